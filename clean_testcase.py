@@ -4,7 +4,10 @@ This script is used to clean one or more test cases that have already been
 setup.
 
 It will remove directories / driver scripts that were generated as part of
-setting up a test case.
+setting up a test case.  These are read from the setup_manifest file that
+setup_testcase.py writes in each test directory, falling back on the config
+XML files for test cases set up before manifests were written.  Removal is
+done with a pool of threads, which unlink the files found by a scandir walk.
 """
 
 from __future__ import absolute_import, division, print_function, \
@@ -12,12 +15,155 @@ from __future__ import absolute_import, division, print_function, \
 
 import sys
 import os
-import shutil
 import fnmatch
 import re
 import argparse
 import subprocess
 import xml.etree.ElementTree as ET
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+
+manifest_name = 'setup_manifest'
+
+
+def get_generated_paths(test_path, work_dir):  # {{{
+    # Returns the top-level paths (case directories and driver scripts) that
+    # setup_testcase.py generated in work_dir for the test in test_path.
+    manifest_path = '{}/{}'.format(work_dir, manifest_name)
+    paths = []
+    if os.path.exists(manifest_path):
+        manifest = open(manifest_path, 'r')
+        for line in manifest:
+            line = line.strip()
+            if line != '':
+                paths.append('{}/{}'.format(work_dir, line))
+        manifest.close()
+        paths.append(manifest_path)
+        return paths
+
+    # Loop over all files in test_path that have the .xml extension.
+    for file in os.listdir('{}'.format(test_path)):
+        if fnmatch.fnmatch(file, '*.xml'):
+            # Build full file name
+            config_file = '{}/{}'.format(test_path, file)
+
+            # Parse file
+            config_tree = ET.parse(config_file)
+            config_root = config_tree.getroot()
+
+            # Process <config> files
+            if config_root.tag == 'config':
+                # Determine the base directory in the case path, to delete
+                case_base = config_root.attrib['case'].split('/')[0]
+                paths.append('{}/{}'.format(work_dir, case_base))
+
+            # Process <driver_script> files
+            elif config_root.tag == 'driver_script':
+                paths.append('{}/{}'.format(work_dir,
+                                            config_root.attrib['name']))
+
+            del config_tree
+            del config_root
+
+    return paths
+# }}}
+
+
+def _collect_tree(path, files, dirs):  # {{{
+    # Walk path without following symlinks, appending files (and links) to
+    # files and directories to dirs in the order they are found.
+    if scandir is None:
+        for root, subdirs, subfiles in os.walk(path):
+            dirs.append(root)
+            for name in subfiles:
+                files.append(os.path.join(root, name))
+            for name in subdirs:
+                if os.path.islink(os.path.join(root, name)):
+                    files.append(os.path.join(root, name))
+            subdirs[:] = [name for name in subdirs if not
+                          os.path.islink(os.path.join(root, name))]
+        return
+
+    dirs.append(path)
+    for entry in scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            _collect_tree(entry.path, files, dirs)
+        else:
+            files.append(entry.path)
+# }}}
+
+
+def _unlink(path):  # {{{
+    # Returns the path and error if the file exists but could not be removed
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if os.path.lexists(path):
+            return path, e.strerror
+    return None
+# }}}
+
+
+def _add_parents(path, parents):  # {{{
+    parent = os.path.dirname(path)
+    while parent not in parents and parent != os.path.dirname(parent):
+        parents.add(parent)
+        parent = os.path.dirname(parent)
+# }}}
+
+
+def remove_paths(paths, threads=8):  # {{{
+    # Removes each of the given files and directory trees, returning the list
+    # of paths that existed and were removed.  Files are unlinked
+    # concurrently by a pool of threads, then directories are removed deepest
+    # first.  Files and directories that could not be removed are reported,
+    # and the directories above them are left in place.
+    removed = []
+    files = []
+    dirs = []
+    for path in paths:
+        if os.path.isdir(path) and not os.path.islink(path):
+            _collect_tree(path, files, dirs)
+            removed.append(path)
+        elif os.path.lexists(path):
+            files.append(path)
+            removed.append(path)
+
+    failures = []
+    if len(files) > 0:
+        pool = ThreadPool(threads)
+        failures = [failure for failure in
+                    pool.map(_unlink, files,
+                             chunksize=max(1, len(files) // (4*threads)))
+                    if failure is not None]
+        pool.close()
+        pool.join()
+
+    # Directories that still contain a file that could not be removed
+    kept = set()
+    for path, error in failures:
+        _add_parents(path, kept)
+
+    # Children are always collected after their parents
+    for path in reversed(dirs):
+        if path in kept:
+            continue
+        try:
+            os.rmdir(path)
+        except OSError as e:
+            failures.append((path, e.strerror))
+            _add_parents(path, kept)
+
+    for path, error in failures:
+        print('ERROR: Could not remove {}: {}'.format(path, error))
+
+    failed = set([path for path, error in failures]) | kept
+    return [path for path in removed if path not in failed]
+# }}}
 
 if __name__ == "__main__":
     # Define and process input arguments
@@ -133,46 +279,10 @@ if __name__ == "__main__":
         # Only write history if we did something...
         write_history = False
 
-        # Loop over all files in test_path that have the .xml extension.
-        for file in os.listdir('{}'.format(test_path)):
-            if fnmatch.fnmatch(file, '*.xml'):
-                # Build full file name
-                config_file = '{}/{}'.format(test_path, file)
-
-                # Parse file
-                config_tree = ET.parse(config_file)
-                config_root = config_tree.getroot()
-
-                # Process <config> files
-                if config_root.tag == 'config':
-                    case_dir = config_root.attrib['case']
-
-                    case_paths = case_dir.split('/')
-                    # Determine the base directory in the case path, to delete
-                    case_base = case_paths[0]
-
-                    # Delete the top level directory that was created, if it
-                    # exists.
-                    if os.path.exists('{}/{}'.format(work_dir, case_base)):
-                        if os.path.isdir('{}/{}'.format(work_dir, case_base)):
-                            shutil.rmtree('{}/{}'.format(work_dir, case_base))
-                            write_history = True
-                            print(' -- Removed case {}/{}'.format(work_dir,
-                                                                  case_base))
-
-                # Process <driver_script> files
-                elif config_root.tag == 'driver_script':
-                    script_name = config_root.attrib['name']
-
-                    # Delete script if it exists
-                    if os.path.exists('{}/{}'.format(work_dir, script_name)):
-                        os.remove('{}/{}'.format(work_dir, script_name))
-                        write_history = True
-                        print(' -- Removed driver script '
-                              '{}/{}'.format(work_dir, script_name))
-
-                del config_tree
-                del config_root
+        # Remove the case directories and driver scripts that were generated
+        for path in remove_paths(get_generated_paths(test_path, work_dir)):
+            write_history = True
+            print(' -- Removed {}'.format(path))
 
     # Write the history of this command to the command_history file, for
     # provenance.
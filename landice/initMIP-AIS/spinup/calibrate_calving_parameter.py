@@ -10,6 +10,7 @@ from netCDF4 import Dataset
 from optparse import OptionParser
 from scipy import interpolate
 
+from mpas_mesh import MpasMesh
 
 
 print "** Gathering information.  (Invoke with --help for more details. All arguments are optional)"
@@ -26,8 +27,6 @@ filein = Dataset(options.fileinName,'r')
 # get needed vars from input
 xCell = filein.variables['xCell'][:]
 yCell = filein.variables['yCell'][:]
-cellsOnCell = filein.variables['cellsOnCell'][:]
-nEdgesOnCell = filein.variables['nEdgesOnCell'][:]
 eMax = filein.variables['eMax'][time,:]
 eMin = filein.variables['eMin'][time,:]
 speed = filein.variables['surfaceSpeed'][time,:]
@@ -35,6 +34,7 @@ cellMask = filein.variables['cellMask'][time,:]
 thickness = filein.variables['thickness'][time,:]
 bedTopography = filein.variables['bedTopography'][time,:]
 nCells = len(filein.dimensions['nCells'])
+mesh = MpasMesh(options.fileinName, varNames=['cellsOnCell'])
 
 
 
@@ -78,17 +78,11 @@ if method == 1:
    print "nCells=", nCells
    print "{} cells left for extrapolation.".format(nCells - np.count_nonzero(filledCells))
    while np.count_nonzero(filledCells) != nCells:
-      filledCellsNew = np.copy(filledCells)
-      searchCells = np.where(filledCells==0)[0]
-      #print "searching:", searchCells
-      for iCell in searchCells:
-         neighbors = cellsOnCell[iCell, :nEdgesOnCell[iCell]]-1
-         goodNeigh = neighbors[np.nonzero(filledCells[neighbors])]
-         if len(goodNeigh>0):
-           K2[iCell] = K2[goodNeigh].mean()
-           #K2[iCell] = 10.0**(np.log10(K2[goodNeigh]).mean())
-           filledCellsNew[iCell] = True
-      filledCells = np.copy(filledCellsNew)  # update mask
+      # mean over the filled neighbors of each unfilled cell
+      (sums, counts) = mesh.neighbor_sum(K2, filledCells)
+      searchCells = np.logical_and(filledCells==0, counts>0)
+      K2[searchCells] = sums[searchCells]/counts[searchCells]
+      filledCells = np.logical_or(filledCells, searchCells)  # update mask
       print "{} cells left for extrapolation.".format(nCells - np.count_nonzero(filledCells))
 
 
@@ -142,31 +136,17 @@ print "Adding buffer increase"
 filledCells = (thickness>0.0)
 print "{} cells left for buffer increase.".format(nCells - np.count_nonzero(filledCells))
 while np.count_nonzero(filledCells) != nCells:
-   filledCellsNew = np.copy(filledCells)
-   searchCells = np.where(filledCells==0)[0]
-   #print "searching:", searchCells
-   for iCell in searchCells:
-      neighbors = cellsOnCell[iCell, :nEdgesOnCell[iCell]]-1
-      goodNeigh = neighbors[np.nonzero(filledCells[neighbors])]
-      if len(goodNeigh>0):
-        K2[iCell] = K2[goodNeigh].mean() * 1.01   # increase K in each layer beyond the initial ice by this factor
-        filledCellsNew[iCell] = True
-   filledCells = np.copy(filledCellsNew)  # update mask
+   (sums, counts) = mesh.neighbor_sum(K2, filledCells)
+   searchCells = np.logical_and(filledCells==0, counts>0)
+   K2[searchCells] = sums[searchCells]/counts[searchCells] * 1.01   # increase K in each layer beyond the initial ice by this factor
+   filledCells = np.logical_or(filledCells, searchCells)  # update mask
    print "{} cells left for buffer increase.".format(nCells - np.count_nonzero(filledCells))
 
 
 # add huge values at edge of mesh (two rows)
-filledCells = filledCells*0
-for iCell in range(nCells):
-   if cellsOnCell[iCell, :nEdgesOnCell[iCell]].min() == 0:
-      filledCells[iCell] = 1
-      K2[iCell] = 1.0e17
-searchCells = np.where(filledCells==0)[0]
-for iCell in searchCells:
-      neighbors = cellsOnCell[iCell, :nEdgesOnCell[iCell]]-1
-      goodNeigh = neighbors[np.nonzero(filledCells[neighbors])]
-      if len(goodNeigh>0):
-         K2[iCell] = 1.0e17
+filledCells = mesh.boundary_cells()
+K2[filledCells] = 1.0e17
+K2[mesh.neighbor_any(filledCells)] = 1.0e17
 
 #indGood = np.where(calvMask == 0)[0]
 #myInterp = interpolate.LinearNDInterpolator(np.stack((xCell[indGood], yCell[indGood])).T, K2[indGood])
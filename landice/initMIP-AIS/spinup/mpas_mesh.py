@@ -0,0 +1 @@
+../../../utility_scripts/mpas_mesh.py
\ No newline at end of file
@@ -22,6 +22,8 @@ import argparse
 import xml.etree.ElementTree as ET
 import subprocess
 
+from clean_testcase import get_generated_paths, remove_paths
+
 
 def process_test_setup(test_tag, config_file, work_dir, model_runtime,
                        suite_script, baseline_dir, verbose):  # {{{
@@ -147,8 +149,9 @@ def process_test_setup(test_tag, config_file, work_dir, model_runtime,
 # }}}
 
 
-def process_test_clean(test_tag, work_dir, suite_script):  # {{{
-    dev_null = open('/dev/null', 'a')
+def process_test_clean(test_tag, work_dir):  # {{{
+    # Returns the paths generated when the test was set up, which are
+    # removed together for the whole suite by clean_suite
 
     # Process test attributes
     try:
@@ -190,16 +193,13 @@ def process_test_clean(test_tag, work_dir, suite_script):  # {{{
         print("Exiting...")
         sys.exit(1)
 
-    # Clean test case
-    subprocess.check_call(
-        ['./clean_testcase.py', '-q', '--work_dir', work_dir, '-o', test_core,
-         '-c',  test_configuration, '-r', test_resolution, '-t', test_test],
-        stdout=dev_null, stderr=dev_null)
+    test_path = '{}/{}/{}/{}'.format(test_core, test_configuration,
+                                     test_resolution, test_test)
 
-    print("   -- Cleaned case '{}': -o {} -c {} -r {} -t {}".format(
+    print("   -- Cleaning case '{}': -o {} -c {} -r {} -t {}".format(
         test_name, test_core, test_configuration, test_resolution, test_test))
 
-    dev_null.close()
+    return get_generated_paths(test_path, '{}/{}'.format(work_dir, test_path))
 
 # }}}
 
@@ -301,10 +301,14 @@ def clean_suite(suite_tag, work_dir):  # {{{
     if os.path.exists(regression_script):
         os.remove(regression_script)
 
+    # Gather the generated paths of all tests and remove them at once
+    paths = []
     for child in suite_tag:
         # Process <test> children within the <regression_suite>
         if child.tag == 'test':
-            process_test_clean(child, work_dir, regression_script)
+            paths.extend(process_test_clean(child, work_dir))
+
+    remove_paths(paths)
 # }}}
 
 
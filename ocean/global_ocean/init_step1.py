@@ -20,11 +20,23 @@ Also, the optional --with_cavities flag indicates that ice-shelf cavities
 are present and the grounded-ice mask from Bedmap2 should be used.
 The optional --with_critical_passages flag indicates that critical
 passages are to be opened. Otherwise, steps 2, 5 and 9 are skipped
+
+The steps are declared as a graph of dependencies and steps that do not depend
+on each other (e.g. the land and critical-passages masks) are run
+concurrently, with at most --nprocs at a time.  The geojson files from steps
+1-3 only depend on geometric_features, so they are cached in a subfolder of
+--cache_dir (by default $GEOMETRIC_FEATURES_CACHE or
+~/.cache/compass/geometric_features) named by the git revision of
+geometric_features and shared between meshes and test cases.  Caching is
+skipped if geometric_features is not a git repository or has local changes, or
+if --no_cache is given.
 """
 import os
 import os.path
 import subprocess
+import time
 from optparse import OptionParser
+from multiprocessing.pool import ThreadPool
 
 
 def removeFile(fileName):
@@ -33,6 +45,112 @@ def removeFile(fileName):
     except OSError:
         pass
 
+
+class Step(object):
+    """
+    A step in the graph: a list of commands run in sequence once all the steps
+    it depends on are done.  If cacheFile is given, the commands write
+    outFile, which is then moved to cacheFile, and the commands are skipped if
+    cacheFile already exists.  Either way, linkName is made a link to the
+    cached file.
+    """
+    def __init__(self, name, commands, dependencies=[], outFile=None,
+                 cacheFile=None, linkName=None):
+        self.name = name
+        self.commands = commands
+        self.dependencies = dependencies
+        self.outFile = outFile
+        self.cacheFile = cacheFile
+        self.linkName = linkName
+
+
+def runStep(step):
+    if step.cacheFile is not None and os.path.exists(step.cacheFile):
+        print "using cached", step.cacheFile
+    else:
+        if step.outFile is not None:
+            removeFile(step.outFile)
+        try:
+            for args in step.commands:
+                print "running", ' '.join(args)
+                subprocess.check_call(args, env=os.environ.copy())
+        except:
+            # don't leave a partial temporary file in the shared cache
+            if step.cacheFile is not None:
+                removeFile(step.outFile)
+            raise
+        if step.cacheFile is not None:
+            # rename is atomic, so other test cases sharing the cache never
+            # see a partial file
+            os.rename(step.outFile, step.cacheFile)
+    if step.linkName is not None:
+        removeFile(step.linkName)
+        os.symlink(os.path.abspath(step.cacheFile), step.linkName)
+    return step.name
+
+
+def runSteps(steps, nProcs):
+    # run each step once all of its dependencies are done, with up to nProcs
+    # steps at a time
+    pending = list(steps)
+    running = {}
+    done = set()
+    pool = ThreadPool(nProcs)
+    while len(pending) > 0 or len(running) > 0:
+        for step in list(pending):
+            if all([name in done for name in step.dependencies]):
+                running[step.name] = pool.apply_async(runStep, (step,))
+                pending.remove(step)
+        if len(running) == 0:
+            raise ValueError('steps {} have unmet dependencies'.format(
+                [step.name for step in pending]))
+        finished = [name for name in running if running[name].ready()]
+        if len(finished) == 0:
+            time.sleep(0.1)
+            continue
+        for name in finished:
+            # raises an exception if any of the step's commands failed
+            running.pop(name).get()
+            done.add(name)
+    pool.close()
+    pool.join()
+
+
+def getCacheFolder(path, cacheDir):
+    # a folder for cached geojson files named by the git revision of
+    # geometric_features, or None if the revision can't be determined or there
+    # are local changes
+    try:
+        revision = subprocess.check_output(['git', '-C', path, 'rev-parse',
+                                            'HEAD']).strip()
+        changes = subprocess.check_output(['git', '-C', path, 'status',
+                                           '--porcelain', '--untracked-files=no'
+                                           ]).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    if changes != '':
+        return None
+    cacheFolder = '{}/{}'.format(cacheDir, revision)
+    try:
+        os.makedirs(cacheFolder)
+    except OSError:
+        pass
+    return cacheFolder
+
+
+def geojsonStep(name, commands, fileName, cacheName):
+    # a step whose commands produce the geojson file fileName, which is cached
+    # as cacheName if there is a cache folder
+    if cacheFolder is None:
+        return Step(name, commands, outFile=fileName)
+    cacheFile = '{}/{}'.format(cacheFolder, cacheName)
+    outFile = '{}.{}.tmp'.format(cacheFile, os.getpid())
+    commands = [[outFile if arg == fileName else arg for arg in args]
+                for args in commands]
+    return Step(name, commands, outFile=outFile, cacheFile=cacheFile,
+                linkName=fileName)
+
+
 parser = OptionParser()
 parser.add_option("--with_cavities", action="store_true", dest="with_cavities")
 parser.add_option("--with_critical_passages", action="store_true",
@@ -40,120 +158,146 @@ parser.add_option("--with_critical_passages", action="store_true",
 parser.add_option("-p", "--geom_feat_path", type="string", dest="path",
                   default="geometric_features",
                   help="Path to the geometric_features repository.")
+parser.add_option("--cache_dir", type="string", dest="cache_dir",
+                  help="Folder for cached geojson files (default: "
+                  "$GEOMETRIC_FEATURES_CACHE or "
+                  "~/.cache/compass/geometric_features).")
+parser.add_option("--no_cache", action="store_true", dest="no_cache",
+                  help="Don't use or write cached geojson files.")
+parser.add_option("-j", "--nprocs", type="int", dest="nprocs", default=3,
+                  help="The maximum number of steps to run at once.")
 options, args = parser.parse_args()
 
 path = options.path
 
+# the cache is kept outside the geometric_features repository, which is often
+# shared or read-only
+if options.cache_dir is None:
+    cacheDir = os.environ.get(
+        'GEOMETRIC_FEATURES_CACHE',
+        os.path.expanduser('~/.cache/compass/geometric_features'))
+else:
+    cacheDir = options.cache_dir
+
+if options.no_cache:
+    cacheFolder = None
+else:
+    cacheFolder = getCacheFolder(path, cacheDir)
+
 landCoverage = '{}/natural_earth/region/Land_Coverage/' \
     'region.geojson'.format(path)
 
 landCoverageMask = '{}/ocean/region/Global_Ocean_90S_to_60S/' \
     'region.geojson'.format(path)
 
-removeFile('land_coverage.geojson')
-
-# mask the land coverage to exclude the region below 60S
-args = ['{}/difference_features.py'.format(path),
-        '-f', landCoverage,
-        '-m', landCoverageMask,
-        '-o', 'land_coverage.geojson']
-print "running", ' '.join(args)
-subprocess.check_call(args, env=os.environ.copy())
-
 # add the appropriate land coverage below 60S (either all ice or grounded ice)
 if options.with_cavities:
     antarcticLandCoverage = '{}/bedmap2/region/AntarcticGroundedIceCoverage/' \
         'region.geojson'.format(path)
+    landCoverageCache = 'land_coverage_with_cavities.geojson'
 else:
     antarcticLandCoverage = '{}/bedmap2/region/AntarcticIceCoverage/' \
         'region.geojson'.format(path)
+    landCoverageCache = 'land_coverage_without_cavities.geojson'
 
-args = ['{}/merge_features.py'.format(path), '-f', antarcticLandCoverage,
-        '-o', 'land_coverage.geojson']
-print "running", ' '.join(args)
-subprocess.check_call(args, env=os.environ.copy())
+steps = []
 
-# create the land mask based on the land coverage
-# Run command is:
-# ./MpasMaskCreator.x  base_mesh.nc land_mask.nc -f land_coverage.geojson
-args = ['./MpasMaskCreator.x', 'base_mesh.nc', 'land_mask.nc',
-        '-f', 'land_coverage.geojson']
-print "running", ' '.join(args)
-subprocess.check_call(args, env=os.environ.copy())
+# mask the land coverage to exclude the region below 60S, then add the land
+# coverage below 60S
+steps.append(geojsonStep(
+    'land_coverage',
+    [['{}/difference_features.py'.format(path),
+      '-f', landCoverage,
+      '-m', landCoverageMask,
+      '-o', 'land_coverage.geojson'],
+     ['{}/merge_features.py'.format(path), '-f', antarcticLandCoverage,
+      '-o', 'land_coverage.geojson']],
+    'land_coverage.geojson', landCoverageCache))
 
 # create seed points for a flood fill of the ocean
 # use all points in the ocean directory, on the assumption that they are, in
 # fact, in the ocean
-removeFile('seed_points.geojson')
-args = ['{}/merge_features.py'.format(path),
-        '-d', '{}/ocean/point'.format(path),
-        '-t', 'seed_point',
-        '-o', 'seed_points.geojson']
-print "running", ' '.join(args)
-subprocess.check_call(args, env=os.environ.copy())
+steps.append(geojsonStep(
+    'seed_points',
+    [['{}/merge_features.py'.format(path),
+      '-d', '{}/ocean/point'.format(path),
+      '-t', 'seed_point',
+      '-o', 'seed_points.geojson']],
+    'seed_points.geojson', 'seed_points.geojson'))
+
+# create the land mask based on the land coverage
+# Run command is:
+# ./MpasMaskCreator.x  base_mesh.nc land_mask.nc -f land_coverage.geojson
+steps.append(Step('land_mask',
+                  [['./MpasMaskCreator.x', 'base_mesh.nc', 'land_mask.nc',
+                    '-f', 'land_coverage.geojson']],
+                  ['land_coverage']))
 
 if options.with_critical_passages:
     # merge transects for critical passages into critical_passages.geojson
-    removeFile('critical_passages.geojson')
-    args = ['{}/merge_features.py'.format(path),
-            '-d', '{}/ocean/transect'.format(path),
-            '-t', 'Critical_Passage',
-            '-o', 'critical_passages.geojson']
-    print "running", ' '.join(args)
-    subprocess.check_call(args, env=os.environ.copy())
+    steps.append(geojsonStep(
+        'critical_passages',
+        [['{}/merge_features.py'.format(path),
+          '-d', '{}/ocean/transect'.format(path),
+          '-t', 'Critical_Passage',
+          '-o', 'critical_passages.geojson']],
+        'critical_passages.geojson', 'critical_passages.geojson'))
 
     # create masks from the transects
     # Run command is:
     # ./MpasMaskCreator.x  base_mesh.nc critical_passages_mask.nc
     # -f critical_passages.geojson
-    args = ['./MpasMaskCreator.x', 'base_mesh.nc', 'critical_passages_mask.nc',
-            '-f', 'critical_passages.geojson']
-    print "running", ' '.join(args)
-    subprocess.check_call(args, env=os.environ.copy())
+    steps.append(Step('critical_passages_mask',
+                      [['./MpasMaskCreator.x', 'base_mesh.nc',
+                        'critical_passages_mask.nc',
+                        '-f', 'critical_passages.geojson']],
+                      ['critical_passages']))
 
     # cull the mesh based on the land mask and keeping critical passages open
     # Run command is:
     # ./MpasCellCuller.x  base_mesh.nc culled_mesh.nc -m land_mask.nc
     # -p critical_passages_mask.nc
-    args = ['./MpasCellCuller.x', 'base_mesh.nc', 'culled_mesh.nc',
-            '-m', 'land_mask.nc', '-p', 'critical_passages_mask.nc']
-    print "running", ' '.join(args)
-    subprocess.check_call(args, env=os.environ.copy())
+    steps.append(Step('culled_mesh',
+                      [['./MpasCellCuller.x', 'base_mesh.nc', 'culled_mesh.nc',
+                        '-m', 'land_mask.nc',
+                        '-p', 'critical_passages_mask.nc']],
+                      ['land_mask', 'critical_passages_mask']))
 else:
 
     # cull the mesh based on the land mask
     # Run command is:
     # ./MpasCellCuller.x  base_mesh.nc culled_mesh.nc -m land_mask.nc
-    args = ['./MpasCellCuller.x', 'base_mesh.nc', 'culled_mesh.nc',
-            '-m', 'land_mask.nc']
-    print "running", ' '.join(args)
-    subprocess.check_call(args, env=os.environ.copy())
+    steps.append(Step('culled_mesh',
+                      [['./MpasCellCuller.x', 'base_mesh.nc', 'culled_mesh.nc',
+                        '-m', 'land_mask.nc']],
+                      ['land_mask']))
 
 # create a mask for the flood fill seed points
 # Run command is:
 # ./MpasMaskCreator.x  culled_mesh.nc seed_mask.nc -s seed_points.geojson
-args = ['./MpasMaskCreator.x', 'culled_mesh.nc', 'seed_mask.nc',
-        '-s', 'seed_points.geojson']
-print "running", ' '.join(args)
-subprocess.check_call(args, env=os.environ.copy())
+steps.append(Step('seed_mask',
+                  [['./MpasMaskCreator.x', 'culled_mesh.nc', 'seed_mask.nc',
+                    '-s', 'seed_points.geojson']],
+                  ['culled_mesh', 'seed_points']))
 
 
 # cull the mesh a second time using a flood fill from the seed points
 # Run command is:
 # ./MpasCellCuller.x  culled_mesh.nc culled_mesh_final.nc -i seed_mask.nc
-args = ['./MpasCellCuller.x', 'culled_mesh.nc', 'culled_mesh_final.nc',
-        '-i', 'seed_mask.nc']
-
-print "running", ' '.join(args)
-subprocess.check_call(args, env=os.environ.copy())
+steps.append(Step('culled_mesh_final',
+                  [['./MpasCellCuller.x', 'culled_mesh.nc',
+                    'culled_mesh_final.nc', '-i', 'seed_mask.nc']],
+                  ['seed_mask']))
 
 if options.with_critical_passages:
     # make a new version of the critical passages mask on the culled mesh
     # Run command is:
     # ./MpasMaskCreator.x  culled_mesh_final.nc critical_passages_mask_final.nc
     # -f critical_passages.geojson
-    args = ['./MpasMaskCreator.x', 'culled_mesh_final.nc',
-            'critical_passages_mask_final.nc',
-            '-f', 'critical_passages.geojson']
-    print "running", ' '.join(args)
-    subprocess.check_call(args, env=os.environ.copy())
+    steps.append(Step('critical_passages_mask_final',
+                      [['./MpasMaskCreator.x', 'culled_mesh_final.nc',
+                        'critical_passages_mask_final.nc',
+                        '-f', 'critical_passages.geojson']],
+                      ['culled_mesh_final', 'critical_passages']))
+
+runSteps(steps, options.nprocs)
@@ -3,10 +3,39 @@ import numpy
 from netCDF4 import Dataset
 from optparse import OptionParser
 import os
+import time
 
-def smoothGeometry(landFraction, floatingFraction, bed, draft, filterSigma):
+def gaussianFilter(field, filterSigma, tileSize=None):
+  # A Gaussian filter with zero values outside the domain.  If tileSize is
+  # given, the filter is applied to one tile (plus a halo as wide as the
+  # filter) at a time so the temporary arrays stay small.  The result is the
+  # same as filtering the whole field at once.
   import scipy.ndimage.filters as filters
 
+  if tileSize is None:
+    return filters.gaussian_filter(field,filterSigma,mode='constant',cval=0.)
+
+  # the default truncation of scipy's gaussian_filter is 4 sigma
+  halo = int(4.0*filterSigma + 0.5)
+  (ny,nx) = field.shape
+  result = numpy.zeros(field.shape, field.dtype)
+  for yStart in range(0,ny,tileSize):
+    yEnd = min(yStart+tileSize,ny)
+    yHaloStart = max(yStart-halo,0)
+    yHaloEnd = min(yEnd+halo,ny)
+    for xStart in range(0,nx,tileSize):
+      xEnd = min(xStart+tileSize,nx)
+      xHaloStart = max(xStart-halo,0)
+      xHaloEnd = min(xEnd+halo,nx)
+      tile = filters.gaussian_filter(field[yHaloStart:yHaloEnd,xHaloStart:xHaloEnd],
+                                     filterSigma,mode='constant',cval=0.)
+      result[yStart:yEnd,xStart:xEnd] = tile[yStart-yHaloStart:yEnd-yHaloStart,
+                                             xStart-xHaloStart:xEnd-xHaloStart]
+  return result
+
+def smoothGeometry(landFraction, floatingFraction, bed, draft, filterSigma,
+                   tileSize=None):
+
   # Smoothing is performed using only the topography in the portion of the grid that is ocean.
   # This prevents the kink in the ice draft across the grounding line or regions of bare bedrock
   # from influencing the smoothed topography.  (Parts of the Ross ice shelf near the Trans-Antarctic
@@ -18,43 +47,91 @@ def smoothGeometry(landFraction, floatingFraction, bed, draft, filterSigma):
   threshold = 0.01 # we won't normalize bed topography or ice draft where the mask is below this threshold
 
   oceanFraction = 1. - landFraction
-  smoothedMask = filters.gaussian_filter(oceanFraction,filterSigma,mode='constant',cval=0.)
+  smoothedMask = gaussianFilter(oceanFraction,filterSigma,tileSize)
   mask = smoothedMask > threshold
 
-  draft = filters.gaussian_filter(draft*oceanFraction,filterSigma,mode='constant',cval=0.)
+  draft = gaussianFilter(draft*oceanFraction,filterSigma,tileSize)
   draft[mask] /= smoothedMask[mask]
-  bed = filters.gaussian_filter(bed*oceanFraction,filterSigma,mode='constant',cval=0.)
+  bed = gaussianFilter(bed*oceanFraction,filterSigma,tileSize)
   bed[mask] /= smoothedMask[mask]
 
-  smoothedDraftMask = filters.gaussian_filter(floatingFraction,filterSigma,mode='constant',cval=0.)
+  smoothedDraftMask = gaussianFilter(floatingFraction,filterSigma,tileSize)
   smoothedDraftMask[mask] /= smoothedMask[mask]
 
   return (bed,draft,smoothedDraftMask)
 
+def benchmark(filterSigma, resolution=500., tileSize=512):
+  # time the smoothing of a synthetic geometry on the ISOMIP+ domain (from x0
+  # to xMax and 80 km wide) at the given resolution, with and without tiles
+  nx = int((xMax-x0)/resolution)+2*buffer
+  ny = int(80e3/resolution)+2*buffer
+  (X,Y) = numpy.meshgrid(x0 + resolution*numpy.arange(nx),
+                         resolution*numpy.arange(ny))
+  groundedMask = numpy.array(X < 400e3 + 20e3*numpy.cos(2*numpy.pi*Y/80e3), float)
+  floatingMask = numpy.array(numpy.logical_and(groundedMask == 0., X < 640e3), float)
+  bed = -500. - 200.*numpy.sin(2*numpy.pi*X/100e3)*numpy.cos(2*numpy.pi*Y/80e3)
+  draft = -100. - 500.*floatingMask*(640e3-X)/240e3
+
+  print 'benchmark: %i x %i grid at %g m resolution'%(nx, ny, resolution)
+  startTime = time.time()
+  full = smoothGeometry(groundedMask, floatingMask, bed, draft, filterSigma)
+  print '  whole field: %g s'%(time.time()-startTime)
+  startTime = time.time()
+  tiled = smoothGeometry(groundedMask, floatingMask, bed, draft, filterSigma,
+                         tileSize)
+  print '  tile size %s: %g s'%(tileSize, time.time()-startTime)
+  print '  max difference: %g'%max([numpy.amax(numpy.abs(full[index]-tiled[index]))
+                                    for index in range(3)])
+
 def readVar(varName, defaultValue=0.0):
   field = defaultValue*numpy.ones((ny,nx),float)
-  field[buffer:-buffer,buffer:-buffer] = numpy.array(inFile.variables[varName])[:,minIndex:]
+  # only read the part of the input that is used
+  field[buffer:-buffer,buffer:-buffer] = inFile.variables[varName][:,minIndex:]
   return field
 
 def writeVar(outVarName, inVarName, field):
-  outVar = outFile.createVariable(outVarName,'f8',('y','x'))
+  outVar = outFile.createVariable(outVarName,fieldType,('y','x'),
+                                  zlib=(options.complevel > 0),
+                                  complevel=max(options.complevel,1),
+                                  chunksizes=chunkSizes)
   inVar = inFile.variables[inVarName]
   outVar[:,:] = field
   outVar.setncatts({k: inVar.getncattr(k) for k in inVar.ncattrs()})
 
-parser = OptionParser()
+parser = OptionParser(usage='usage: %prog [options] inFileName outFileName filterSigma minIceThickness\n'
+                            '       %prog --benchmark [options] filterSigma')
+parser.add_option("--float32", action="store_true", dest="float32",
+                  help="Write the geometry fields as 32-bit rather than 64-bit floats")
+parser.add_option("--complevel", type="int", dest="complevel", default=4,
+                  help="The zlib compression level of the output (0 for no compression)")
+parser.add_option("--chunk_size", type="int", dest="chunk_size", default=256,
+                  help="The size of the (square) chunks of the output fields")
+parser.add_option("--tile_size", type="int", dest="tile_size", default=512,
+                  help="The size of the (square) tiles used for smoothing (0 to smooth whole fields)")
+parser.add_option("--benchmark", action="store_true", dest="benchmark",
+                  help="Time the smoothing of a synthetic 500 m geometry instead of processing a file")
 
 options, args = parser.parse_args()
-inFileName=args[0]
-outFileName=args[1]
-filterSigma=float(args[2])
-minIceThickness=float(args[3])
 
 buffer = 1
 
 xMax = 800e3 #km
 x0 = 320e3 #km
 
+if options.tile_size > 0:
+  tileSize = options.tile_size
+else:
+  tileSize = None
+
+if options.benchmark:
+  benchmark(float(args[0]), tileSize=tileSize)
+  exit(0)
+
+inFileName=args[0]
+outFileName=args[1]
+filterSigma=float(args[2])
+minIceThickness=float(args[3])
+
 densityRatio = 918./1028.
   
 inFile = Dataset(inFileName,'r')
@@ -93,7 +170,14 @@ draft[mask] = 0.
 floatingMask[mask] = 0.
 openOceanMask[mask] = 1. - groundedMask[mask]
 
-(bed,draft,smoothedDraftMask) = smoothGeometry(groundedMask, floatingMask, bed, draft, filterSigma)
+(bed,draft,smoothedDraftMask) = smoothGeometry(groundedMask, floatingMask, bed, draft, filterSigma,
+                                                tileSize)
+
+if options.float32:
+  fieldType = 'f4'
+else:
+  fieldType = 'f8'
+chunkSizes = (min(options.chunk_size,ny), min(options.chunk_size,nx))
 
 outFile = Dataset(outFileName,'w', format='NETCDF4')
 outFile.createDimension('x', nx)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+Runs the GammaT parameter study set up by setup_Ocean0_param_study.py.
+
+This script is run from the set-up Ocean0 test directory, which contains the
+forward_GammaT_* case of each member along with the init_step1, init_step2
+and adjust_ssh cases.  The members all link to the initial condition from
+these shared cases, so the shared cases are run once (and skipped if they
+have already completed, see utility_scripts/run_stages.py).  The members are
+then run concurrently, as many at a time as fit in the core budget (--cores)
+given the number of MPI tasks of each member.  Members that have already
+completed are skipped.
+
+Finally, the land-ice fluxes of all members are reduced to time series of
+melt flux, thermal driving and friction velocity, which are written to one
+combined file that can be plotted with
+viz/plotMeltFluxes.py --combined_file meltFluxes_GammaT.nc
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import xml.etree.ElementTree as ET
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+
+scriptDir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append('%s/viz'%scriptDir)
+sys.path.append('%s/../../utility_scripts'%scriptDir)
+
+from meltFluxes import reduceMember, writeCombinedMeltFluxes
+from run_stages import run_stages, is_complete, describe_outputs, \
+    write_marker, remove_marker
+
+
+def read_members(manifestFileName):
+    # the case name, parameter values and number of MPI tasks of each member
+    # in the manifest written by make_parameter_study_configs.py
+    manifestFile = open(manifestFileName, 'r')
+    manifest = json.load(manifestFile)
+    manifestFile.close()
+    members = []
+    for member in manifest['members']:
+        configFileName = member['config']
+        if not os.path.isabs(configFileName):
+            configFileName = '%s/%s'%(scriptDir, configFileName)
+        configRoot = ET.parse(configFileName).getroot()
+        procs = 1
+        for modelRun in configRoot.iter('model_run'):
+            procs = max(procs, int(modelRun.attrib['procs']))
+        members.append({'case': configRoot.attrib['case'],
+                        'parameters': member['parameters'],
+                        'procs': procs})
+    return manifest['parameters'], members
+
+
+def run_member(member):
+    # run one member unless it has already completed, returning its case
+    # name and whether it succeeded
+    case = member['case']
+    if is_complete(case, ['*.nc'], False):
+        print ' * Skipping %s (already complete)'%case
+        return case, True
+    remove_marker(case)
+    print ' * Running %s on %i cores'%(case, member['procs'])
+    logFile = open('%s/run_member.log'%case, 'w')
+    status = subprocess.call(['./run.py'], cwd=case, stdout=logFile,
+                             stderr=logFile)
+    logFile.close()
+    if status != 0:
+        print '   %s failed, see %s/run_member.log'%(case, case)
+        return case, False
+    write_marker(case, {'outputs': describe_outputs(case, ['*.nc'])})
+    print '   - %s complete'%case
+    return case, True
+
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+parser.add_argument("--manifest", dest="manifest", default='%s/2km/Ocean0/config_GammaT_manifest.json'%scriptDir, help="The manifest of the parameter study written by setup_Ocean0_param_study.py")
+parser.add_argument("--cores", dest="cores", type=int, default=cpu_count(), help="The number of cores available for running members at once (default: the number of cores on this node)")
+parser.add_argument("--shared_stages", dest="shared_stages", nargs="+", default=['init_step1', 'init_step2', 'adjust_ssh'], help="The cases shared by all members, run once in order before the members")
+parser.add_argument("--combined_file", dest="combined_file", help="The file to write the combined melt fluxes to (default meltFluxes_<parameter>.nc)")
+parser.add_argument("--in_file", dest="in_file", default='land_ice_fluxes.nc', help="The land-ice flux file of each member")
+parser.add_argument("--ssh_max", dest="ssh_max", type=float, default=0., help="Only cells with SSH below this value are included in the melt fluxes")
+parser.add_argument("--nprocs", dest="nprocs", type=int, default=cpu_count(), help="The number of members to reduce at once")
+
+args = parser.parse_args()
+
+(paramNames, members) = read_members(args.manifest)
+paramName = paramNames[0]
+
+if not run_stages(args.shared_stages):
+    sys.exit(1)
+
+# as many members at once as fit in the core budget
+memberProcs = max([member['procs'] for member in members])
+nSlots = max(1, min(len(members), args.cores//memberProcs))
+print 'running %i members, %i at a time'%(len(members), nSlots)
+
+pool = ThreadPool(nSlots)
+failed = [case for (case, success) in pool.imap_unordered(run_member, members)
+          if not success]
+pool.close()
+pool.join()
+
+if len(failed) > 0:
+    print 'Error: members %s failed'%', '.join(failed)
+
+# combine the melt fluxes of the members that have output
+paramValues = []
+tasks = []
+for member in members:
+    inFileName = '%s/%s'%(member['case'], args.in_file)
+    if member['case'] in failed or not os.path.exists(inFileName):
+        continue
+    paramValues.append(member['parameters'][paramName])
+    tasks.append((inFileName, args.ssh_max, 100))
+
+if len(tasks) > 0:
+    if args.combined_file is None:
+        args.combined_file = 'meltFluxes_%s.nc'%paramName
+    reducePool = Pool(max(1, min(args.nprocs, len(tasks))))
+    results = reducePool.map(reduceMember, tasks)
+    reducePool.close()
+    reducePool.join()
+    writeCombinedMeltFluxes(args.combined_file, paramName, paramValues,
+                            results)
+    print 'wrote melt fluxes of %i members to %s'%(len(tasks),
+                                                   args.combined_file)
+
+if len(failed) > 0:
+    sys.exit(1)
+sys.exit(0)
@@ -9,6 +9,9 @@ import os.path
 
 import subprocess
 
+from windowedReduction import getTimeWindow, windowedAreaIntegrals, \
+    writeFields
+
 parser = OptionParser()
 
 parser.add_option("--in_fluxes_file", type="string", default="land_ice_fluxes.nc", dest="in_fluxes_file")
@@ -16,24 +19,19 @@ parser.add_option("--in_forcing_file", type="string", default="forcing_data_init
 parser.add_option("--out_forcing_file", type="string", default="forcing_data_updated.nc", dest="out_forcing_file")
 parser.add_option("--out_forcing_link", type="string", default="forcing_data.nc", dest="out_forcing_link")
 parser.add_option("--avg_years", type="float", default=0.25, dest="avg_years")
+parser.add_option("--chunk_size", type="int", default=100, dest="chunk_size",
+                  help="The maximum number of time levels to read at once")
 
 options, args = parser.parse_args()
 
-subprocess.check_call(['cp', options.in_forcing_file, options.out_forcing_file])
-subprocess.check_call(['ln', '-sfn', options.out_forcing_file, options.out_forcing_link])
-
 inFile = Dataset(options.in_fluxes_file,'r')
-outFile = Dataset(options.out_forcing_file,'r+')
+forcingFile = Dataset(options.in_forcing_file,'r')
 
 areaCell = inFile.variables['areaCell'][:]
-times = inFile.variables['daysSinceStartOfSim'][:]/365.
-
-nCells = len(inFile.dimensions['nCells'])
-nTime = len(inFile.dimensions['Time'])
 
-tIndices = numpy.nonzero(times >= times[-1]-options.avg_years)[0]
+(start, stop) = getTimeWindow(inFile, options.avg_years)
 
-print len(tIndices)
+print stop-start
 
 rho_sw = 1026.
 cp_sw = 3.996e3
@@ -45,16 +43,10 @@ hflux_factor = 1.0/(rho_sw*cp_sw)
 Tsurf = -1.9
 Ssurf = 33.8
 
-meanMeltFlux = 0.0
-meanIceArea = 0.0
-for tIndex in tIndices:
-  freshwaterFlux = inFile.variables['landIceFreshwaterFlux'][tIndex,:]
-  fraction = inFile.variables['landIceFraction'][tIndex,:]
-  meanMeltFlux += numpy.sum(freshwaterFlux*areaCell)
-  meanIceArea += numpy.sum(fraction*areaCell)
-
-meanMeltFlux /= len(tIndices)
-meanIceArea /= len(tIndices)
+integrals = windowedAreaIntegrals(inFile, ['landIceFreshwaterFlux', 'landIceFraction'],
+                                  areaCell, start, stop, options.chunk_size)
+meanMeltFlux = integrals['landIceFreshwaterFlux']
+meanIceArea = integrals['landIceFraction']
 
 # convert to volume flux in m^3/s
 meanMeltFlux /= rho_sw
@@ -67,12 +59,11 @@ area = numpy.sum(areaCell)
 meanSeaLevelRiseRate = meanMeltFlux*secPerYear/area
 print 'mean rate of sea-level change:', meanSeaLevelRiseRate, 'm/yr'
 
-evaporationFluxVar = outFile.variables['evaporationFlux']
-seaIceSalinityFluxVar = outFile.variables['seaIceSalinityFlux']
-seaIceHeatFluxVar = outFile.variables['seaIceHeatFlux']
-evaporationFlux = evaporationFluxVar[0,:]
+evaporationFlux = numpy.array(forcingFile.variables['evaporationFlux'][:])
+seaIceSalinityFlux = numpy.array(forcingFile.variables['seaIceSalinityFlux'][:])
+seaIceHeatFlux = numpy.array(forcingFile.variables['seaIceHeatFlux'][:])
 
-evapMask = evaporationFlux != 0.
+evapMask = evaporationFlux[0,:] != 0.
 
 evapArea = numpy.sum(areaCell*evapMask)
 
@@ -80,16 +71,19 @@ evapRate = -meanMeltFlux/evapArea
 
 print 'evaporation rate:', evapRate*secPerYear, 'm/yr'
 
-evaporationFlux[evapMask] = evapRate*rho_sw
-evaporationFluxVar[0,:] = evaporationFlux
-
-flux = seaIceSalinityFluxVar[0,:]
-flux[evapMask] = evapRate*Ssurf/sflux_factor
-seaIceSalinityFluxVar[0,:] = flux
-
-flux = seaIceHeatFluxVar[0,:]
-flux[evapMask] = evapRate*Tsurf/hflux_factor
-seaIceHeatFluxVar[0,:] = flux
+evaporationFlux[0,evapMask] = evapRate*rho_sw
+seaIceSalinityFlux[0,evapMask] = evapRate*Ssurf/sflux_factor
+seaIceHeatFlux[0,evapMask] = evapRate*Tsurf/hflux_factor
+
+# write only the updated fields (with xtime and the global attributes of the
+# original file); the model reads the rest of the forcing from the original
+# forcing file
+writeFields(options.out_forcing_file, forcingFile,
+            {'evaporationFlux': evaporationFlux,
+             'seaIceSalinityFlux': seaIceSalinityFlux,
+             'seaIceHeatFlux': seaIceHeatFlux},
+            copyVarNames=['xtime'])
+subprocess.check_call(['ln', '-sfn', options.out_forcing_file, options.out_forcing_link])
 
 inFile.close()
-outFile.close()
+forcingFile.close()
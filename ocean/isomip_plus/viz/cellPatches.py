@@ -0,0 +1,107 @@
+'''
+Polygons for plotting fields on MPAS cells with a single matplotlib
+PolyCollection.  The polygon vertices are built with array operations and can
+be cached to disk in a file named by a hash of the mesh, so each frame only
+needs to set the colors of the collection.
+
+Also the cells along a straight section through the mesh, found with a single
+KD-tree query and cached in the same way, for plotting vertical sections.
+'''
+import numpy
+import hashlib
+import os
+import os.path
+from matplotlib.collections import PolyCollection
+from scipy.spatial import cKDTree
+
+def computeCellPolygons(nEdgesOnCell, verticesOnCell, xVertex, yVertex,
+                        mask=None, scale=1e-3):
+  # an array (nCells, maxEdges, 2) of the (scaled) vertices of each cell in
+  # mask, with cells that have fewer than maxEdges vertices padded by
+  # repeating their last vertex.  verticesOnCell is zero-based.
+  nEdgesOnCell = numpy.asarray(nEdgesOnCell)
+  verticesOnCell = numpy.asarray(verticesOnCell)
+  if mask is not None:
+    nEdgesOnCell = nEdgesOnCell[mask]
+    verticesOnCell = verticesOnCell[mask,:]
+  nCells = len(nEdgesOnCell)
+  maxEdges = verticesOnCell.shape[1]
+  edgeIndices = numpy.arange(maxEdges)
+  columns = numpy.minimum(edgeIndices[numpy.newaxis,:],
+                          nEdgesOnCell[:,numpy.newaxis]-1)
+  vertices = verticesOnCell[numpy.arange(nCells)[:,numpy.newaxis],columns]
+  polygons = numpy.zeros((nCells,maxEdges,2))
+  polygons[:,:,0] = scale*numpy.asarray(xVertex)[vertices]
+  polygons[:,:,1] = scale*numpy.asarray(yVertex)[vertices]
+  return polygons
+
+def getMeshHash(arrays):
+  # a hash of the shapes and values of a list of arrays
+  sha = hashlib.sha1()
+  for array in arrays:
+    array = numpy.ascontiguousarray(array)
+    sha.update(str(array.shape).encode('utf-8'))
+    sha.update(array.astype(float).tobytes())
+  return sha.hexdigest()
+
+def saveCache(cacheFileName, **arrays):
+  # write to a temporary file first and rename it, so another process never
+  # loads a partially written cache
+  tempFileName = '%s.%i.tmp.npz'%(os.path.splitext(cacheFileName)[0],
+                                  os.getpid())
+  numpy.savez(tempFileName, **arrays)
+  os.rename(tempFileName, cacheFileName)
+
+def getCellPolygons(nEdgesOnCell, verticesOnCell, xVertex, yVertex,
+                    mask=None, scale=1e-3, cacheFolder=None):
+  # computeCellPolygons, reading the result from cacheFolder if this mesh and
+  # mask have been computed before, and writing it otherwise
+  if cacheFolder is None:
+    return computeCellPolygons(nEdgesOnCell, verticesOnCell, xVertex,
+                               yVertex, mask, scale)
+
+  if mask is None:
+    mask = numpy.ones(len(nEdgesOnCell), bool)
+  meshHash = getMeshHash([nEdgesOnCell, verticesOnCell, xVertex, yVertex,
+                          mask, [scale]])
+  cacheFileName = '%s/cellPolygons_%s.npz'%(cacheFolder, meshHash)
+  if os.path.exists(cacheFileName):
+    return numpy.load(cacheFileName)['polygons']
+
+  polygons = computeCellPolygons(nEdgesOnCell, verticesOnCell, xVertex,
+                                 yVertex, mask, scale)
+  saveCache(cacheFileName, polygons=polygons)
+  return polygons
+
+def makeCellCollection(polygons, cmap=None):
+  # a collection of the cell polygons whose colors are set with set_array
+  return PolyCollection(polygons, cmap=cmap, alpha=1.)
+
+def computeSectionCellIndices(xCell, yCell, start, end, nPoints=10000):
+  # the cells closest to nPoints evenly spaced points along the line from
+  # start to end (each an (x, y) pair), without consecutive repeats
+  fractions = numpy.linspace(0., 1., nPoints)
+  points = numpy.zeros((nPoints,2))
+  points[:,0] = start[0] + fractions*(end[0]-start[0])
+  points[:,1] = start[1] + fractions*(end[1]-start[1])
+  tree = cKDTree(numpy.column_stack((xCell, yCell)))
+  (distances, cellIndices) = tree.query(points)
+  keep = numpy.ones(nPoints, bool)
+  keep[1:] = cellIndices[1:] != cellIndices[0:-1]
+  return cellIndices[keep]
+
+def getSectionCellIndices(xCell, yCell, start, end, nPoints=10000,
+                          cacheFolder=None):
+  # computeSectionCellIndices, reading the result from cacheFolder if this
+  # mesh and section have been computed before, and writing it otherwise
+  if cacheFolder is None:
+    return computeSectionCellIndices(xCell, yCell, start, end, nPoints)
+
+  meshHash = getMeshHash([xCell, yCell, start, end, [nPoints]])
+  cacheFileName = '%s/sectionCells_%s.npz'%(cacheFolder, meshHash)
+  if os.path.exists(cacheFileName):
+    return numpy.load(cacheFileName)['cellIndices']
+
+  cellIndices = computeSectionCellIndices(xCell, yCell, start, end, nPoints)
+  saveCache(cacheFileName, cellIndices=cellIndices)
+  return cellIndices
@@ -1,14 +1,82 @@
 #!/usr/bin/env python
+"""
+Computes the barotropic and overturning streamfunctions, plots each field at
+each time and makes a movie of each field.
+
+The streamfunctions are computed in parallel, sharing a cache of the mesh in
+the meshCache subfolder.  The mesh variables needed for plotting are then
+added to the cache once so that plotting processes can share them through
+memory maps, along with the cell polygons and section cells built from them.
+Frames are rendered by a pool of plotResults.py processes, each plotting one
+group of fields for a range of time indices, and the movies of a group of
+fields are started as soon as all of its frames are done.  A summary of the
+time spent in each stage is printed at the end.
+"""
 
 import argparse
 import os
 import subprocess
-import glob
+import time
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from netCDF4 import Dataset
+
+# the plots made by plotResults.py, grouped by the variable they come from
+fieldGroups = [['bsf'], ['meltRate'], ['oceanHeatFlux'], ['iceHeatFlux'],
+               ['thermalDriving'], ['halineDriving'], ['fricVel'],
+               ['topTemp', 'botTemp', 'centerTemp'],
+               ['topSalinity', 'botSalinity', 'centerSalinity'],
+               ['topLayerThickness', 'botLayerThickness',
+                'centerLayerThickness'],
+               ['deltaSSH'],
+               ['topVx', 'botVx', 'centerVx'],
+               ['topVy', 'botVy', 'centerVy'],
+               ['osf']]
+
+def getTimeCount():
+    # the number of time levels plotResults.py will plot
+    nTime = None
+    for fileName in ['output.nc', 'barotropicStreamfunction.nc',
+                     'overturningStreamfunction.nc']:
+        fileName = '%s/%s'%(folder, fileName)
+        if not os.path.exists(fileName):
+            continue
+        inFile = Dataset(fileName, 'r')
+        count = len(inFile.dimensions['Time'])
+        inFile.close()
+        if nTime is None:
+            nTime = count
+        else:
+            nTime = min(nTime, count)
+    return nTime
+
+def runPlotTask(task):
+    (groupIndex, start, stop) = task
+    fields = fieldGroups[groupIndex]
+    logFile = open('%s/plotLogs/plot_%s_%04i.log'%(folder, fields[0], start),
+                   'w')
+    args = ['./viz/plotResults.py', '--inFolder=%s'%folder,
+            '--outImageFolder=%s/plots'%folder, '--expt=%s'%expt,
+            '--cacheFolder=%s/meshCache'%folder,
+            '--fields=%s'%','.join(fields),
+            '--timeIndices=%i:%i'%(start, stop)]
+    status = subprocess.call(args, stdout=logFile, stderr=logFile)
+    logFile.close()
+    return (groupIndex, start, status)
+
+def startMovie(prefix):
+    logFile = open('%s/plotLogs/%s.log'%(folder,prefix), 'w')
+    args = [avconv, '-y', '-r', framesPerSecond, '-i', '%s/plots/%s_%%04d.png'%(folder, prefix),
+            '-b', '32000k', '-r', framesPerSecond, '%s/movies/%s.mp4'%(folder, prefix)]
+
+    print 'running %s'%' '.join(args)
+    return subprocess.Popen(args, stdout=logFile, stderr=logFile)
 
 parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
 parser.add_argument("-f", "--folder", dest="folder", help="Folder for plots", required=True)
 parser.add_argument("-e", "--expt", dest="expt", help="Experiment number (0, 1 or 2)", required=True)
 parser.add_argument("-a", "--avconv", dest="avconv", help="full path to avconv")
+parser.add_argument("-n", "--nProcs", dest="nProcs", type=int, help="number of plotting processes (default: the number of cores)")
 
 args = parser.parse_args()
 
@@ -21,6 +89,11 @@ if(args.avconv is None):
 else:
     avconv = args.avconv
 
+if(args.nProcs is None):
+    nProcs = cpu_count()
+else:
+    nProcs = args.nProcs
+
 initFile = 'init.nc'
 print folder
 print 'expt ', expt
@@ -30,16 +103,21 @@ try:
 except OSError:
     pass
 
+stageTimes = []
+
+startTime = time.time()
 
 logFile = open('%s/plotLogs/barotropic.log'%folder, 'w')
-args = ['./viz/computeBarotropicStreamfunction.py', folder]
+args = ['./viz/computeBarotropicStreamfunction.py',
+        '--cacheFolder=%s/meshCache'%folder, folder]
 
 print 'running %s'%' '.join(args)
 barotropicProcess = subprocess.Popen(args, stdout=logFile, stderr=logFile)
 
 
 logFile = open('%s/plotLogs/overturning.log'%folder, 'w')
-args = ['./viz/computeOverturningStreamfunction.py', folder]
+args = ['./viz/computeOverturningStreamfunction.py',
+        '--cacheFolder=%s/meshCache'%folder, folder]
 
 print 'running %s'%' '.join(args)
 overturningProcess = subprocess.Popen(args, stdout=logFile, stderr=logFile)
@@ -56,12 +134,23 @@ if(status != 0):
     print 'Error running computeOverturningStreamfunction.py'
     exit(1)
 
-logFile = open('%s/plotLogs/plot.log'%folder, 'w')
-args = ['./viz/plotResults.py', '--inFolder=%s'%folder, '--outImageFolder=%s/plots'%folder,
-        '--expt=%s'%expt]
+stageTimes.append(('streamfunctions', time.time()-startTime))
+
 
+startTime = time.time()
+# run plotResults.py once without plotting any time levels so the mesh, cell
+# polygons and section cells are cached before the plotting processes start
+logFile = open('%s/plotLogs/plot_cache.log'%folder, 'w')
+args = ['./viz/plotResults.py', '--inFolder=%s'%folder,
+        '--outImageFolder=%s/plots'%folder, '--expt=%s'%expt,
+        '--cacheFolder=%s/meshCache'%folder, '--timeIndices=0:0']
 print 'running %s'%' '.join(args)
-subprocess.check_call(args, stdout=logFile, stderr=logFile)
+status = subprocess.call(args, stdout=logFile, stderr=logFile)
+logFile.close()
+if(status != 0):
+    print 'Error running plotResults.py to fill the mesh cache'
+    exit(1)
+stageTimes.append(('mesh cache', time.time()-startTime))
 
 
 framesPerSecond = '30'
@@ -70,24 +159,64 @@ try:
 except OSError:
     pass
 
+startTime = time.time()
 
+# split the time indices of each group of fields among the processes
+nTime = getTimeCount()
+if(nTime is None):
+    print 'Error: none of output.nc, barotropicStreamfunction.nc or ' \
+        'overturningStreamfunction.nc were found in %s'%folder
+    exit(1)
+chunkSize = max(1, -(-nTime//nProcs))
+tasks = []
+remainingTasks = []
+for groupIndex in range(len(fieldGroups)):
+    starts = range(0, nTime, chunkSize)
+    remainingTasks.append(len(starts))
+    for start in starts:
+        tasks.append((groupIndex, start, min(start+chunkSize, nTime)))
+
+print 'plotting %i time levels with %i processes'%(nTime, nProcs)
 processes = []
-
-for fileName in glob.glob('%s/plots/*0001.png'%folder):
-    prefix = fileName.split('/')[-1][:-9]
-    print prefix
-    logFile = open('%s/plotLogs/%s.log'%(folder,prefix), 'w')
-    args = [avconv, '-y', '-r', framesPerSecond, '-i', '%s/plots/%s_%%04d.png'%(folder, prefix),
-            '-b', '32000k', '-r', framesPerSecond, '%s/movies/%s.mp4'%(folder, prefix)]
- 
-    print 'running %s'%' '.join(args)
-    process = subprocess.Popen(args, stdout=logFile, stderr=logFile)
-    
-    processes.append(process)
-
+failedTasks = []
+pool = ThreadPool(nProcs)
+for (groupIndex, start, status) in pool.imap_unordered(runPlotTask, tasks):
+    if(status != 0):
+        # let the other tasks finish rather than leaving orphaned processes;
+        # the failures are reported once the pool is done
+        failedTasks.append((groupIndex, start))
+        continue
+    remainingTasks[groupIndex] -= 1
+    if(remainingTasks[groupIndex] > 0):
+        continue
+    # all frames of this group are done, so its movies can be made
+    for prefix in fieldGroups[groupIndex]:
+        if os.path.exists('%s/plots/%s_0001.png'%(folder, prefix)):
+            processes.append(startMovie(prefix))
+pool.close()
+pool.join()
+
+for (groupIndex, start) in failedTasks:
+    print 'Error running plotResults.py, see %s/plotLogs/plot_%s_%04i.log'%(
+        folder, fieldGroups[groupIndex][0], start)
+
+stageTimes.append(('frames', time.time()-startTime))
+
+startTime = time.time()
 for process in processes:
     status = process.wait()
-    
+
     if(status != 0):
         print 'Error running avconv'
 
+stageTimes.append(('movies (after frames)', time.time()-startTime))
+
+print ''
+print 'Stage timing summary:'
+for (stage, stageTime) in stageTimes:
+    print '  %-24s %10.2f s'%(stage, stageTime)
+print '  %-24s %10.2f s'%('total', sum([stageTime for (stage, stageTime) in
+                                        stageTimes]))
+
+if(len(failedTasks) > 0):
+    exit(1)
@@ -8,75 +8,97 @@ from optparse import OptionParser
 import scipy.sparse
 import scipy.sparse.linalg
 import os.path
-
-
-def computeTransport():
-  transport = numpy.zeros(nEdges)
-  innerEdges = numpy.logical_and(cellsOnEdge[:,0] >= 0,cellsOnEdge[:,1] >= 0)
-  innerEdges = numpy.nonzero(innerEdges)[0]
-  for iEdge in innerEdges:
-    cell0 = cellsOnEdge[iEdge,0]
-    cell1 = cellsOnEdge[iEdge,1]
-    layerThicknessEdge = 0.5*(layerThickness[cell0,:] + layerThickness[cell1,:])
-    transport[iEdge] = dvEdge[iEdge]*numpy.sum(layerThicknessEdge*normalVelocity[iEdge,:])
-
-  return (innerEdges,transport)
-  
-def computeBSF():
-  boundaryVertices = numpy.logical_or(cellsOnVertex[:,0] ==-1,cellsOnVertex[:,1] ==-1)
-  boundaryVertices = numpy.logical_or(boundaryVertices,cellsOnVertex[:,2] ==-1)
-  boundaryVertices = numpy.nonzero(boundaryVertices)[0]
-  nBoundaryVertices = len(boundaryVertices)
-  nInnerEdges = len(innerEdges)
-  
-  rhs = numpy.zeros(nInnerEdges+nBoundaryVertices,dtype=float)
-  indices = numpy.zeros((2,2*nInnerEdges+nBoundaryVertices),dtype=int)
-  data = numpy.zeros(2*nInnerEdges+nBoundaryVertices,dtype=float)
-  for index in range(nInnerEdges):
-  
-    iEdge = innerEdges[index]
-    v0 = verticesOnEdge[iEdge,0]
-    v1 = verticesOnEdge[iEdge,1]
-    
-    indices[0,2*index] = index
-    indices[1,2*index] = v1
-    data[2*index] = 1.
-    indices[0,2*index+1] = index
-    indices[1,2*index+1] = v0
-    data[2*index+1] = -1.
-    
-    rhs[index] = transport[iEdge]*1e-6 #in Sv
-  
-  for index in range(nBoundaryVertices):
-    iVertex = boundaryVertices[index]
-    indices[0,2*nInnerEdges+index] = nInnerEdges+index
-    indices[1,2*nInnerEdges+index] = iVertex
-    data[2*nInnerEdges+index] = 1. 
-    rhs[nInnerEdges+index] = 0. # bsf is zero at the boundaries
-  
-  M = scipy.sparse.csr_matrix((data,indices),shape=(nInnerEdges+nBoundaryVertices,nVertices))
-  
-  solution = scipy.sparse.linalg.lsqr(M,rhs)
-  
-  bsf = -solution[0]
-  return bsf
-
- 
-def computeBSFCell(bsf):
-  bsfCell = numpy.zeros(nCells)
-  for iCell in range(nCells):
-    edgeCount = nEdgesOnCell[iCell]
-    edges = edgesOnCell[iCell,0:edgeCount]
-    verts = verticesOnCell[iCell,0:edgeCount]
-    areaEdge = dcEdge[edges]*dvEdge[edges]
-    indexM1 = numpy.mod(numpy.arange(-1,edgeCount-1),edgeCount)
-    areaVert = 0.5*(areaEdge+areaEdge[indexM1])
-    bsfCell[iCell] = numpy.sum(areaVert*bsf[verts])/numpy.sum(areaVert)
-  
-  return bsfCell
+import time
+
+from mpas_mesh import MpasMesh
+
+
+def computeTransport(normalVelocity, layerThickness):
+  # the vertically integrated transport through each inner edge
+  cell0 = cellsOnEdge[innerEdges,0]
+  cell1 = cellsOnEdge[innerEdges,1]
+  layerThicknessEdge = 0.5*(layerThickness[cell0,:] + layerThickness[cell1,:])
+  return dvEdge[innerEdges]*numpy.sum(
+      layerThicknessEdge*normalVelocity[innerEdges,:], axis=1)
+
+class BSFSolver(object):
+  # The barotropic streamfunction on vertices is the least-squares solution
+  # of a system with one equation per inner edge (the difference in BSF
+  # between its vertices is the transport through it) and one per boundary
+  # vertex (where the BSF is zero).  The system only depends on the mesh, so
+  # the normal equations are assembled and factored once and then solved for
+  # many transports at a time.
+
+  def __init__(self, innerEdges, verticesOnEdge, cellsOnVertex, nVertices):
+    boundaryVertices = numpy.any(cellsOnVertex[:,0:3] == -1, axis=1)
+    boundaryVertices = numpy.nonzero(boundaryVertices)[0]
+    nBoundaryVertices = len(boundaryVertices)
+    nInnerEdges = len(innerEdges)
+
+    rows = numpy.concatenate((numpy.arange(nInnerEdges),
+                              numpy.arange(nInnerEdges),
+                              nInnerEdges + numpy.arange(nBoundaryVertices)))
+    cols = numpy.concatenate((verticesOnEdge[innerEdges,1],
+                              verticesOnEdge[innerEdges,0],
+                              boundaryVertices))
+    data = numpy.concatenate((numpy.ones(nInnerEdges),
+                              -numpy.ones(nInnerEdges),
+                              numpy.ones(nBoundaryVertices)))
+    self.M = scipy.sparse.csr_matrix(
+        (data, (rows, cols)), shape=(nInnerEdges+nBoundaryVertices,nVertices))
+    self.nInnerEdges = nInnerEdges
+    self.nBoundaryVertices = nBoundaryVertices
+
+    # vertices not in the system are set to zero, as lsqr would
+    normalMatrix = (self.M.T*self.M).tocsc()
+    unused = normalMatrix.diagonal() == 0.
+    normalMatrix = normalMatrix + scipy.sparse.diags(1.*unused, 0)
+    try:
+      self.lu = scipy.sparse.linalg.splu(normalMatrix.tocsc())
+    except RuntimeError:
+      # the normal equations are singular (e.g. a region with no boundary
+      # vertices), so fall back on lsqr for every solve
+      print 'Warning: BSF system is singular, using lsqr'
+      self.lu = None
+
+  def solve(self, transport):
+    # transport has shape (nInnerEdges,) or (nInnerEdges, nTimes)
+    transport = numpy.asarray(transport)
+    rhs = numpy.zeros((self.nInnerEdges+self.nBoundaryVertices,)
+                      + transport.shape[1:])
+    rhs[0:self.nInnerEdges] = transport*1e-6 #in Sv
+    # bsf is zero at the boundaries
+    if self.lu is None:
+      if rhs.ndim == 1:
+        return -scipy.sparse.linalg.lsqr(self.M,rhs)[0]
+      return -numpy.array([scipy.sparse.linalg.lsqr(self.M,rhs[:,index])[0]
+                           for index in range(rhs.shape[1])]).T
+    return -self.lu.solve(self.M.T.dot(rhs))
+
+def buildBSFCellOperator():
+  # sparse matrix that averages the BSF at the vertices of each cell,
+  # weighted by the area associated with each vertex.  The edges and vertices
+  # of each cell are in CSR format (see mpas_mesh.py), so the operator has the
+  # same structure as verticesOnCell.
+  cellOffsets = mesh.cellOffsets
+  edges = mesh.edgesOnCell
+  areaEdge = dcEdge[edges]*dvEdge[edges]
+  # the edge before each edge around its cell
+  indexM1 = numpy.arange(len(edges)) - 1
+  indexM1[cellOffsets[0:-1]] = cellOffsets[1:] - 1
+  areaVert = 0.5*(areaEdge + areaEdge[indexM1])
+  cells = numpy.repeat(numpy.arange(nCells), nEdgesOnCell)
+  weights = areaVert/numpy.bincount(cells, weights=areaVert,
+                                    minlength=nCells)[cells]
+  return scipy.sparse.csr_matrix(
+      (weights, numpy.array(mesh.verticesOnCell), numpy.array(cellOffsets)),
+      shape=(nCells, nVertices))
 
 parser = OptionParser()
-           
+parser.add_option("--batchSize", type="int", dest="batchSize", default=12,
+                  help="the number of time levels to solve for at once")
+parser.add_option("--cacheFolder", type="string", dest="cacheFolder",
+                  help="folder in which to cache the mesh (default: $MPAS_MESH_CACHE, if set)")
 options, args = parser.parse_args()
 
 folder=args[0]
@@ -117,18 +139,14 @@ if(continueOutput):
 else:
   nTimeOut = 0
 
-verticesOnEdge = inFile.variables['verticesOnEdge'][:]-1 # change to zero-based indexing
-cellsOnEdge = inFile.variables['cellsOnEdge'][:]-1 # change to zero-based indexing
-dvEdge = inFile.variables['dvEdge'][:]
-dcEdge = inFile.variables['dcEdge'][:]
-cellsOnVertex = inFile.variables['cellsOnVertex'][:]-1 # change to zero-based indexing
-nEdgesOnCell = inFile.variables['nEdgesOnCell'][:]
-edgesOnCell = inFile.variables['edgesOnCell'][:]-1
-verticesOnCell = inFile.variables['verticesOnCell'][:]-1
-xEdge = inFile.variables['xEdge'][:]
-yEdge = inFile.variables['yEdge'][:]
-xVertex = inFile.variables['xVertex'][:]
-yVertex = inFile.variables['yVertex'][:]
+# zero-based connectivity, cached by the mesh's file_id if cacheFolder is given
+mesh = MpasMesh('%s/output.nc'%folder, options.cacheFolder)
+verticesOnEdge = mesh.verticesOnEdge
+cellsOnEdge = mesh.cellsOnEdge
+dvEdge = mesh.dvEdge
+dcEdge = mesh.dcEdge
+cellsOnVertex = mesh.cellsOnVertex
+nEdgesOnCell = mesh.nEdgesOnCell
 
 if(continueOutput):
   outBSF = outFile.variables['barotropicStreamfunction']
@@ -137,23 +155,33 @@ else:
   outBSF = outFile.createVariable('barotropicStreamfunction',float,['Time','nVertices'])
   outBSFCell = outFile.createVariable('barotropicStreamfunctionCell',float,['Time','nCells'])
 
-print nTimeOut, nTimeIn
-for tIndex in range(nTimeOut,nTimeIn):
-  print tIndex, nTimeIn
-  normalVelocity = inFile.variables['normalVelocity'][tIndex,:,:]
-  layerThickness = inFile.variables['layerThickness'][tIndex,:,:]
-  
+innerEdges = mesh.inner_edges()
 
-  (innerEdges,transport) = computeTransport()
-  
-  bsf = computeBSF()
-  
-  bsfCell = computeBSFCell(bsf)
-  
-  
-  outBSF[tIndex,:] = bsf
-  outBSFCell[tIndex,:] = bsfCell
+t0 = time.time()
+solver = BSFSolver(innerEdges, verticesOnEdge, cellsOnVertex, nVertices)
+bsfCellOperator = buildBSFCellOperator()
+print 'setup and factorization: %.3f s'%(time.time()-t0)
+
+print nTimeOut, nTimeIn
+for tStart in range(nTimeOut,nTimeIn,options.batchSize):
+  tEnd = min(tStart+options.batchSize,nTimeIn)
+  transport = numpy.zeros((len(innerEdges),tEnd-tStart))
+  for tIndex in range(tStart,tEnd):
+    normalVelocity = inFile.variables['normalVelocity'][tIndex,:,:]
+    layerThickness = inFile.variables['layerThickness'][tIndex,:,:]
+    transport[:,tIndex-tStart] = computeTransport(normalVelocity,
+                                                  layerThickness)
+
+  t0 = time.time()
+  bsf = solver.solve(transport)
+  solveTime = (time.time()-t0)/(tEnd-tStart)
+
+  bsfCell = bsfCellOperator.dot(bsf)
+
+  for tIndex in range(tStart,tEnd):
+    print tIndex, nTimeIn, 'solve: %.4f s'%solveTime
+    outBSF[tIndex,:] = bsf[:,tIndex-tStart]
+    outBSFCell[tIndex,:] = bsfCell[:,tIndex-tStart]
 
 outFile.close()
 inFile.close()
-
@@ -1,18 +1,176 @@
 #!/usr/bin/env python
 import numpy
 from netCDF4 import Dataset
-from shapely.geometry import Polygon, LineString
 
 from optparse import OptionParser
 
 from progressbar import ProgressBar, Percentage, Bar, ETA
 
 import os.path
+import time
 
-def getTransectWeights(outFileName, axis):
+# intersections with weights smaller than this are treated as touching
+# rather than overlapping (shapely returns exactly zero in this case, while
+# clipping can leave round-off)
+minWeight = 1e-10
+
+def getCandidateRange(bounds, minCoord, maxCoord, nOut):
+  # the range of output cell indices [lower, upper) that may overlap each
+  # MPAS cell spanning [minCoord, maxCoord]
+  lower = numpy.maximum(numpy.searchsorted(bounds, minCoord, side='left')-1, 0)
+  upper = numpy.minimum(numpy.searchsorted(bounds, maxCoord, side='right'), nOut)
+  upper = numpy.maximum(upper, lower)
+  return lower, upper
+
+def getCellPolygons(cellIndices):
+  # padded arrays of vertex coordinates and a vertex count for each cell
+  maxEdges = verticesOnCell.shape[1]
+  counts = nEdgesOnCell[cellIndices]
+  valid = numpy.arange(maxEdges)[numpy.newaxis,:] < counts[:,numpy.newaxis]
+  verts = numpy.where(valid, verticesOnCell[cellIndices,:], 0)
+  return xVertex[verts], yVertex[verts], counts
+
+def clipHalfPlane(xPoly, yPoly, counts, axis, bound, keepGreater):
+  # Vectorized Sutherland-Hodgman clipping of many convex polygons against
+  # the half plane coord >= bound (keepGreater) or coord <= bound
+  nPoly, maxVerts = xPoly.shape
+  bound = numpy.asarray(bound)[:,numpy.newaxis]
+  rows = numpy.arange(nPoly)[:,numpy.newaxis]
+  vertexIndices = numpy.arange(maxVerts)[numpy.newaxis,:]
+  valid = vertexIndices < counts[:,numpy.newaxis]
+  prevIndices = numpy.mod(vertexIndices-1, numpy.maximum(counts, 1)[:,numpy.newaxis])
+
+  xEnd = xPoly
+  yEnd = yPoly
+  xStart = xPoly[rows, prevIndices]
+  yStart = yPoly[rows, prevIndices]
+  if axis == 'x':
+    cEnd = xEnd
+    cStart = xStart
+  else:
+    cEnd = yEnd
+    cStart = yStart
+  if keepGreater:
+    insideEnd = cEnd >= bound
+    insideStart = cStart >= bound
+  else:
+    insideEnd = cEnd <= bound
+    insideStart = cStart <= bound
+
+  crosses = valid & (insideEnd != insideStart)
+  denom = numpy.where(crosses, cEnd - cStart, 1.)
+  frac = numpy.where(crosses, (bound - cStart)/denom, 0.)
+  xCross = xStart + frac*(xEnd - xStart)
+  yCross = yStart + frac*(yEnd - yStart)
+  if axis == 'x':
+    xCross = numpy.where(crosses, bound, xCross)
+  else:
+    yCross = numpy.where(crosses, bound, yCross)
+
+  # each edge contributes its crossing (if any) followed by its end vertex
+  # (if inside)
+  xOut = numpy.zeros((nPoly, 2*maxVerts))
+  yOut = numpy.zeros((nPoly, 2*maxVerts))
+  keep = numpy.zeros((nPoly, 2*maxVerts), bool)
+  xOut[:,0::2] = xCross
+  yOut[:,0::2] = yCross
+  keep[:,0::2] = crosses
+  xOut[:,1::2] = xEnd
+  yOut[:,1::2] = yEnd
+  keep[:,1::2] = valid & insideEnd
+
+  # compact the kept vertices to the front of each row
+  order = numpy.argsort(~keep, axis=1, kind='mergesort')
+  newCounts = numpy.sum(keep, axis=1)
+  newMax = max(numpy.amax(newCounts), 1) if nPoly > 0 else 1
+  order = order[:,0:newMax]
+  return xOut[rows, order], yOut[rows, order], newCounts
+
+def polygonArea(xPoly, yPoly, counts):
+  nPoly, maxVerts = xPoly.shape
+  rows = numpy.arange(nPoly)[:,numpy.newaxis]
+  vertexIndices = numpy.arange(maxVerts)[numpy.newaxis,:]
+  valid = vertexIndices < counts[:,numpy.newaxis]
+  nextIndices = numpy.mod(vertexIndices+1, numpy.maximum(counts, 1)[:,numpy.newaxis])
+  cross = xPoly*yPoly[rows, nextIndices] - xPoly[rows, nextIndices]*yPoly
+  return 0.5*numpy.abs(numpy.sum(numpy.where(valid, cross, 0.), axis=1))
+
+def getOccurrenceRank(keys):
+  # for each entry, the number of earlier entries with the same key
+  order = numpy.argsort(keys, kind='mergesort')
+  sortedKeys = keys[order]
+  isStart = numpy.ones(len(keys), bool)
+  isStart[1:] = sortedKeys[1:] != sortedKeys[:-1]
+  startIndices = numpy.maximum.accumulate(numpy.where(isStart, numpy.arange(len(keys)), 0))
+  rank = numpy.zeros(len(keys), int)
+  rank[order] = numpy.arange(len(keys)) - startIndices
+  return rank
+
+def expandCandidates(cells, lowerA, upperA, lowerB, upperB):
+  # all (cell, a, b) with a in [lowerA, upperA) and b in [lowerB, upperB),
+  # ordered by cell, then a, then b
+  nA = upperA - lowerA
+  nB = upperB - lowerB
+  nPairs = nA*nB
+  offsets = numpy.cumsum(nPairs) - nPairs
+  pairCells = numpy.repeat(numpy.arange(len(cells)), nPairs)
+  local = numpy.arange(numpy.sum(nPairs)) - offsets[pairCells]
+  nBPair = numpy.maximum(nB[pairCells], 1)
+  aIndices = lowerA[pairCells] + local//nBPair
+  bIndices = lowerB[pairCells] + local%nBPair
+  return cells[pairCells], aIndices, bIndices
+
+def computeInterpWeights(chunkSize=100000):
+  # vectorized intersections of MPAS cells with MISOMIP grid cells
+  cellIndices = []
+  xIndices = []
+  yIndices = []
+  weights = []
 
   pbar = ProgressBar(widgets=[Percentage(), Bar(), ETA()], maxval=nCells).start()
+  for cellStart in range(0, nCells, chunkSize):
+    cells = numpy.arange(cellStart, min(cellStart+chunkSize, nCells))
+    xPoly, yPoly, counts = getCellPolygons(cells)
+    valid = numpy.arange(xPoly.shape[1])[numpy.newaxis,:] < counts[:,numpy.newaxis]
+    xl, xu = getCandidateRange(x, numpy.amin(numpy.where(valid, xPoly, numpy.inf), axis=1),
+                               numpy.amax(numpy.where(valid, xPoly, -numpy.inf), axis=1), outNx)
+    yl, yu = getCandidateRange(y, numpy.amin(numpy.where(valid, yPoly, numpy.inf), axis=1),
+                               numpy.amax(numpy.where(valid, yPoly, -numpy.inf), axis=1), outNy)
+
+    pairCells, pairY, pairX = expandCandidates(cells, yl, yu, xl, xu)
+    local = pairCells - cellStart
+
+    xClip, yClip, clipCounts = xPoly[local,:], yPoly[local,:], counts[local]
+    xClip, yClip, clipCounts = clipHalfPlane(xClip, yClip, clipCounts, 'x', x[pairX], True)
+    xClip, yClip, clipCounts = clipHalfPlane(xClip, yClip, clipCounts, 'x', x[pairX+1], False)
+    xClip, yClip, clipCounts = clipHalfPlane(xClip, yClip, clipCounts, 'y', y[pairY], True)
+    xClip, yClip, clipCounts = clipHalfPlane(xClip, yClip, clipCounts, 'y', y[pairY+1], False)
+    pairWeights = polygonArea(xClip, yClip, clipCounts)/outDx**2
+
+    mask = pairWeights > minWeight
+    cellIndices.append(pairCells[mask])
+    xIndices.append(pairX[mask])
+    yIndices.append(pairY[mask])
+    weights.append(pairWeights[mask])
+    pbar.update(cells[-1]+1)
+  pbar.finish()
+
+  cellIndices = numpy.concatenate(cellIndices)
+  xIndices = numpy.concatenate(xIndices)
+  yIndices = numpy.concatenate(yIndices)
+  weights = numpy.concatenate(weights)
+  xyIndices = xIndices + outNx*yIndices
+  sliceIndices = getOccurrenceRank(xyIndices)
 
+  # sort the intersections first by sliceIndex, then by xIndex + outNx*yIndex
+  # for efficiency
+  sortedIndices = numpy.lexsort((xyIndices, sliceIndices))
+  return (cellIndices[sortedIndices], xIndices[sortedIndices],
+          yIndices[sortedIndices], sliceIndices[sortedIndices],
+          weights[sortedIndices])
+
+def computeTransectWeights(axis):
+  # vectorized intersections of MPAS cells with the segments of a transect
   if axis == 'x':
     slicePos = xTransect
     outNOther = outNy
@@ -22,12 +180,138 @@ def getTransectWeights(outFileName, axis):
     outNOther = outNx
     outOtherAxis = x
 
-  sliceCount = numpy.zeros(outNOther,int)
+  cells = numpy.arange(nCells)
+  xPoly, yPoly, counts = getCellPolygons(cells)
+  if axis == 'x':
+    slicePoly, otherPoly = xPoly, yPoly
+  else:
+    slicePoly, otherPoly = yPoly, xPoly
+
+  # the segment of the line slice == slicePos inside each (convex) cell is
+  # bounded by the crossings of the cell's edges
+  nPoly, maxVerts = xPoly.shape
+  rows = numpy.arange(nPoly)[:,numpy.newaxis]
+  vertexIndices = numpy.arange(maxVerts)[numpy.newaxis,:]
+  valid = vertexIndices < counts[:,numpy.newaxis]
+  nextIndices = numpy.mod(vertexIndices+1, numpy.maximum(counts, 1)[:,numpy.newaxis])
+  sStart = slicePoly
+  sEnd = slicePoly[rows, nextIndices]
+  oStart = otherPoly
+  oEnd = otherPoly[rows, nextIndices]
+  crosses = valid & ((sStart - slicePos)*(sEnd - slicePos) <= 0.) & (sStart != sEnd)
+  frac = numpy.where(crosses, (slicePos - sStart)/numpy.where(crosses, sEnd - sStart, 1.), 0.)
+  oCross = oStart + frac*(oEnd - oStart)
+  lowerOther = numpy.amin(numpy.where(crosses, oCross, numpy.inf), axis=1)
+  upperOther = numpy.amax(numpy.where(crosses, oCross, -numpy.inf), axis=1)
+  hits = numpy.any(crosses, axis=1)
+
+  cells = cells[hits]
+  lowerOther = lowerOther[hits]
+  upperOther = upperOther[hits]
+  otherValid = valid[hits]
+  lower, upper = getCandidateRange(outOtherAxis,
+                                   numpy.amin(numpy.where(otherValid, otherPoly[hits], numpy.inf), axis=1),
+                                   numpy.amax(numpy.where(otherValid, otherPoly[hits], -numpy.inf), axis=1),
+                                   outNOther)
+
+  zeros = numpy.zeros(len(cells), int)
+  pairCells, pairOther, dummy = expandCandidates(cells, lower, upper, zeros, zeros+1)
+  local = numpy.searchsorted(cells, pairCells)
+  lengths = numpy.minimum(upperOther[local], outOtherAxis[pairOther+1]) - \
+            numpy.maximum(lowerOther[local], outOtherAxis[pairOther])
+  pairWeights = lengths/outDx
+
+  mask = pairWeights > minWeight
+  cellIndices = pairCells[mask]
+  otherIndices = pairOther[mask]
+  weights = pairWeights[mask]
+  sliceIndices = getOccurrenceRank(otherIndices)
+
+  # sort the intersections first by sliceIndex, then by otherIndex
+  # for efficiency
+  sortedIndices = numpy.lexsort((otherIndices, sliceIndices))
+  return (cellIndices[sortedIndices], otherIndices[sortedIndices],
+          sliceIndices[sortedIndices], weights[sortedIndices])
+
+def computeInterpWeightsShapely():
+  # the original, per-cell implementation using shapely, kept for validation
+  from shapely.geometry import Polygon
+
   cellIndices = []
-  otherIndices = []
+  xIndices = []
+  yIndices = []
   weights = []
   sliceIndices = []
 
+  sliceCount = numpy.zeros((outNy,outNx),int)
+
+  pbar = ProgressBar(widgets=[Percentage(), Bar(), ETA()], maxval=nCells).start()
+
+  for iCell in range(nCells):
+    verts = verticesOnCell[iCell,0:nEdgesOnCell[iCell]]
+    verts = numpy.append(verts,verts[0])
+    xVert = xVertex[verts]
+    yVert = yVertex[verts]
+    mpasPolygon = Polygon(list(zip(xVert,yVert)))
+
+    xl, xu = getCandidateRange(x, numpy.amin(xVert), numpy.amax(xVert), outNx)
+    yl, yu = getCandidateRange(y, numpy.amin(yVert), numpy.amax(yVert), outNy)
+
+    for yIndex in range(yl, yu):
+      for xIndex in range(xl, xu):
+        vertices = ((x[xIndex], y[yIndex]),
+                    (x[xIndex+1], y[yIndex]),
+                    (x[xIndex+1], y[yIndex+1]),
+                    (x[xIndex], y[yIndex+1]),
+                    (x[xIndex], y[yIndex]))
+        outPoly = Polygon(vertices)
+        if not mpasPolygon.intersects(outPoly):
+          continue
+        intersectionArea = mpasPolygon.intersection(outPoly).area
+        if intersectionArea == 0.:
+          continue
+
+        cellIndices.append(iCell)
+        xIndices.append(xIndex)
+        yIndices.append(yIndex)
+
+        weights.append(intersectionArea/outDx**2)
+
+        sliceIndex = sliceCount[yIndex,xIndex]
+        sliceCount[yIndex,xIndex] += 1
+        sliceIndices.append(sliceIndex)
+    pbar.update(iCell+1)
+
+  pbar.finish()
+
+  cellIndices = numpy.array(cellIndices)
+  xIndices = numpy.array(xIndices)
+  yIndices = numpy.array(yIndices)
+  sliceIndices = numpy.array(sliceIndices)
+  weights = numpy.array(weights)
+
+  sortedIndices = numpy.lexsort((xIndices + outNx*yIndices, sliceIndices))
+  return (cellIndices[sortedIndices], xIndices[sortedIndices],
+          yIndices[sortedIndices], sliceIndices[sortedIndices],
+          weights[sortedIndices])
+
+def computeTransectWeightsShapely(axis):
+  # the original, per-cell implementation using shapely, kept for validation
+  from shapely.geometry import Polygon, LineString
+
+  if axis == 'x':
+    slicePos = xTransect
+    outNOther = outNy
+    outOtherAxis = y
+  else:
+    slicePos = yTransect
+    outNOther = outNx
+    outOtherAxis = x
+
+  cellIndices = []
+  otherIndices = []
+  weights = []
+
   for iCell in range(nCells):
     verts = verticesOnCell[iCell,0:nEdgesOnCell[iCell]]
     verts = numpy.append(verts,verts[0])
@@ -41,25 +325,14 @@ def getTransectWeights(outFileName, axis):
       sliceAxisVerts = yVert
       otherAxisVerts = xVert
 
-
-
     if(numpy.amax(sliceAxisVerts) < slicePos) or (numpy.amin(sliceAxisVerts) > slicePos):
       # this polygon doesn't intersect the slice
       continue
 
-    mpasPolygon = Polygon(zip(xVert,yVert))
+    mpasPolygon = Polygon(list(zip(xVert,yVert)))
 
-    indices = numpy.nonzero(outOtherAxis < numpy.amin(otherAxisVerts))[0]
-    if len(indices) == 0:
-      lower = 0
-    else:
-      lower = indices[-1]
-
-    indices = numpy.nonzero(outOtherAxis > numpy.amax(otherAxisVerts))[0]
-    if len(indices) == 0:
-      upper = outNOther
-    else:
-      upper = indices[0]
+    lower, upper = getCandidateRange(outOtherAxis, numpy.amin(otherAxisVerts),
+                                     numpy.amax(otherAxisVerts), outNOther)
 
     for otherIndex in range(lower, upper):
       if axis == 'x':
@@ -78,33 +351,53 @@ def getTransectWeights(outFileName, axis):
 
       cellIndices.append(iCell)
       otherIndices.append(otherIndex)
-  
       weights.append(length/outDx)
-  
-      sliceIndex = sliceCount[otherIndex]
-      sliceCount[otherIndex] += 1
-      sliceIndices.append(sliceIndex)
-    pbar.update(iCell+1)
-  
-  pbar.finish()
 
   cellIndices = numpy.array(cellIndices)
   otherIndices = numpy.array(otherIndices)
-  sliceIndices = numpy.array(sliceIndices)
   weights = numpy.array(weights)
+  sliceIndices = getOccurrenceRank(otherIndices)
 
-  # sort the intersections first by otherIndex, then by sliceIndex
-  # for efficiency
-  nSlices = numpy.amax(sliceCount)
-  sortedIndices = numpy.zeros(0,int)
-  pbar = ProgressBar(widgets=[Percentage(), Bar(), ETA()], maxval=nSlices).start()
-  for sliceIndex in range(nSlices):
-    intersectionsInSlice = numpy.nonzero(sliceIndices == sliceIndex)[0]
-    indices = numpy.argsort(otherIndices[intersectionsInSlice])
-    sortedIndices = numpy.append(sortedIndices,intersectionsInSlice[indices])
-    pbar.update(sliceIndex+1)
-  pbar.finish()
-  
+  sortedIndices = numpy.lexsort((otherIndices, sliceIndices))
+  return (cellIndices[sortedIndices], otherIndices[sortedIndices],
+          sliceIndices[sortedIndices], weights[sortedIndices])
+
+def compareWeights(name, indices, weights, refIndices, refWeights):
+  # report whether two sets of intersections agree
+  match = len(weights) == len(refWeights)
+  if match:
+    for index, refIndex in zip(indices, refIndices):
+      match = match and numpy.all(index == refIndex)
+  if match:
+    maxDiff = numpy.amax(numpy.abs(weights - refWeights)) if len(weights) > 0 else 0.
+    print '%s: %i intersections match, max weight difference %g' \
+        %(name, len(weights), maxDiff)
+  else:
+    print '%s: intersections DIFFER (%i vs. %i in shapely)' \
+        %(name, len(weights), len(refWeights))
+  return match
+
+def writeInterpWeights(outFileName, cellIndices, xIndices, yIndices,
+                       sliceIndices, weights):
+  outFile = Dataset(outFileName,'w',format='NETCDF4')
+  outFile.createDimension('nIntersections', len(cellIndices))
+  outFile.createVariable('cellIndices','i4',('nIntersections',))
+  outFile.createVariable('xIndices','i4',('nIntersections',))
+  outFile.createVariable('yIndices','i4',('nIntersections',))
+  outFile.createVariable('sliceIndices','i4',('nIntersections',))
+  outFile.createVariable('mpasToMisomipWeights','f8',('nIntersections',))
+
+  outVars = outFile.variables
+  outVars['cellIndices'][:] = cellIndices
+  outVars['xIndices'][:] = xIndices
+  outVars['yIndices'][:] = yIndices
+  outVars['sliceIndices'][:] = sliceIndices
+  outVars['mpasToMisomipWeights'][:] = weights
+
+  outFile.close()
+
+def writeTransectWeights(outFileName, axis, cellIndices, otherIndices,
+                         sliceIndices, weights):
   outFile = Dataset(outFileName,'w',format='NETCDF4')
   outFile.createDimension('nIntersections', len(cellIndices))
   outFile.createVariable('cellIndices','i4',('nIntersections',))
@@ -114,20 +407,22 @@ def getTransectWeights(outFileName, axis):
     outFile.createVariable('xIndices','i4',('nIntersections',))
   outFile.createVariable('sliceIndices','i4',('nIntersections',))
   outFile.createVariable('mpasToMisomipWeights','f8',('nIntersections',))
-  
+
   outVars = outFile.variables
-  outVars['cellIndices'][:] = cellIndices[sortedIndices]
+  outVars['cellIndices'][:] = cellIndices
   if axis == 'x':
-    outVars['yIndices'][:] = otherIndices[sortedIndices]
+    outVars['yIndices'][:] = otherIndices
   else:
-    outVars['xIndices'][:] = otherIndices[sortedIndices]
+    outVars['xIndices'][:] = otherIndices
+
+  outVars['sliceIndices'][:] = sliceIndices
+  outVars['mpasToMisomipWeights'][:] = weights
 
-  outVars['sliceIndices'][:] = sliceIndices[sortedIndices]
-  outVars['mpasToMisomipWeights'][:] = weights[sortedIndices]
-  
   outFile.close()
 
 parser = OptionParser()
+parser.add_option("--validate", action="store_true", dest="validate",
+                  help="compare the intersections and timing against the original shapely implementation")
 options, args = parser.parse_args()
 
 if(len(args) == 0):
@@ -166,117 +461,34 @@ xVertex = inVars['xVertex'][:]
 yVertex = inVars['yVertex'][:]
 
 inFile.close()
+
+if options.validate:
+  t0 = time.time()
+  interpWeights = computeInterpWeights()
+  t1 = time.time()
+  refInterpWeights = computeInterpWeightsShapely()
+  t2 = time.time()
+  print 'grid intersections: vectorized %.2f s, shapely %.2f s' \
+      %(t1-t0, t2-t1)
+  compareWeights('grid', interpWeights[0:4], interpWeights[4],
+                 refInterpWeights[0:4], refInterpWeights[4])
+  for axis in ['x', 'y']:
+    t0 = time.time()
+    transectWeights = computeTransectWeights(axis)
+    t1 = time.time()
+    refTransectWeights = computeTransectWeightsShapely(axis)
+    t2 = time.time()
+    print '%s transect intersections: vectorized %.2f s, shapely %.2f s' \
+        %(axis, t1-t0, t2-t1)
+    compareWeights('%s transect'%axis, transectWeights[0:3],
+                   transectWeights[3], refTransectWeights[0:3],
+                   refTransectWeights[3])
+
 if(not os.path.exists(interpWeightsFileName)):
-  
-  cellIndices = []
-  xIndices = []
-  yIndices = []
-  weights = []
-  sliceIndices = []
-  
-  sliceCount = numpy.zeros((outNy,outNx),int)
-  
-  pbar = ProgressBar(widgets=[Percentage(), Bar(), ETA()], maxval=nCells).start()
-  
-  for iCell in range(nCells):
-    verts = verticesOnCell[iCell,0:nEdgesOnCell[iCell]]
-    verts = numpy.append(verts,verts[0])
-    xVert = xVertex[verts]
-    yVert = yVertex[verts]
-    mpasPolygon = Polygon(zip(xVert,yVert))
-    #mpasArea = mpasPolygon.area
-  
-    # find the out indices that bound the MPAS polygon
-    indices = numpy.nonzero(x < numpy.amin(xVert))[0]
-    if len(indices) == 0:
-      xl = 0
-    else:
-      xl = indices[-1]
-  
-    indices = numpy.nonzero(x > numpy.amax(xVert))[0]
-    if len(indices) == 0:
-      xu = outNx
-    else:
-      xu = indices[0]
-  
-    indices = numpy.nonzero(y < numpy.amin(yVert))[0]
-    if len(indices) == 0:
-      yl = 0
-    else:
-      yl = indices[-1]
-  
-    indices = numpy.nonzero(y > numpy.amax(yVert))[0]
-    if len(indices) == 0:
-      yu = outNy
-    else:
-      yu = indices[0]
-  
-    for yIndex in range(yl, yu):
-      for xIndex in range(xl, xu):
-        vertices = ((x[xIndex], y[yIndex]),
-                    (x[xIndex+1], y[yIndex]),
-                    (x[xIndex+1], y[yIndex+1]),
-                    (x[xIndex], y[yIndex+1]),
-                    (x[xIndex], y[yIndex]))
-        outPoly = Polygon(vertices)
-        if not mpasPolygon.intersects(outPoly):
-          continue
-        intersectionArea = mpasPolygon.intersection(outPoly).area
-        if intersectionArea == 0.:
-          continue
-  
-        cellIndices.append(iCell)
-        xIndices.append(xIndex)
-        yIndices.append(yIndex)
-  
-        weights.append(intersectionArea/outDx**2)
-  
-        sliceIndex = sliceCount[yIndex,xIndex]
-        sliceCount[yIndex,xIndex] += 1
-        sliceIndices.append(sliceIndex)
-    pbar.update(iCell+1)
-  
-  pbar.finish()
-  
-  cellIndices = numpy.array(cellIndices)
-  xIndices = numpy.array(xIndices)
-  yIndices = numpy.array(yIndices)
-  sliceIndices = numpy.array(sliceIndices)
-  weights = numpy.array(weights)
-  
-  # sort the intersections first by xIndex, then by yIndex, then by sliceIndex
-  # for efficiency
-  nSlices = numpy.amax(sliceCount)
-  sortedIndices = numpy.zeros(0,int)
-  xyIndices = xIndices + outNx*yIndices
-  pbar = ProgressBar(widgets=[Percentage(), Bar(), ETA()], maxval=nSlices).start()
-  for sliceIndex in range(nSlices):
-    intersectionsInSlice = numpy.nonzero(sliceIndices == sliceIndex)[0]
-    indices = numpy.argsort(xyIndices[intersectionsInSlice])
-    sortedIndices = numpy.append(sortedIndices,intersectionsInSlice[indices])
-    pbar.update(sliceIndex+1)
-  pbar.finish()
-  
-  outFile = Dataset(interpWeightsFileName,'w',format='NETCDF4')
-  outFile.createDimension('nIntersections', len(cellIndices))
-  outFile.createVariable('cellIndices','i4',('nIntersections',))
-  outFile.createVariable('xIndices','i4',('nIntersections',))
-  outFile.createVariable('yIndices','i4',('nIntersections',))
-  outFile.createVariable('sliceIndices','i4',('nIntersections',))
-  outFile.createVariable('mpasToMisomipWeights','f8',('nIntersections',))
-  
-  outVars = outFile.variables
-  outVars['cellIndices'][:] = cellIndices[sortedIndices]
-  outVars['xIndices'][:] = xIndices[sortedIndices]
-  outVars['yIndices'][:] = yIndices[sortedIndices]
-  outVars['sliceIndices'][:] = sliceIndices[sortedIndices]
-  outVars['mpasToMisomipWeights'][:] = weights[sortedIndices]
-  
-  outFile.close()
+  writeInterpWeights(interpWeightsFileName, *computeInterpWeights())
 
 if(not os.path.exists(xTransectFileName)):
-  getTransectWeights(xTransectFileName, axis='x')
+  writeTransectWeights(xTransectFileName, 'x', *computeTransectWeights('x'))
 
 if(not os.path.exists(yTransectFileName)):
-  getTransectWeights(yTransectFileName, axis='y')
-  
+  writeTransectWeights(yTransectFileName, 'y', *computeTransectWeights('y'))
@@ -1,96 +1,130 @@
 #!/usr/bin/env python
 import numpy
+import scipy.sparse
 from netCDF4 import Dataset
 
 from optparse import OptionParser
 
 import os.path
-
-import shapely.geometry
+import time
 
 from progressbar import ProgressBar, Percentage, Bar, ETA
 
-def computeSectionEdgeIndices(point1,point2):
-  #print 'section at between', point1, point2
-  
-  shapelySection = shapely.geometry.LineString([point1,point2])
-
-
-  edgeIndices = []
-  for iEdge in range(nEdges):
-    if shapelySection.intersects(shapelyEdges[iEdge]):
-      edgeIndices.append(iEdge)
-  if(len(edgeIndices) == 0):
-    return (numpy.array(edgeIndices),numpy.array([]))
-
-  # favor larger x and y in a tie
-  edgeIndices = numpy.array(edgeIndices)[numpy.argsort(xEdge[edgeIndices] + yEdge[edgeIndices])[::-1]]
-  distanceSquared = (xEdge[edgeIndices] - point1[0])**2 + (yEdge[edgeIndices] - point1[1])**2
-  currentEdge = edgeIndices[numpy.argmin(distanceSquared)]
-  distanceSquared = (xEdge[edgeIndices] - point2[0])**2 + (yEdge[edgeIndices] - point2[1])**2
-  endEdge = edgeIndices[numpy.argmin(distanceSquared)]
-  xEnd = point2[0] #xEdge[endEdge]
-  yEnd = point2[1] #yEdge[endEdge]
-
-
-  # first vertex is the one closer to the end point
-  vertices = verticesOnEdge[currentEdge,:]
-  distances = (xVertex[vertices] - xEnd)**2 + (yVertex[vertices] - yEnd)**2
-  iVertex = vertices[numpy.argmin(distances)]
-  
-  edgeIndices = [currentEdge]
-  if(vertices[0] == iVertex):
-    edgeSigns = [1]
-  else:
-    assert(vertices[1] == iVertex)
-    edgeSigns = [-1]
-
-  while(currentEdge != endEdge):
-    edges = edgesOnVertex[iVertex,:]
-    if(endEdge in edges):
-      currentEdge = endEdge
-    else:
-      # favor larger x and y in a tie
-      edges = edges[numpy.argsort(xEdge[edges] + yEdge[edges])[::-1]]
-      minDistance = 1e30
-      currentEdge = -1
-      for iEdge in edges:
-        if iEdge < 0:
-          continue
-        if iEdge in edgeIndices:
-          continue
-        
-        distance = (xEdge[iEdge] - xEnd)**2 + (yEdge[iEdge] - yEnd)**2
-        if(distance < minDistance):
-          minDistance = distance
-          currentEdge = iEdge
-
-    if(currentEdge < 0):
-      print "Warning: endEdge not found!"
-      print xEdge[edgeIndices], yEdge[edgeIndices]
-      print xEdge[endEdge], yEdge[endEdge]
-      # we must be done done
-      break
-    
-    edgeIndices.append(currentEdge)
-    vertex1 = verticesOnEdge[currentEdge,0]
-    vertex2 = verticesOnEdge[currentEdge,1]
-    if(vertex1 == iVertex):
-      iVertex = vertex2
-      edgeSigns.append(1)
-    else:
-      assert(vertex2 == iVertex)
-      iVertex = vertex1
-      edgeSigns.append(-1)
-  
-  return (numpy.array(edgeIndices),numpy.array(edgeSigns))
+from sectionPaths import getSectionPaths
+from mpas_mesh import MpasMesh
+
+def computeTransport(layerThickness, normalVelocity, zInterfaceCell):
+  # transport through each section (and the area it passes through) on the
+  # output z grid, computed as a sparse product of (section edge, model level)
+  # to (output z bin, section) overlap areas and the normal velocity
+  nSectionEdges = len(sectionEdges)
+  cell1 = cellsOnEdge[sectionEdges,0]
+  cell2 = cellsOnEdge[sectionEdges,1]
+  bottomLevels = maxLevelEdgeTop[sectionEdges]
+  levels = numpy.arange(nVertLevels)
+  valid = levels[numpy.newaxis,:] <= bottomLevels[:,numpy.newaxis]
+
+  zBot = 0.5*(zInterfaceCell[cell1,bottomLevels+1]
+            + zInterfaceCell[cell2,bottomLevels+1])
+  layerThicknessEdge = 0.5*(layerThickness[cell1,:] + layerThickness[cell2,:])
+  # as in computeTransportLoop, the bottom level has its own thickness and each
+  # level above it takes the thickness of the level below
+  thickness = numpy.zeros((nSectionEdges,nVertLevels))
+  thickness[:,0:-1] = layerThicknessEdge[:,1:]
+  bottomMask = levels[numpy.newaxis,:] == bottomLevels[:,numpy.newaxis]
+  thickness[bottomMask] = layerThicknessEdge[bottomMask]
+  thickness[valid == False] = 0.
+  heightAboveBot = numpy.zeros((nSectionEdges,nVertLevels+1))
+  heightAboveBot[:,0:-1] = numpy.cumsum(thickness[:,::-1],axis=1)[:,::-1]
+  zLevelTop = zBot[:,numpy.newaxis] + heightAboveBot[:,0:-1]
+  zLevelBot = zBot[:,numpy.newaxis] + heightAboveBot[:,1:]
+
+  # output z bins from top to bottom, with anything below the grid included in
+  # the deepest bin
+  zBinTop = z[0:-1]
+  zBinBot = numpy.array(z[1:])
+  zBinBot[-1] = -numpy.inf
+  firstBin = numpy.searchsorted(-zBinBot, -zLevelTop, side='right')
+  lastBin = numpy.searchsorted(-zBinTop, -zLevelBot, side='left') - 1
+  binCount = (lastBin - firstBin + 1)*valid
+
+  rows = []
+  cols = []
+  areas = []
+  for binOffset in range(numpy.amax(binCount)):
+    (edgeIndices, levelIndices) = numpy.nonzero(binCount > binOffset)
+    binIndices = firstBin[edgeIndices,levelIndices] + binOffset
+    dz = (numpy.minimum(zLevelTop[edgeIndices,levelIndices],
+                        zBinTop[binIndices])
+          - numpy.maximum(zLevelBot[edgeIndices,levelIndices],
+                          zBinBot[binIndices]))
+    mask = dz > 0.
+    edgeIndices = edgeIndices[mask]
+    rows.append(binIndices[mask]*nx + sectionXIndices[edgeIndices])
+    cols.append(edgeIndices*nVertLevels + levelIndices[mask])
+    areas.append(dvEdge[sectionEdges[edgeIndices]]*dz[mask])
+
+  rows = numpy.concatenate([numpy.zeros(0,int)] + rows)
+  cols = numpy.concatenate([numpy.zeros(0,int)] + cols)
+  areas = numpy.concatenate([numpy.zeros(0)] + areas)
+  signs = sectionSigns[cols//nVertLevels]
+
+  transportOperator = scipy.sparse.csr_matrix(
+      (signs*areas, (rows, cols)),
+      shape=((nz-1)*nx, nSectionEdges*nVertLevels))
+  velocity = numpy.asarray(normalVelocity[sectionEdges,:]).ravel()
+  transportSection = transportOperator.dot(velocity).reshape(nz-1,nx)
+  transportSectionArea = numpy.bincount(rows, weights=areas,
+                                        minlength=(nz-1)*nx).reshape(nz-1,nx)
+  return (transportSection, transportSectionArea)
+
+def computeTransportLoop(layerThickness, normalVelocity, zInterfaceCell):
+  # the original implementation of computeTransport, used for validation
+  transportSection = numpy.zeros((nz-1,nx))
+  transportSectionArea = numpy.zeros((nz-1,nx))
+  for xIndex in range(nx):
+    for sIndex in range(len(sectionEdgeIndices[xIndex])):
+      iEdge = sectionEdgeIndices[xIndex][sIndex]
+      sign = sectionEdgeSigns[xIndex][sIndex]
+
+      cell1 = cellsOnEdge[iEdge,0]
+      cell2 = cellsOnEdge[iEdge,1]
+      levelIndex = maxLevelEdgeTop[iEdge]
+      zBot = 0.5*(zInterfaceCell[cell1,levelIndex+1] + zInterfaceCell[cell2,levelIndex+1])
+      layerThicknessEdge = 0.5*(layerThickness[cell1,levelIndex]
+                              + layerThickness[cell2,levelIndex])
+      zTop = zBot + layerThicknessEdge
+      for zIndex in range(nz-2,-1,-1):
+        # sum the fluxes (if any) within this level on the output grid
+        while (levelIndex >= 0) and (zBot < z[zIndex]):
+          v = normalVelocity[iEdge,levelIndex]
+          if(zTop <= z[zIndex]):
+            dz = zTop - zBot
+            zBot = zTop
+            layerThicknessEdge = 0.5*(layerThickness[cell1,levelIndex]
+                                    + layerThickness[cell2,levelIndex])
+            zTop += layerThicknessEdge
+            levelIndex -= 1
+          else:
+            dz = z[zIndex] - zBot
+            zBot = z[zIndex]
+          area = dvEdge[iEdge]*dz
+          transportSection[zIndex,xIndex] += sign*area*v
+          transportSectionArea[zIndex,xIndex] += area
+  return (transportSection, transportSectionArea)
 
-                       
 parser = OptionParser()
-           
+parser.add_option("--validate", action="store_true", dest="validate",
+                  help="compare the transport and timing against the original loop implementation")
+parser.add_option("--cacheFolder", type="string", dest="cacheFolder",
+                  help="folder in which to cache the mesh and the sections so they are only computed once for a given mesh (default: cache only the sections, in the run folder)")
 options, args = parser.parse_args()
 
 folder = args[0]
+if options.cacheFolder is None:
+  sectionCacheFolder = folder
+else:
+  sectionCacheFolder = options.cacheFolder
 
 inFile = Dataset('%s/output.nc'%folder,'r')
 outFileName = '%s/overturningStreamfunction.nc'%folder
@@ -111,22 +145,17 @@ else:
   nTimeOut = 0
 
 
-verticesOnEdge = inFile.variables['verticesOnEdge'][:,:]-1 # change to zero-based indexing
-cellsOnEdge = inFile.variables['cellsOnEdge'][:,:]-1 # change to zero-based indexing
-dvEdge = inFile.variables['dvEdge'][:]
-dcEdge = inFile.variables['dcEdge'][:]
-cellsOnVertex = inFile.variables['cellsOnVertex'][:,:]-1 # change to zero-based indexing
-nEdgesOnCell = inFile.variables['nEdgesOnCell'][:]
-edgesOnCell = inFile.variables['edgesOnCell'][:,:]-1
-edgesOnVertex = inFile.variables['edgesOnVertex'][:,:]-1
-verticesOnCell = inFile.variables['verticesOnCell'][:,:]-1
+# zero-based connectivity, cached by the mesh's file_id if cacheFolder is given
+mesh = MpasMesh('%s/output.nc'%folder, options.cacheFolder)
+verticesOnEdge = mesh.verticesOnEdge
+cellsOnEdge = mesh.cellsOnEdge
+dvEdge = mesh.dvEdge
 maxLevelCell = inFile.variables['maxLevelCell'][:]-1
-xEdge = inFile.variables['xEdge'][:]
-yEdge = inFile.variables['yEdge'][:]
-xVertex = inFile.variables['xVertex'][:]
-yVertex = inFile.variables['yVertex'][:]
-xCell = inFile.variables['xCell'][:]
-yCell = inFile.variables['yCell'][:]
+dcEdge = mesh.dcEdge
+xEdge = mesh.xEdge
+yEdge = mesh.yEdge
+xVertex = mesh.xVertex
+yVertex = mesh.yVertex
 
 
 if(continueOutput):
@@ -161,32 +190,22 @@ else:
   nz = int((zMax-zMin)/dz)+1
   z = numpy.linspace(zMax,zMin,nz)
 
-  #print "Building shapely edges"
-  shapelyEdges = []
-  for iEdge in range(nEdges):
-    points = []
-    for v in verticesOnEdge[iEdge,:]:
-      points.append((xVertex[v],yVertex[v]))
-    shapelyEdges.append(shapely.geometry.LineString(points))
-
   #print "Finding section indices"
+  startPoints = numpy.zeros((nx,2))
+  startPoints[:,0] = x
+  startPoints[:,1] = yMin
+  endPoints = numpy.array(startPoints)
+  endPoints[:,1] = yMax
+  (sectionEdgeIndices, sectionEdgeSigns) = getSectionPaths(
+      verticesOnEdge, dvEdge, dcEdge, xVertex, yVertex, xEdge, yEdge,
+      startPoints, endPoints, cacheFolder=sectionCacheFolder)
   maxSectionLength = 0
-  sectionEdgeIndices = []
-  sectionEdgeSigns = []
-  pbar = ProgressBar(widgets=[Percentage(), Bar(), ETA()], maxval=len(x)).start()
   for xIndex in range(len(x)):
-    #print xIndex, '/', len(x)-1
-    xSection = x[xIndex]
-    (edgeIndices, edgeSigns) = computeSectionEdgeIndices((xSection,yMin),(xSection,yMax))
+    edgeIndices = sectionEdgeIndices[xIndex]
     if(len(edgeIndices) != 0):
       xMean = numpy.mean(xEdge[edgeIndices])
       x[xIndex] = xMean
-
-    sectionEdgeIndices.append(edgeIndices)
-    sectionEdgeSigns.append(edgeSigns)
     maxSectionLength = max(maxSectionLength,len(edgeIndices))
-    pbar.update(xIndex+1)
-  pbar.finish()
     
   sectionIndicesArray = numpy.ma.masked_all((nx,maxSectionLength),int)
   sectionSignsArray = numpy.ma.masked_all((nx,maxSectionLength),int)
@@ -213,14 +232,20 @@ else:
 bottomDepth = inFile.variables['bottomDepth'][:]
 
 #print "Building maxLevelEdgeTop"
-maxLevelEdgeTop = -1*numpy.ones(nEdges,int)
-for iEdge in range(nEdges):
-  cell1 = cellsOnEdge[iEdge,0]
-  cell2 = cellsOnEdge[iEdge,1]
-  if(cell1 >= 0 and cell2 >= 0):
-    maxLevelEdgeTop[iEdge] = min(maxLevelCell[cell1],maxLevelCell[cell2])
-
-pbar = ProgressBar(widgets=[Percentage(), Bar(), ETA()], maxval=nTimeIn*nx).start()
+cell1 = cellsOnEdge[:,0]
+cell2 = cellsOnEdge[:,1]
+maxLevelEdgeTop = numpy.where(numpy.logical_and(cell1 >= 0, cell2 >= 0),
+                              numpy.minimum(maxLevelCell[cell1],
+                                            maxLevelCell[cell2]), -1)
+
+# the edges of all sections, with the section (x) index and sign of each
+sectionEdges = numpy.array(numpy.concatenate(sectionEdgeIndices), int)
+sectionSigns = numpy.array(numpy.concatenate(sectionEdgeSigns), int)
+sectionXIndices = numpy.concatenate(
+    [xIndex*numpy.ones(len(sectionEdgeIndices[xIndex]), int)
+     for xIndex in range(nx)])
+
+pbar = ProgressBar(widgets=[Percentage(), Bar(), ETA()], maxval=nTimeIn).start()
 for tIndex in range(nTimeOut,nTimeIn):
   #print "Time: ", ''.join(inFile.variables['xtime'][tIndex,:]).rstrip()
 
@@ -236,40 +261,22 @@ for tIndex in range(nTimeOut,nTimeIn):
   
         
   #print "Computing transport over sections"
-  transportSection = numpy.zeros((nz-1,nx))
-  transportSectionArea = numpy.zeros((nz-1,nx))
-  for xIndex in range(nx):
-    for sIndex in range(len(sectionEdgeIndices[xIndex])):
-      iEdge = sectionEdgeIndices[xIndex][sIndex]
-      sign = sectionEdgeSigns[xIndex][sIndex]
-
-      cell1 = cellsOnEdge[iEdge,0]
-      cell2 = cellsOnEdge[iEdge,1]
-      levelIndex = maxLevelEdgeTop[iEdge]
-      zBot = 0.5*(zInterfaceCell[cell1,levelIndex+1] + zInterfaceCell[cell2,levelIndex+1])
-      layerThicknessEdge = 0.5*(layerThickness[cell1,levelIndex]
-                              + layerThickness[cell2,levelIndex])
-      zTop = zBot + layerThicknessEdge
-      for zIndex in range(nz-2,-1,-1):
-        #print zIndex
-        # sum the fluxes (if any) within this level on the output grid
-        while (levelIndex >= 0) and (zBot < z[zIndex]):
-          #print zIndex, levelIndex, z[zIndex], zBot
-          v = normalVelocity[iEdge,levelIndex]
-          if(zTop <= z[zIndex]):
-            dz = zTop - zBot
-            zBot = zTop
-            layerThicknessEdge = 0.5*(layerThickness[cell1,levelIndex]
-                                    + layerThickness[cell2,levelIndex])
-            zTop += layerThicknessEdge
-            levelIndex -= 1
-          else:
-            dz = z[zIndex] - zBot
-            zBot = z[zIndex]
-          area = dvEdge[iEdge]*dz
-          transportSection[zIndex,xIndex] += sign*area*v
-          transportSectionArea[zIndex,xIndex] += area
-    pbar.update(tIndex*nx+xIndex+1)
+  t0 = time.time()
+  (transportSection, transportSectionArea) = computeTransport(
+      layerThickness, normalVelocity, zInterfaceCell)
+  if options.validate and tIndex == nTimeOut:
+    t1 = time.time()
+    (refTransport, refArea) = computeTransportLoop(
+        layerThickness, normalVelocity, zInterfaceCell)
+    t2 = time.time()
+    print 'transport: vectorized %.2f s, loop %.2f s' %(t1-t0, t2-t1)
+    print 'max transport difference %g (max transport %g)' \
+        %(numpy.amax(numpy.abs(transportSection - refTransport)),
+          numpy.amax(numpy.abs(refTransport)))
+    print 'max area difference %g (max area %g)' \
+        %(numpy.amax(numpy.abs(transportSectionArea - refArea)),
+          numpy.amax(refArea))
+  pbar.update(tIndex+1)
     
   transportMask = 1.0*(transportSectionArea > 0.0)
 
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 import numpy
+import scipy.sparse
 from netCDF4 import Dataset
 
 from optparse import OptionParser
@@ -8,42 +9,49 @@ from progressbar import ProgressBar, Percentage, Bar, ETA
 
 import os.path
 
+def buildHorizOperator():
+  # sparse operator from MPAS cells to the MISOMIP grid (flattened as
+  # yIndex*outNx + xIndex), including only ocean cells
+  oceanCell = maxLevelCell[xyCellIndices] >= 0
+  return scipy.sparse.csr_matrix(
+      (xyMpasToMisomipWeights*oceanCell,
+       (xyYIndices*outNx + xyXIndices, xyCellIndices)),
+      shape=(outNy*outNx, nCells))
+
+def buildTransectOperator(cellIndices, outIndices, weights, nOut):
+  # sparse operator from MPAS cell/level values (flattened as
+  # iCell*nVertLevels + k) to a transect (flattened as zIndex*nOut + outIndex)
+  # for the current ssh and layerThickness.  Each output point takes the
+  # value of the layer it falls in (piecewise-constant in the vertical), and
+  # is zero above the sea surface or below the sea floor.
+  nIntersections = len(cellIndices)
+  levels = numpy.arange(nVertLevels)
+  layerThick = layerThickness[cellIndices,:] * \
+      (levels[numpy.newaxis,:] <= maxLevelCell[cellIndices,numpy.newaxis])
+  depthBottom = numpy.cumsum(layerThick, axis=1)
+  depth = ssh[cellIndices,numpy.newaxis] - z[numpy.newaxis,:]
+  valid = numpy.logical_and(depth >= 0.,
+                            depth <= depthBottom[:,-1:])
+  # the first layer whose bottom is at or below each depth
+  levelIndices = numpy.zeros((nIntersections, outNz), int)
+  for k in range(nVertLevels-1):
+    levelIndices += depthBottom[:,k:k+1] < depth
+  zIndices = numpy.tile(numpy.arange(outNz), (nIntersections, 1))
+  rows = zIndices*nOut + outIndices[:,numpy.newaxis]
+  cols = cellIndices[:,numpy.newaxis]*nVertLevels + levelIndices
+  values = numpy.tile(weights[:,numpy.newaxis], (1, outNz))
+  return scipy.sparse.csr_matrix((values[valid], (rows[valid], cols[valid])),
+                                 shape=(outNz*nOut, nCells*nVertLevels))
+
 def interpHoriz(field, normalize=True):
-  outField = numpy.zeros((outNy,outNx))
-  for sliceIndex in range(xyNSlices):
-    mask = xySliceIndices == sliceIndex
-    cellsSlice = xyCellIndices[mask]
-    fieldSlice = field[cellsSlice]*(maxLevelCell[cellsSlice] >= 0)
-    outField[xyYIndices[mask],xyXIndices[mask]] += (xyMpasToMisomipWeights[mask]
-      * fieldSlice)
+  outField = horizOperator.dot(numpy.asarray(field)).reshape(outNy,outNx)
   if normalize:
     outField[xyOceanMask] /= xyOceanFraction[xyOceanMask]
     outField[xyOceanMask == False] = 0.
   return outField
 
 def interpXZTransect(field, normalize=True):
-  outField = numpy.zeros((outNz,outNx))
-
-  for sliceIndex in range(xzNSlices):
-    mask = xzSliceIndices == sliceIndex
-    cellsSlice = xzCellIndices[mask]
-    xIndices = xzXIndices[mask]
-    weights = xzMpasToMisomipWeights[mask]
-    for index in range(len(cellsSlice)):
-      iCell = cellsSlice[index]
-      xIndex = xIndices[index]
-      weight = weights[index]
-      layerThick = layerThickness[iCell,:]
-      layerThick[maxLevelCell[iCell]+1:] = 0.
-      zInterface = numpy.zeros(2*nVertLevels)
-      fieldColumn = numpy.zeros(2*nVertLevels)
-      fieldColumn[0::2] = field[iCell,:]
-      fieldColumn[1::2] = field[iCell,:]
-      zInterface[0] = ssh[iCell]
-      zInterface[1::2] = ssh[iCell] - numpy.cumsum(layerThick[:])
-      zInterface[2::2] = ssh[iCell] - numpy.cumsum(layerThick[:-1])
-      outField[:,xIndex] += weight*numpy.interp(z, zInterface[::-1], fieldColumn[::-1],
-                                                left=0., right=0.)
+  outField = xzOperator.dot(numpy.asarray(field).ravel()).reshape(outNz,outNx)
 
   if normalize:
     outField[xzOceanMask] /= xzOceanFraction[xzOceanMask]
@@ -52,28 +60,7 @@ def interpXZTransect(field, normalize=True):
   return outField
 
 def interpYZTransect(field, normalize=True):
-  outField = numpy.zeros((outNz,outNy))
-
-  for sliceIndex in range(yzNSlices):
-    mask = yzSliceIndices == sliceIndex
-    cellsSlice = yzCellIndices[mask]
-    yIndices = yzYIndices[mask]
-    weights = yzMpasToMisomipWeights[mask]
-    for index in range(len(cellsSlice)):
-      iCell = cellsSlice[index]
-      yIndex = yIndices[index]
-      weight = weights[index]
-      layerThick = layerThickness[iCell,:]
-      layerThick[maxLevelCell[iCell]+1:] = 0.
-      zInterface = numpy.zeros(2*nVertLevels)
-      fieldColumn = numpy.zeros(2*nVertLevels)
-      fieldColumn[0::2] = field[iCell,:]
-      fieldColumn[1::2] = field[iCell,:]
-      zInterface[0] = ssh[iCell]
-      zInterface[1::2] = ssh[iCell] - numpy.cumsum(layerThick[:])
-      zInterface[2::2] = ssh[iCell] - numpy.cumsum(layerThick[:-1])
-      outField[:,yIndex] += weight*numpy.interp(z, zInterface[::-1], fieldColumn[::-1],
-                                                left=0., right=0.)
+  outField = yzOperator.dot(numpy.asarray(field).ravel()).reshape(outNz,outNy)
 
   if normalize:
     outField[yzOceanMask] /= yzOceanFraction[yzOceanMask]
@@ -130,28 +117,22 @@ inVars = inFile.variables
 xyCellIndices = inVars['cellIndices'][:]
 xyXIndices = inVars['xIndices'][:]
 xyYIndices = inVars['yIndices'][:]
-xySliceIndices = inVars['sliceIndices'][:]
 xyMpasToMisomipWeights = inVars['mpasToMisomipWeights'][:]
 inFile.close()
-xyNSlices = numpy.amax(xySliceIndices)+1
 
 inFile = Dataset('%s/xTransectIntersections.nc'%folder,'r')
 inVars = inFile.variables
 yzCellIndices = inVars['cellIndices'][:]
 yzYIndices = inVars['yIndices'][:]
-yzSliceIndices = inVars['sliceIndices'][:]
 yzMpasToMisomipWeights = inVars['mpasToMisomipWeights'][:]
 inFile.close()
-yzNSlices = numpy.amax(yzSliceIndices)+1
 
 inFile = Dataset('%s/yTransectIntersections.nc'%folder,'r')
 inVars = inFile.variables
 xzCellIndices = inVars['cellIndices'][:]
 xzXIndices = inVars['xIndices'][:]
-xzSliceIndices = inVars['sliceIndices'][:]
 xzMpasToMisomipWeights = inVars['mpasToMisomipWeights'][:]
 inFile.close()
-xzNSlices = numpy.amax(xzSliceIndices)+1
 
 dynamicTopo = experiment in ['Ocean3', 'Ocean4', 'IceOcean1', 'IceOcean2']
 
@@ -166,6 +147,10 @@ if(continueOutput):
 else:
   outFile = Dataset(outFileName,'w',format='NETCDF4')
 
+  # the number of output months that are complete and don't need to be
+  # recomputed when the script is run again
+  outFile.nCompleteTimes = 0
+
   outFile.createDimension('nTime', None)
   outFile.createDimension('nx', outNx)
   outFile.createDimension('ny', outNy)
@@ -280,12 +265,20 @@ nVertices = len(outputFile.dimensions['nVertices'])
 nCells = len(outputFile.dimensions['nCells'])
 nEdges = len(outputFile.dimensions['nEdges'])
 nVertLevels = len(outputFile.dimensions['nVertLevels'])
+# only time levels that are in all input files (which may still be being
+# written by the model or the streamfunction scripts)
 nTimeIn = len(outputFile.dimensions['Time'])
+nTimeIn = min(nTimeIn, len(landIceFile.dimensions['Time']))
 nTimeIn = min(nTimeIn, len(bsfFile.dimensions['Time']))
 nTimeIn = min(nTimeIn, len(osfFile.dimensions['Time']))
 
 if(continueOutput):
-  nTimeOut = max(0, len(outFile.dimensions['nTime'])-2)
+  if 'nCompleteTimes' in outFile.ncattrs():
+    nTimeOut = int(outFile.nCompleteTimes)
+  else:
+    # written before nCompleteTimes was added, so the last month may have been
+    # incomplete
+    nTimeOut = max(0, len(outFile.dimensions['nTime'])-2)
 else:
   nTimeOut = 0
 
@@ -296,11 +289,10 @@ areaCell = outputVars['areaCell'][:]
 bathymetry = -outputVars['bottomDepth'][:]
 maxLevelCell = outputVars['maxLevelCell'][:]-1
 
-cellMask = numpy.zeros((nCells, nVertLevels))
-for iCell in range(nCells):
-  k = maxLevelCell[iCell]
-  if (k >= 0):
-    cellMask[iCell,0:k+1] = 1.0
+cellMask = 1.0*(numpy.arange(nVertLevels)[numpy.newaxis,:]
+                <= maxLevelCell[:,numpy.newaxis])
+
+horizOperator = buildHorizOperator()
 
 xyOceanFraction = interpHoriz(cellMask[:,0], normalize=False)
 xyOceanMask = xyOceanFraction > 0.001
@@ -325,11 +317,20 @@ timesOut = months+12*years
 notDone = timesOut >= nTimeOut
 timesIn = numpy.nonzero(notDone)[0]
 
+if(continueOutput):
+  print 'skipping %i complete months, processing %i new time levels' \
+      %(nTimeOut, len(timesIn))
+
 pbar = ProgressBar(widgets=[Percentage(), Bar(), ETA()], maxval=nTimeIn).start()
 timeOut = -1
 for timeIn in timesIn:
   if(timesOut[timeIn] > timeOut):
     timeOut = timesOut[timeIn]
+    # all earlier months have been written.  The current month is only
+    # complete once a later month is found, since the model may still be
+    # adding time levels to it
+    outFile.nCompleteTimes = timeOut
+    outFile.sync()
     year = years[timeIn]
     day = daysBeforeMonth[months[timeIn]]
     vars['time'][timeOut] = secPerYear*year + secPerDay*day
@@ -391,7 +392,13 @@ for timeIn in timesIn:
 
   #writeVar('overturningStreamfunction', resampleXZ(sfOverturn),
   #                    resampleXZ(osfMask) > .999)
-  
+
+  # the transect operators depend on ssh and layerThickness at this time
+  xzOperator = buildTransectOperator(xzCellIndices, xzXIndices,
+                                     xzMpasToMisomipWeights, outNx)
+  yzOperator = buildTransectOperator(yzCellIndices, yzYIndices,
+                                     yzMpasToMisomipWeights, outNy)
+
   xzOceanFraction = interpXZTransect(cellMask, normalize=False)
   xzOceanMask = xzOceanFraction > 0.001
 
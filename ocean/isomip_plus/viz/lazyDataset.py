@@ -0,0 +1,47 @@
+'''
+Lazy read access to NetCDF files for the viz scripts.  Time-dependent
+variables are read one time slice (hyperslab) at a time rather than as whole
+arrays, and time-independent (mesh) fields are kept in a small LRU cache.
+Files opened more than once share the same handle and cache.
+'''
+import numpy
+from netCDF4 import Dataset
+from collections import OrderedDict
+import os.path
+
+# open datasets and their caches of static fields, by absolute path
+openDatasets = {}
+
+class LazyDataset(object):
+
+  def __init__(self, fileName, maxCachedFields=32):
+    self.fileName = os.path.abspath(fileName)
+    if self.fileName not in openDatasets:
+      openDatasets[self.fileName] = (Dataset(self.fileName,'r'),
+                                     OrderedDict())
+    (self.dataset, self.staticCache) = openDatasets[self.fileName]
+    self.maxCachedFields = maxCachedFields
+    self.dimensions = self.dataset.dimensions
+    self.variables = self.dataset.variables
+
+  def getTimeSlice(self, varName, tIndex):
+    # read only the given time index of a variable with Time as its first
+    # dimension
+    return self.dataset.variables[varName][tIndex,...]
+
+  def getStatic(self, varName):
+    # read a time-independent field as a numpy array, keeping the most
+    # recently used fields in memory
+    if varName in self.staticCache:
+      field = self.staticCache.pop(varName)
+    else:
+      field = numpy.array(self.dataset.variables[varName][:])
+    self.staticCache[varName] = field
+    while len(self.staticCache) > self.maxCachedFields:
+      self.staticCache.popitem(last=False)
+    return field
+
+  def close(self):
+    if self.fileName in openDatasets:
+      openDatasets.pop(self.fileName)
+      self.dataset.close()
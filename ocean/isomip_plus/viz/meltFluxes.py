@@ -0,0 +1,114 @@
+'''
+Reduction of the land-ice fluxes of ISOMIP+ runs to time series of melt flux,
+melt area, thermal driving and friction velocity over the ice shelf, and a
+NetCDF file combining these time series for the members of a parameter study
+so they can be plotted without reading each member's output again.
+'''
+import numpy
+from netCDF4 import Dataset
+import os
+
+rho_fw = 1000.
+secPerYear = 365*24*60*60
+
+def reduceMember(task):
+  # area-weighted sums over the ice shelf of the melt flux, melt area,
+  # thermal driving and friction velocity at each time with nonzero melt in
+  # one member's land-ice flux file.  The result is cached next to the file
+  # and recomputed only if the file has changed or sshMax is different.
+  (inFileName, sshMax, chunkSize) = task
+  cacheFileName = '%s_meltFluxes.npz'%os.path.splitext(inFileName)[0]
+  fileTime = os.path.getmtime(inFileName)
+  if os.path.exists(cacheFileName):
+    cache = numpy.load(cacheFileName)
+    if cache['fileTime'] == fileTime and cache['sshMax'] == sshMax:
+      return (cache['times'], cache['lastTime'], cache['totalMeltFlux'],
+              cache['meltArea'], cache['thermalDrivingSum'],
+              cache['frictionVelocitySum'])
+
+  inFile = Dataset(inFileName,'r')
+  inVars = inFile.variables
+
+  areaCell = inVars['areaCell'][:]
+
+  timesLocal = inVars['daysSinceStartOfSim'][:]
+
+  nTime = len(inFile.dimensions['Time'])
+  totalMeltFlux = numpy.zeros(nTime)
+  meltArea = numpy.zeros(nTime)
+  thermalDrivingSum = numpy.zeros(nTime)
+  frictionVelocitySum = numpy.zeros(nTime)
+  timeMask = numpy.zeros(nTime,bool)
+  for start in range(0,nTime,chunkSize):
+    stop = min(start+chunkSize,nTime)
+    freshwaterFlux = inVars['landIceFreshwaterFlux'][start:stop,:]
+    fraction = inVars['landIceFraction'][start:stop,:]
+    ssh = inVars['ssh'][start:stop,:]
+    thermalDriving = (inVars['landIceBoundaryLayerTemperature'][start:stop,:]
+                   - inVars['landIceInterfaceTemperature'][start:stop,:])
+    frictionVelocity = inVars['landIceFrictionVelocity'][start:stop,:]
+
+    meltRate = freshwaterFlux/rho_fw*secPerYear
+    weights = (ssh < sshMax)*areaCell[numpy.newaxis,:]
+    totalMeltFlux[start:stop] = numpy.sum(weights*meltRate,axis=1)
+    meltArea[start:stop] = numpy.sum(weights*fraction,axis=1)
+    thermalDrivingSum[start:stop] = numpy.sum(weights*thermalDriving,axis=1)
+    frictionVelocitySum[start:stop] = numpy.sum(weights*frictionVelocity,axis=1)
+    timeMask[start:stop] = numpy.logical_not(numpy.all(freshwaterFlux == 0.,
+                                                       axis=1))
+  inFile.close()
+
+  result = (numpy.array(timesLocal[timeMask]), timesLocal[-1],
+            totalMeltFlux[timeMask], meltArea[timeMask],
+            thermalDrivingSum[timeMask], frictionVelocitySum[timeMask])
+  numpy.savez(cacheFileName, fileTime=fileTime, sshMax=sshMax,
+              times=result[0], lastTime=result[1], totalMeltFlux=result[2],
+              meltArea=result[3], thermalDrivingSum=result[4],
+              frictionVelocitySum=result[5])
+  return result
+
+def writeCombinedMeltFluxes(fileName, paramName, paramValues, results):
+  # write the results of reduceMember for each member of a parameter study,
+  # padded with NaNs to the longest time series
+  nMembers = len(results)
+  nTimes = [len(result[0]) for result in results]
+  outFile = Dataset(fileName,'w',format='NETCDF4')
+  outFile.parameterName = paramName
+  outFile.createDimension('nMembers',nMembers)
+  outFile.createDimension('nTimes',max([1]+nTimes))
+  var = outFile.createVariable('parameterValues',str,('nMembers',))
+  for memberIndex in range(nMembers):
+    var[memberIndex] = str(paramValues[memberIndex])
+  outFile.createVariable('nTimeValues','i4',('nMembers',))[:] = nTimes
+  outFile.createVariable('lastTime','f8',('nMembers',))[:] = \
+      [result[1] for result in results]
+  varNames = ['times', 'totalMeltFlux', 'meltArea', 'thermalDrivingSum',
+              'frictionVelocitySum']
+  resultIndices = [0, 2, 3, 4, 5]
+  for (varName, resultIndex) in zip(varNames, resultIndices):
+    var = outFile.createVariable(varName,'f8',('nMembers','nTimes'))
+    values = numpy.nan*numpy.ones((nMembers,max([1]+nTimes)))
+    for memberIndex in range(nMembers):
+      values[memberIndex,0:nTimes[memberIndex]] = results[memberIndex][resultIndex]
+    var[:] = values
+  outFile.close()
+
+def readCombinedMeltFluxes(fileName):
+  # returns the parameter name, the parameter values and a list of the
+  # results of reduceMember for each member in a combined file
+  inFile = Dataset(fileName,'r')
+  paramName = inFile.parameterName
+  paramValues = [str(value) for value in inFile.variables['parameterValues'][:]]
+  nTimes = inFile.variables['nTimeValues'][:]
+  lastTimes = inFile.variables['lastTime'][:]
+  fields = [numpy.array(inFile.variables[varName][:]) for varName in
+            ['times', 'totalMeltFlux', 'meltArea', 'thermalDrivingSum',
+             'frictionVelocitySum']]
+  inFile.close()
+  results = []
+  for memberIndex in range(len(paramValues)):
+    n = nTimes[memberIndex]
+    results.append((fields[0][memberIndex,0:n], lastTimes[memberIndex],
+                    fields[1][memberIndex,0:n], fields[2][memberIndex,0:n],
+                    fields[3][memberIndex,0:n], fields[4][memberIndex,0:n]))
+  return (paramName, paramValues, results)
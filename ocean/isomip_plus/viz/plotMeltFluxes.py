@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 import numpy
-from netCDF4 import Dataset
 
 from optparse import OptionParser
 import matplotlib
@@ -12,6 +11,9 @@ import matplotlib.cm as cm
 import glob
 
 import os
+from multiprocessing import Pool, cpu_count
+
+from meltFluxes import reduceMember, readCombinedMeltFluxes
 
 parser = OptionParser()
 
@@ -20,6 +22,14 @@ parser.add_option("--out_dir", type="string", default='meltPlots', dest="out_dir
 parser.add_option("--ssh_max", type="float", default=0., dest='ssh_max')
 parser.add_option("--tavg_start", type="float", default=0.5, dest='tavg_start')
 parser.add_option("--tavg_end", type="float", default=1.0, dest='tavg_end')
+parser.add_option("--nprocs", type="int", default=cpu_count(), dest='nprocs',
+                  help="the number of members to reduce at once")
+parser.add_option("--chunk_size", type="int", default=100, dest='chunk_size',
+                  help="the number of time levels to read at once")
+parser.add_option("--combined_file", type="string", dest='combined_file',
+                  help="a file of the melt fluxes of all members of a parameter study "
+                       "(written by run_Ocean0_param_study.py) to plot instead of "
+                       "reading each member's land-ice fluxes")
            
 options, args = parser.parse_args()
 
@@ -27,7 +37,16 @@ paramPaths = args
 paramName = None
 outPath = options.out_dir
 paramNumericalValues = []
-if(len(paramPaths) == 0):
+if(options.combined_file is not None):
+  (paramName, paramValues, combinedResults) = readCombinedMeltFluxes(options.combined_file)
+  # the index of each member's results stands in for its path
+  paramPaths = range(len(paramValues))
+  for paramValue in paramValues:
+    try:
+      paramNumericalValues.append(float(paramValue))
+    except ValueError:
+      pass
+elif(len(paramPaths) == 0):
   paramPaths = ['.']
 elif(len(paramPaths) > 1):
   paramName = paramPaths[0].split('_')[-2]
@@ -52,9 +71,6 @@ try:
 except OSError:
   pass
 
-rho_fw = 1000.
-secPerYear = 365*24*60*60
-
 varNames = ['meanMeltRate', 'totalMeltFlux', 'thermalDriving', 'frictionVelocity']
 unit = ['m/yr', 'GT/yr', 'deg C', 'cm/s']
 
@@ -66,53 +82,43 @@ maxTime = 0.
 if paramName is not None:
   validParamIndices = numpy.zeros(len(paramValues),bool)
 
+memberFileNames = []
 for paramIndex in range(len(paramPaths)):
   paramPath = paramPaths[paramIndex]
-  inFileName = '%s/%s'%(paramPath,options.in_file)
-  if(not os.path.exists(inFileName)):
-    continue
+  if(options.combined_file is not None):
+    inFileName = paramPath
+  else:
+    inFileName = '%s/%s'%(paramPath,options.in_file)
+    if(not os.path.exists(inFileName)):
+      continue
 
   if(paramName is not None):
     legends.append('%s = %s'%(paramName, paramValues[paramIndex]))
     print legends[len(legends)-1]
     validParamIndices[paramIndex] = True
 
-  inFile = Dataset(inFileName,'r')
-
-  areaCell = inFile.variables['areaCell'][:]
-
-  timesLocal = inFile.variables['daysSinceStartOfSim'][:]
+  memberFileNames.append(inFileName)
+
+tasks = [(inFileName, options.ssh_max, options.chunk_size) for inFileName in
+         memberFileNames]
+if(options.combined_file is not None):
+  results = [combinedResults[memberIndex] for memberIndex in memberFileNames]
+elif(options.nprocs > 1 and len(tasks) > 1):
+  pool = Pool(min(options.nprocs, len(tasks)))
+  results = pool.map(reduceMember, tasks)
+  pool.close()
+  pool.join()
+else:
+  results = [reduceMember(task) for task in tasks]
 
-  maxTime = max(maxTime,timesLocal[-1])
+for (timesLocal, lastTime, totalMeltFlux, meltArea, thermalDrivingSum,
+     frictionVelocitySum) in results:
+  maxTime = max(maxTime,lastTime)
 
-  nTime = len(inFile.dimensions['Time'])
-  totalMeltFlux = numpy.ma.masked_all(nTime)
-  meltArea = numpy.ma.masked_all(nTime)
-  thermalDrivingSum = numpy.ma.masked_all(nTime)
-  frictionVelocitySum = numpy.ma.masked_all(nTime)
-  timeMask = numpy.zeros(nTime,bool)
-  for tIndex in range(nTime):
-    freshwaterFlux = inFile.variables['landIceFreshwaterFlux'][tIndex,:]
-    if(numpy.all(freshwaterFlux == 0.)):
-      continue
-    fraction = inFile.variables['landIceFraction'][tIndex,:]
-    ssh = inFile.variables['ssh'][tIndex,:]
-    thermalDriving = (inFile.variables['landIceBoundaryLayerTemperature'][tIndex,:]
-                   - inFile.variables['landIceInterfaceTemperature'][tIndex,:])
-    frictionVelocity = inFile.variables['landIceFrictionVelocity'][tIndex,:]
-
-    meltRate = freshwaterFlux/rho_fw*secPerYear
-    sshMask = ssh < options.ssh_max
-    totalMeltFlux[tIndex] = numpy.sum(sshMask*meltRate*areaCell)
-    meltArea[tIndex] = numpy.sum(sshMask*fraction*areaCell)
-    thermalDrivingSum[tIndex] = numpy.sum(sshMask*thermalDriving*areaCell)
-    frictionVelocitySum[tIndex] = numpy.sum(sshMask*frictionVelocity*areaCell)
-    timeMask[tIndex] = True
-
-  times.append(timesLocal[timeMask])
-  fields.append([totalMeltFlux[timeMask]/meltArea[timeMask], 1e-12*totalMeltFlux[timeMask],
-                 thermalDrivingSum[timeMask]/meltArea[timeMask],
-                 1e2*frictionVelocitySum[timeMask]/meltArea[timeMask]])
+  times.append(timesLocal)
+  fields.append([totalMeltFlux/meltArea, 1e-12*totalMeltFlux,
+                 thermalDrivingSum/meltArea,
+                 1e2*frictionVelocitySum/meltArea])
 
 if(maxTime < 1/24.):
   timeUnit = 's'
@@ -1,13 +1,10 @@
 #!/usr/bin/env python
 import numpy
-from netCDF4 import Dataset
 
 from optparse import OptionParser
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-from matplotlib.patches import Polygon
-from matplotlib.collections import PatchCollection
 import matplotlib.colors as colors
 
 import os
@@ -15,6 +12,11 @@ import os.path
 
 import copy
 
+from mpas_mesh import MpasMesh, from_csr
+from cellPatches import getCellPolygons, makeCellCollection, \
+    getSectionCellIndices
+from lazyDataset import LazyDataset
+
 def makeFerretColormap():
   red = numpy.array([[0,0.6],
                      [0.15,1],
@@ -45,30 +47,18 @@ def makeFerretColormap():
   return cmap
 
 
-def computeCellPatches(mask):
-  patches = []
-  for iCell in range(nCells):
-    if(not mask[iCell]):
-      continue
-    nVert = nVerticesOnCell[iCell]
-    vertexIndices = verticesOnCell[iCell,:nVert]
-    vertices = numpy.zeros((nVert,2))
-    vertices[:,0] = 1e-3*xVertex[vertexIndices]
-    vertices[:,1] = 1e-3*yVertex[vertexIndices]
-    #middle = numpy.mean(vertices,axis=0)
-
-    #expansion = 1.05
-    # expand by 1% to avoid annoying gaps
-    #for iVert in range(nVert):
-      #vertices[iVert,:] = expansion*(vertices[iVert,:]-middle) + middle
-    polygon = Polygon(vertices, True)
-    patches.append(polygon)
-    
-  p = PatchCollection(patches, cmap=ferretMap, alpha=1.)
-    
-  return p
-  
+def fieldSelected(*prefixes):
+  # whether any of the given plots was requested with --fields
+  if fields is None:
+    return True
+  for prefix in prefixes:
+    if prefix in fields:
+      return True
+  return False
+
 def plotHorizField(field, title, prefix, oceanDomain=True, vmin=None, vmax=None, figsize=[9,6]):
+  if not fieldSelected(prefix):
+    return
   outFileName = '%s/%s_%04i.png'%(options.outImageFolder,prefix,tIndex+1)
   if(os.path.exists(outFileName)):
     return
@@ -93,6 +83,8 @@ def plotHorizField(field, title, prefix, oceanDomain=True, vmin=None, vmax=None,
   plt.close()  
 
 def plotVertField(field, title, prefix, vmin=None, vmax=None, figsize=[9,6], inX=None, inZ=None):
+  if not fieldSelected(prefix):
+    return
   outFileName = '%s/%s_%04i.png'%(options.outImageFolder,prefix,tIndex+1)
   if(os.path.exists(outFileName)):
     return
@@ -111,6 +103,8 @@ def plotVertField(field, title, prefix, vmin=None, vmax=None, figsize=[9,6], inX
   plt.close()  
 
 def plotHorizVertField(field, name, units, prefix, oceanDomain=True, vmin=None, vmax=None):
+  if not fieldSelected('top%s'%prefix, 'bot%s'%prefix, 'center%s'%prefix):
+    return
   if(vmin is None):
     vmin = numpy.amin(field)
   if(vmax is None):
@@ -130,20 +124,6 @@ def plotHorizVertField(field, name, units, prefix, oceanDomain=True, vmin=None,
   field = field[sectionCellIndices,:].T
   plotVertField(field, '%s along center line (%s)'%(name,units), 'center%s'%prefix, vmin=vmin, vmax=vmax)
 
-def computeSectionCellIndices():
-  y = options.sectionY
-  xMin = numpy.amin(xCell)
-  xMax = numpy.amax(xCell)
-  xs = numpy.linspace(xMin,xMax,10000)
-  cellIndices = []
-  for x in xs:
-    distanceSquared = (x - xCell)**2 + (y-yCell)**2
-    index = numpy.argmin(distanceSquared)
-    if(len(cellIndices) == 0 or cellIndices[-1] != index):
-      cellIndices.append(index)
-
-  return numpy.array(cellIndices)
-
 def cellToSectionEdges(field):
   nx = len(sectionCellIndices)
   fieldMid = field[sectionCellIndices]
@@ -160,9 +140,20 @@ parser.add_option("--outImageFolder", type="string", default="plots", dest="outI
 parser.add_option("--inFolder", type="string", default=".", dest="inFolder")
 parser.add_option("--expt", type="int", default="1", dest="expt")
 parser.add_option("--sectionY", type="float", default=40e3, dest="sectionY")
+parser.add_option("--fields", type="string", dest="fields",
+                  help="comma-separated list of the plots to make (e.g. bsf,topTemp,osf), default all")
+parser.add_option("--timeIndices", type="string", dest="timeIndices",
+                  help="range of time indices to plot as start:stop, default all")
+parser.add_option("--cacheFolder", type="string", dest="cacheFolder",
+                  help="folder in which to cache the mesh, cell polygons and section cells (default: cache only the polygons and section cells, in inFolder)")
 
 options, args = parser.parse_args()
 
+if(options.fields is None):
+  fields = None
+else:
+  fields = options.fields.split(',')
+
 rho_sw = 1026.
 rho_fw = 1000.
 
@@ -175,30 +166,34 @@ except OSError as e:
 
 inFileName = '%s/init.nc'%(options.inFolder)
 print inFileName
-inFile = Dataset(inFileName,'r')
+inFile = LazyDataset(inFileName)
 #sspRef = numpy.array(inFile.variables['atmosphericPressure'])
-oceanThickness = numpy.sum(inFile.variables['layerThickness'][0,:,:],axis=1)
-bottomDepth = numpy.array(inFile.variables['bottomDepth'])
-landIceFraction = inFile.variables['landIceFraction'][0,:]
+oceanThickness = numpy.sum(inFile.getTimeSlice('layerThickness',0),axis=1)
+bottomDepth = inFile.getStatic('bottomDepth')
+landIceFraction = inFile.getTimeSlice('landIceFraction',0)
 sshRef = oceanThickness-bottomDepth
 inFile.close()
 
 inFileName = '%s/output.nc'%(options.inFolder)
-outputFile = Dataset(inFileName,'r')
+outputFile = LazyDataset(inFileName)
 inFileName = '%s/barotropicStreamfunction.nc'%(options.inFolder)
-bsfFile = Dataset(inFileName,'r')
+bsfFile = LazyDataset(inFileName)
 inFileName = '%s/overturningStreamfunction.nc'%(options.inFolder)
 useOSF = os.path.exists(inFileName)
 if(useOSF):
-  osfFile = Dataset(inFileName,'r')
+  osfFile = LazyDataset(inFileName)
 
 inFileName = '%s/land_ice_fluxes.nc'%(options.inFolder)
-landIceFluxesFile = Dataset(inFileName,'r')
+landIceFluxesFile = LazyDataset(inFileName)
+
 
+mesh = MpasMesh('%s/output.nc'%(options.inFolder), options.cacheFolder,
+                ['xCell', 'yCell', 'bottomDepth', 'nEdgesOnCell',
+                 'verticesOnCell', 'xVertex', 'yVertex', 'maxLevelCell'])
 
-xCell = numpy.array(outputFile.variables['xCell'])
-yCell = numpy.array(outputFile.variables['yCell'])
-bottomDepth = numpy.array(outputFile.variables['bottomDepth'])
+xCell = numpy.array(mesh.xCell)
+yCell = numpy.array(mesh.yCell)
+bottomDepth = numpy.array(mesh.bottomDepth)
 
 nVertices = len(outputFile.dimensions['nVertices'])
 nCells = len(outputFile.dimensions['nCells'])
@@ -209,12 +204,18 @@ nTime = min(nTime,len(bsfFile.dimensions['Time']))
 if(useOSF):
   nTime = min(nTime,len(osfFile.dimensions['Time']))
 
-nVerticesOnCell = numpy.array(outputFile.variables['nEdgesOnCell'])
-verticesOnCell = numpy.array(outputFile.variables['verticesOnCell'])-1
-xVertex = numpy.array(outputFile.variables['xVertex'])
-yVertex = numpy.array(outputFile.variables['yVertex'])
+if(options.timeIndices is None):
+  timeIndices = range(nTime)
+else:
+  (start, stop) = options.timeIndices.split(':')
+  timeIndices = range(nTime)[slice(int(start), int(stop))]
 
-maxLevelCell = numpy.array(outputFile.variables['maxLevelCell'])-1
+nVerticesOnCell = numpy.array(mesh.nEdgesOnCell)
+verticesOnCell = from_csr(mesh.cellOffsets, mesh.verticesOnCell)
+xVertex = numpy.array(mesh.xVertex)
+yVertex = numpy.array(mesh.yVertex)
+
+maxLevelCell = numpy.array(mesh.maxLevelCell)-1
 oceanMask = maxLevelCell >= 0
 cavityMask = numpy.logical_and(oceanMask,landIceFraction > 0.01)
 cellMask = numpy.zeros((nCells, nVertLevels))
@@ -224,26 +225,37 @@ for iCell in range(nCells):
     continue
   cellMask[iCell,0:k+1] = 1.0
 
-oceanPatches = computeCellPatches(oceanMask)
-cavityPatches = computeCellPatches(cavityMask)
-
-for tIndex in range(nTime):
-  bsf = numpy.array(bsfFile.variables['barotropicStreamfunctionCell'])[tIndex,:]
-  if(options.expt == 1):
-    vmin=-1
-    vmax=1
-  else:
-    vmin=-0.5
-    vmax=0.5
-  plotHorizField(bsf, 'barotropic streamfunction (Sv)', 'bsf', oceanDomain=True, vmin=vmin, vmax=vmax)
+if(options.cacheFolder is None):
+  cacheFolder = options.inFolder
+else:
+  cacheFolder = options.cacheFolder
+oceanPatches = makeCellCollection(getCellPolygons(
+    nVerticesOnCell, verticesOnCell, xVertex, yVertex, oceanMask,
+    cacheFolder=cacheFolder), ferretMap)
+cavityPatches = makeCellCollection(getCellPolygons(
+    nVerticesOnCell, verticesOnCell, xVertex, yVertex, cavityMask,
+    cacheFolder=cacheFolder), ferretMap)
+
+if fieldSelected('bsf'):
+  for tIndex in timeIndices:
+    bsf = numpy.array(bsfFile.getTimeSlice('barotropicStreamfunctionCell',tIndex))
+    if(options.expt == 1):
+      vmin=-1
+      vmax=1
+    else:
+      vmin=-0.5
+      vmax=0.5
+    plotHorizField(bsf, 'barotropic streamfunction (Sv)', 'bsf', oceanDomain=True, vmin=vmin, vmax=vmax)
   
 bsfFile.close()
 
 if(useOSF):
-  osfX = numpy.array(osfFile.variables['x'])
-  osfZ = numpy.array(osfFile.variables['z'])
+  osfX = osfFile.getStatic('x')
+  osfZ = osfFile.getStatic('z')
 
-sectionCellIndices = computeSectionCellIndices()
+sectionCellIndices = getSectionCellIndices(
+    xCell, yCell, (numpy.amin(xCell), options.sectionY),
+    (numpy.amax(xCell), options.sectionY), cacheFolder=cacheFolder)
 
 x = cellToSectionEdges(xCell)
 nx = len(x)
@@ -251,89 +263,104 @@ X = numpy.zeros((nVertLevels+1,nx))
 for zIndex in range(nVertLevels+1):
   X[zIndex,:] = x
 
-for tIndex in range(nTime):
+centerFields = ['centerTemp', 'centerSalinity', 'centerLayerThickness',
+                'centerVx', 'centerVy']
+
+for tIndex in timeIndices:
   print tIndex+1, '/', nTime
-  layerThickness = numpy.ma.masked_array(outputFile.variables['layerThickness'][tIndex,:,:],cellMask == 0.0)
-  Z = numpy.ma.masked_all((nVertLevels+1,nx))
-  Z[0,:] = 0.0
-  for zIndex in range(0,nVertLevels):
-    layerThicknessSection = cellToSectionEdges(layerThickness[:,zIndex])
-    Z[zIndex+1,:] = Z[zIndex,:] - layerThicknessSection
-  ZMin = numpy.ma.amin(Z,axis=0)
-  offset = cellToSectionEdges(-bottomDepth) - ZMin
-  for zIndex in range(nVertLevels+1):
-    Z[zIndex,:] += offset
-
-  try:
-    secPerYear = 365*24*60*60
-    freshwaterFlux = landIceFluxesFile.variables['landIceFreshwaterFlux'][tIndex,:]
-    meltRate = freshwaterFlux/rho_fw*secPerYear
-    plotHorizField(meltRate, 'melt rate (m/yr)', 'meltRate', oceanDomain=False, vmin=-100., vmax=100.)
-  except KeyError:
-    print "Key landIceFreshwaterFlux not found."
-    pass
-
-  try:
-    flux = landIceFluxesFile.variables['landIceHeatFlux'][tIndex,:]
-    plotHorizField(flux, 'ocean heat flux (W/s)', 'oceanHeatFlux', oceanDomain=False, vmin=-1e3, vmax=1e3)
-  except KeyError:
-    print "Key landIceHeatFlux not found."
-    pass
-
-  try:
-    flux = landIceFluxesFile.variables['heatFluxToLandIce'][tIndex,:]
-    plotHorizField(flux, 'ice heat flux (W/s)', 'iceHeatFlux', oceanDomain=False, vmin=-1e1, vmax=1e1)
-  except KeyError:
-    print "Key heatFluxToLandIce not found."
-    pass
-
-  try:
-    Ti = landIceFluxesFile.variables['landIceInterfaceTemperature'][tIndex,:]
-    To = landIceFluxesFile.variables['landIceBoundaryLayerTemperature'][tIndex,:]
-    thermalDriving = To-Ti
-    plotHorizField(thermalDriving, 'thermal driving (deg C)', 'thermalDriving', oceanDomain=False, vmin=-2, vmax=2)
-  except KeyError:
-    print "Key landIceInterfaceTemperature or landIceBoundaryLayerTemperature not found."
-    pass
-  try:
-    Si = landIceFluxesFile.variables['landIceInterfaceSalinity'][tIndex,:]
-    So = landIceFluxesFile.variables['landIceBoundaryLayerSalinity'][tIndex,:]
-    halineDriving = So-Si
-    plotHorizField(halineDriving, 'haline driving (PSU)', 'halineDriving', oceanDomain=False, vmin=-10, vmax=10)
-  except KeyError:
-    print "Key landIceInterfaceSalinity or landIceBoundaryLayerSalinity not found."
-    pass
-  try:
-    uStar = landIceFluxesFile.variables['landIceFrictionVelocity'][tIndex,:]
-    plotHorizField(uStar, 'friction velocity (m/s)', 'fricVel', oceanDomain=True, vmin=0, vmax=0.05)
-  except KeyError:
-    print "Key landIceFrictionVelocity not found."
-    pass
-  temp = outputFile.variables['temperature'][tIndex,:,:]
-  plotHorizVertField(temp, 'temperature', 'deg C', 'Temp', oceanDomain=True, vmin=-2.5, vmax=1.0)
-
-  salt = outputFile.variables['salinity'][tIndex,:,:]
-  plotHorizVertField(salt, 'salinity', 'PSU', 'Salinity', oceanDomain=True, vmin=33.8, vmax=34.7)
+  layerThickness = numpy.ma.masked_array(outputFile.getTimeSlice('layerThickness',tIndex),cellMask == 0.0)
+  if fieldSelected(*centerFields):
+    Z = numpy.ma.masked_all((nVertLevels+1,nx))
+    Z[0,:] = 0.0
+    for zIndex in range(0,nVertLevels):
+      layerThicknessSection = cellToSectionEdges(layerThickness[:,zIndex])
+      Z[zIndex+1,:] = Z[zIndex,:] - layerThicknessSection
+    ZMin = numpy.ma.amin(Z,axis=0)
+    offset = cellToSectionEdges(-bottomDepth) - ZMin
+    for zIndex in range(nVertLevels+1):
+      Z[zIndex,:] += offset
+
+  if fieldSelected('meltRate'):
+    try:
+      secPerYear = 365*24*60*60
+      freshwaterFlux = landIceFluxesFile.getTimeSlice('landIceFreshwaterFlux',tIndex)
+      meltRate = freshwaterFlux/rho_fw*secPerYear
+      plotHorizField(meltRate, 'melt rate (m/yr)', 'meltRate', oceanDomain=False, vmin=-100., vmax=100.)
+    except KeyError:
+      print "Key landIceFreshwaterFlux not found."
+      pass
+
+  if fieldSelected('oceanHeatFlux'):
+    try:
+      flux = landIceFluxesFile.getTimeSlice('landIceHeatFlux',tIndex)
+      plotHorizField(flux, 'ocean heat flux (W/s)', 'oceanHeatFlux', oceanDomain=False, vmin=-1e3, vmax=1e3)
+    except KeyError:
+      print "Key landIceHeatFlux not found."
+      pass
+
+  if fieldSelected('iceHeatFlux'):
+    try:
+      flux = landIceFluxesFile.getTimeSlice('heatFluxToLandIce',tIndex)
+      plotHorizField(flux, 'ice heat flux (W/s)', 'iceHeatFlux', oceanDomain=False, vmin=-1e1, vmax=1e1)
+    except KeyError:
+      print "Key heatFluxToLandIce not found."
+      pass
+
+  if fieldSelected('thermalDriving'):
+    try:
+      Ti = landIceFluxesFile.getTimeSlice('landIceInterfaceTemperature',tIndex)
+      To = landIceFluxesFile.getTimeSlice('landIceBoundaryLayerTemperature',tIndex)
+      thermalDriving = To-Ti
+      plotHorizField(thermalDriving, 'thermal driving (deg C)', 'thermalDriving', oceanDomain=False, vmin=-2, vmax=2)
+    except KeyError:
+      print "Key landIceInterfaceTemperature or landIceBoundaryLayerTemperature not found."
+      pass
+  if fieldSelected('halineDriving'):
+    try:
+      Si = landIceFluxesFile.getTimeSlice('landIceInterfaceSalinity',tIndex)
+      So = landIceFluxesFile.getTimeSlice('landIceBoundaryLayerSalinity',tIndex)
+      halineDriving = So-Si
+      plotHorizField(halineDriving, 'haline driving (PSU)', 'halineDriving', oceanDomain=False, vmin=-10, vmax=10)
+    except KeyError:
+      print "Key landIceInterfaceSalinity or landIceBoundaryLayerSalinity not found."
+      pass
+  if fieldSelected('fricVel'):
+    try:
+      uStar = landIceFluxesFile.getTimeSlice('landIceFrictionVelocity',tIndex)
+      plotHorizField(uStar, 'friction velocity (m/s)', 'fricVel', oceanDomain=True, vmin=0, vmax=0.05)
+    except KeyError:
+      print "Key landIceFrictionVelocity not found."
+      pass
+  if fieldSelected('topTemp', 'botTemp', 'centerTemp'):
+    temp = outputFile.getTimeSlice('temperature',tIndex)
+    plotHorizVertField(temp, 'temperature', 'deg C', 'Temp', oceanDomain=True, vmin=-2.5, vmax=1.0)
+
+  if fieldSelected('topSalinity', 'botSalinity', 'centerSalinity'):
+    salt = outputFile.getTimeSlice('salinity',tIndex)
+    plotHorizVertField(salt, 'salinity', 'PSU', 'Salinity', oceanDomain=True, vmin=33.8, vmax=34.7)
 
   plotHorizVertField(layerThickness, 'layer thickness', 'm', 'LayerThickness', oceanDomain=True, vmin=0.0, vmax=25.0)
 
-  ssh = outputFile.variables['ssh'][tIndex,:]
-  delta_ssh = ssh-sshRef
-  print 'delta_ssh', numpy.amin(delta_ssh), numpy.amax(delta_ssh)
-  #oceanThickness = numpy.sum(layerThickness,axis=1)
-  #sshDiff = ssh - (oceanThickness-bottomDepth)
-  #print 'sshDiff', numpy.amin(sshDiff), numpy.amax(sshDiff)
-  plotHorizField(delta_ssh, 'change in ssh (m)', 'deltaSSH', oceanDomain=True, vmin=-2, vmax=10)
+  if fieldSelected('deltaSSH'):
+    ssh = outputFile.getTimeSlice('ssh',tIndex)
+    delta_ssh = ssh-sshRef
+    print 'delta_ssh', numpy.amin(delta_ssh), numpy.amax(delta_ssh)
+    #oceanThickness = numpy.sum(layerThickness,axis=1)
+    #sshDiff = ssh - (oceanThickness-bottomDepth)
+    #print 'sshDiff', numpy.amin(sshDiff), numpy.amax(sshDiff)
+    plotHorizField(delta_ssh, 'change in ssh (m)', 'deltaSSH', oceanDomain=True, vmin=-2, vmax=10)
 
   #rho = numpy.array(outputFile.variables['potentialDensity'])[tIndex,:,:]-1000.
   #plotHorizVertField(rho, 'potential density', 'kg/m^3 - 1000.', 'PotRho', vmin=27., vmax=28.)
 
 #  N = numpy.array(outputFile.variables['BruntVaisalaFreqTop'])[tIndex,:,:]
 #  plotHorizVertField(N, 'Brunt Vaisala freq.', '1/s', 'BruntVaisala')
-  vx = numpy.array(outputFile.variables['velocityX'])[tIndex,:,:]
-  plotHorizVertField(vx, 'X velocity', 'm/s', 'Vx', oceanDomain=True)
-  vy = numpy.array(outputFile.variables['velocityY'])[tIndex,:,:]
-  plotHorizVertField(vy, 'Y velocity', 'm/s', 'Vy', oceanDomain=True)
+  if fieldSelected('topVx', 'botVx', 'centerVx'):
+    vx = numpy.array(outputFile.getTimeSlice('velocityX',tIndex))
+    plotHorizVertField(vx, 'X velocity', 'm/s', 'Vx', oceanDomain=True)
+  if fieldSelected('topVy', 'botVy', 'centerVy'):
+    vy = numpy.array(outputFile.getTimeSlice('velocityY',tIndex))
+    plotHorizVertField(vy, 'Y velocity', 'm/s', 'Vy', oceanDomain=True)
 #  Ri = numpy.array(outputFile.variables['RiTopOfCell'])[tIndex,:,:-1]
 #  plotHorizVertField(Ri, 'Richardson number', 'nondim.', 'Ri',vmin=-1., vmax=1.)
 #  try:
@@ -350,8 +377,8 @@ for tIndex in range(nTime):
 #    print "Key vertDiffTopOfCell not found."
 #    pass
 
-  if(useOSF):
-    osf = osfFile.variables['overturningStreamfunction'][tIndex,:,:]
+  if(useOSF and fieldSelected('osf')):
+    osf = osfFile.getTimeSlice('overturningStreamfunction',tIndex)
     if(options.expt == 1):
       vmin=-0.3
       vmax=0.3
@@ -0,0 +1,156 @@
+'''
+Find sections (paths of edges through vertices) across an MPAS mesh between
+pairs of end points, for computing transport through transects.
+
+The mesh is treated as a graph with vertices as nodes, stored in CSR format.
+For each section, only edges within bandWidth*dcEdge of the straight line
+between the end points are kept, and each edge is weighted by its length
+(dvEdge) with a penalty that grows with its distance from the line, so a
+Dijkstra search from the vertex nearest the start point follows the line
+rather than any of the many equally short paths that wander away from it.
+Because the search only depends on the mesh and the end points, results can
+be cached to disk in a file named by a hash of both.
+'''
+import numpy
+import scipy.sparse
+import scipy.sparse.csgraph
+import os
+import os.path
+
+from cellPatches import getMeshHash
+
+def buildVertexGraph(verticesOnEdge, weights, edges, nVertices):
+  # returns a CSR graph of weights between the vertices of the given edges and
+  # a CSR matrix of the (one-based) edge joining each pair of vertices
+  vertex1 = verticesOnEdge[edges,0]
+  vertex2 = verticesOnEdge[edges,1]
+  rows = numpy.append(vertex1, vertex2)
+  cols = numpy.append(vertex2, vertex1)
+  graph = scipy.sparse.csr_matrix((numpy.tile(weights, 2), (rows, cols)),
+                                  shape=(nVertices, nVertices))
+  edgeLookup = scipy.sparse.csr_matrix((numpy.tile(edges+1, 2), (rows, cols)),
+                                       shape=(nVertices, nVertices))
+  return (graph, edgeLookup)
+
+def findNearestVertices(xVertex, yVertex, points):
+  # the index of the vertex closest to each (x, y) point
+  points = numpy.asarray(points)
+  vertices = numpy.zeros(len(points), int)
+  for index in range(len(points)):
+    distanceSquared = ((xVertex - points[index,0])**2
+                       + (yVertex - points[index,1])**2)
+    vertices[index] = numpy.argmin(distanceSquared)
+  return vertices
+
+def distanceToSegment(x, y, startPoint, endPoint):
+  # the distance from each point (x, y) to the segment between two points
+  direction = numpy.asarray(endPoint, float) - numpy.asarray(startPoint, float)
+  length2 = max(numpy.sum(direction**2), 1e-30)
+  fraction = ((x - startPoint[0])*direction[0]
+              + (y - startPoint[1])*direction[1])/length2
+  fraction = numpy.clip(fraction, 0., 1.)
+  return numpy.sqrt((x - startPoint[0] - fraction*direction[0])**2
+                    + (y - startPoint[1] - fraction*direction[1])**2)
+
+def computeSectionPaths(verticesOnEdge, dvEdge, dcEdge, xVertex, yVertex,
+                        xEdge, yEdge, startPoints, endPoints, bandWidth=1.):
+  # returns lists of edge indices and edge signs for each section.  The sign
+  # is 1 if the section goes from the first to the second vertex on the edge
+  # and -1 otherwise.  Sections with no path have no edges.
+  nVertices = len(xVertex)
+  verticesOnEdge = numpy.asarray(verticesOnEdge)
+  validEdges = numpy.nonzero(numpy.logical_and(verticesOnEdge[:,0] >= 0,
+                                               verticesOnEdge[:,1] >= 0))[0]
+  dvEdge = numpy.asarray(dvEdge)[validEdges]
+  dcEdge = numpy.asarray(dcEdge)[validEdges]
+  xEdge = numpy.asarray(xEdge)[validEdges]
+  yEdge = numpy.asarray(yEdge)[validEdges]
+  startVertices = findNearestVertices(xVertex, yVertex, startPoints)
+  endVertices = findNearestVertices(xVertex, yVertex, endPoints)
+
+  sectionEdgeIndices = []
+  sectionEdgeSigns = []
+  for sectionIndex in range(len(startVertices)):
+    distance = distanceToSegment(xEdge, yEdge, startPoints[sectionIndex],
+                                 endPoints[sectionIndex])/dcEdge
+    # widen the band if it doesn't connect the end points (e.g. where the
+    # line runs along the boundary of the mesh)
+    width = bandWidth
+    for attempt in range(4):
+      inBand = distance <= width
+      (graph, edgeLookup) = buildVertexGraph(
+          verticesOnEdge, dvEdge[inBand]*(1. + distance[inBand]**2),
+          validEdges[inBand], nVertices)
+      predecessors = scipy.sparse.csgraph.dijkstra(
+          graph, directed=False, indices=startVertices[sectionIndex],
+          return_predecessors=True)[1]
+      vertices = [endVertices[sectionIndex]]
+      while predecessors[vertices[-1]] >= 0:
+        vertices.append(predecessors[vertices[-1]])
+      if vertices[-1] == startVertices[sectionIndex] and len(vertices) >= 2:
+        break
+      width = 2*width
+    if vertices[-1] != startVertices[sectionIndex] or len(vertices) < 2:
+      print 'Warning: no path found for section %i'%sectionIndex
+      sectionEdgeIndices.append(numpy.zeros(0, int))
+      sectionEdgeSigns.append(numpy.zeros(0, int))
+      continue
+    vertices = numpy.array(vertices[::-1])
+    edges = numpy.asarray(edgeLookup[vertices[0:-1],vertices[1:]]).ravel()-1
+    signs = numpy.where(verticesOnEdge[edges,0] == vertices[0:-1], 1, -1)
+
+    # the path should stay within about a cell of the line
+    pathDistance = numpy.amax(distance[numpy.searchsorted(validEdges, edges)])
+    if pathDistance > bandWidth:
+      print 'Warning: section %i strays up to %.2f cells from its line'%(
+          sectionIndex, pathDistance)
+    sectionEdgeIndices.append(edges)
+    sectionEdgeSigns.append(signs)
+
+  return (sectionEdgeIndices, sectionEdgeSigns)
+
+def getSectionHash(verticesOnEdge, dvEdge, dcEdge, xVertex, yVertex, xEdge,
+                   yEdge, startPoints, endPoints, bandWidth):
+  # a hash of the mesh and the section end points
+  return getMeshHash([verticesOnEdge, dvEdge, dcEdge, xVertex, yVertex, xEdge,
+                      yEdge, startPoints, endPoints, [bandWidth]])
+
+def getSectionPaths(verticesOnEdge, dvEdge, dcEdge, xVertex, yVertex, xEdge,
+                    yEdge, startPoints, endPoints, bandWidth=1.,
+                    cacheFolder=None):
+  # computeSectionPaths, reading the result from cacheFolder if this mesh and
+  # these sections have been computed before, and writing it otherwise
+  if cacheFolder is None:
+    return computeSectionPaths(verticesOnEdge, dvEdge, dcEdge, xVertex,
+                               yVertex, xEdge, yEdge, startPoints, endPoints,
+                               bandWidth)
+
+  sectionHash = getSectionHash(verticesOnEdge, dvEdge, dcEdge, xVertex,
+                               yVertex, xEdge, yEdge, startPoints, endPoints,
+                               bandWidth)
+  cacheFileName = '%s/sectionPaths_%s.npz'%(cacheFolder, sectionHash)
+  if os.path.exists(cacheFileName):
+    cache = numpy.load(cacheFileName)
+    offsets = cache['offsets']
+    sectionEdgeIndices = numpy.split(cache['edgeIndices'], offsets[1:-1])
+    sectionEdgeSigns = numpy.split(cache['edgeSigns'], offsets[1:-1])
+    return (sectionEdgeIndices, sectionEdgeSigns)
+
+  (sectionEdgeIndices, sectionEdgeSigns) = computeSectionPaths(
+      verticesOnEdge, dvEdge, dcEdge, xVertex, yVertex, xEdge, yEdge,
+      startPoints, endPoints, bandWidth)
+
+  offsets = numpy.append(0, numpy.cumsum(
+      [len(edgeIndices) for edgeIndices in sectionEdgeIndices]))
+  # write to a temporary file first so another process never reads a partial
+  # cache
+  tempFileName = '%s.%i.tmp.npz'%(os.path.splitext(cacheFileName)[0],
+                                  os.getpid())
+  numpy.savez(tempFileName,
+              edgeIndices=numpy.concatenate([numpy.zeros(0, int)]
+                                            + sectionEdgeIndices),
+              edgeSigns=numpy.concatenate([numpy.zeros(0, int)]
+                                          + sectionEdgeSigns),
+              offsets=offsets)
+  os.rename(tempFileName, cacheFileName)
+  return (sectionEdgeIndices, sectionEdgeSigns)
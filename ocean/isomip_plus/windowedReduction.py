@@ -0,0 +1,78 @@
+'''
+Reductions of MPAS time-series fields over a window of time.  Each variable
+is read as contiguous hyperslabs of time levels (in as few requests as the
+chunk size allows) and area-weighted integrals are computed for all time
+levels at once.  Also a function for writing selected fields (with xtime and
+the global attributes of a template file) to a new, small NetCDF file rather
+than copying and modifying a whole file.
+'''
+import numpy
+from netCDF4 import Dataset
+
+def getTimeWindow(inFile, windowLength, timeVarName='daysSinceStartOfSim',
+                  timeScale=1./365.):
+  # the range of time indices (start, stop) covering the last windowLength of
+  # the time variable (scaled by timeScale, by default from days to years)
+  times = timeScale*inFile.variables[timeVarName][:]
+  indices = numpy.nonzero(times >= times[-1]-windowLength)[0]
+  return (indices[0], indices[-1]+1)
+
+def windowedAreaIntegrals(inFile, varNames, areaCell, start, stop,
+                          chunkSize=None):
+  # The time mean over time indices start:stop of the area integral of each
+  # variable, returned as a dictionary.  The variables must have dimensions
+  # (Time, nCells, ...); the results have the remaining dimensions.
+  # chunkSize limits the number of time levels read at once.
+  if chunkSize is None:
+    chunkSize = stop-start
+  areaCell = numpy.asarray(areaCell)
+  integrals = {}
+  for varName in varNames:
+    var = inFile.variables[varName]
+    total = 0.
+    for chunkStart in range(start, stop, chunkSize):
+      chunkEnd = min(chunkStart+chunkSize, stop)
+      field = numpy.array(var[chunkStart:chunkEnd,...])
+      total = total + numpy.tensordot(field, areaCell, axes=([1],[0])).sum(axis=0)
+    integrals[varName] = total/float(stop-start)
+  return integrals
+
+def windowedAreaMeans(inFile, varNames, areaCell, start, stop,
+                      chunkSize=None):
+  # like windowedAreaIntegrals but divided by the total area
+  integrals = windowedAreaIntegrals(inFile, varNames, areaCell, start, stop,
+                                    chunkSize)
+  totalArea = numpy.sum(areaCell)
+  means = {}
+  for varName in integrals:
+    means[varName] = integrals[varName]/totalArea
+  return means
+
+def writeFields(outFileName, templateFile, fields, copyVarNames=[]):
+  # Write the given fields (a dictionary of arrays) to a new file, using the
+  # dimensions, types and attributes of the variables of the same name in
+  # templateFile.  The global attributes of templateFile and the variables in
+  # copyVarNames that it has (e.g. xtime) are copied as they are.
+  outFile = Dataset(outFileName, 'w', format=templateFile.file_format)
+  outFile.setncatts({k: templateFile.getncattr(k)
+                     for k in templateFile.ncattrs()})
+  copyVarNames = [varName for varName in copyVarNames
+                  if varName in templateFile.variables]
+  for varName in copyVarNames + list(fields):
+    inVar = templateFile.variables[varName]
+    for dimName in inVar.dimensions:
+      if dimName in outFile.dimensions:
+        continue
+      dim = templateFile.dimensions[dimName]
+      if dim.isunlimited():
+        outFile.createDimension(dimName, None)
+      else:
+        outFile.createDimension(dimName, len(dim))
+    outVar = outFile.createVariable(varName, inVar.dtype, inVar.dimensions)
+    outVar.setncatts({k: inVar.getncattr(k) for k in inVar.ncattrs()
+                      if k != '_FillValue'})
+    if varName in fields:
+      outVar[:] = fields[varName]
+    else:
+      outVar[:] = inVar[:]
+  outFile.close()
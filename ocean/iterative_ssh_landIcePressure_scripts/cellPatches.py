@@ -0,0 +1 @@
+../isomip_plus/viz/cellPatches.py
\ No newline at end of file
@@ -5,6 +5,93 @@ import argparse
 import numpy
 from netCDF4 import Dataset
 
+def write_overlay(fileName, initFile, varNames):
+  # write the current values of the given variables of initFile (and the
+  # dimensions they need) to a small overlay file
+  overlayFile = Dataset(fileName, 'w', format=initFile.file_format)
+  for varName in varNames:
+    var = initFile.variables[varName]
+    for dimName in var.dimensions:
+      if dimName in overlayFile.dimensions:
+        continue
+      dim = initFile.dimensions[dimName]
+      if dim.isunlimited():
+        overlayFile.createDimension(dimName, None)
+      else:
+        overlayFile.createDimension(dimName, len(dim))
+    outVar = overlayFile.createVariable(varName, var.dtype, var.dimensions)
+    outVar[:] = var[:]
+  overlayFile.close()
+
+def get_run_duration():
+  # config_run_duration in namelist.ocean
+  namelistFile = open('namelist.ocean', 'r')
+  lines = namelistFile.readlines()
+  namelistFile.close()
+  for line in lines:
+    if line.split('=')[0].strip() == 'config_run_duration':
+      return line.split('=')[1].strip()
+  return None
+
+def set_run_duration(duration):
+  # set config_run_duration in namelist.ocean, returning the previous value
+  namelistFile = open('namelist.ocean', 'r')
+  lines = namelistFile.readlines()
+  namelistFile.close()
+  oldDuration = None
+  for index in range(len(lines)):
+    if lines[index].split('=')[0].strip() == 'config_run_duration':
+      oldDuration = lines[index].split('=')[1].strip()
+      lines[index] = '    config_run_duration = %s\n'%duration
+  namelistFile = open('namelist.ocean', 'w')
+  namelistFile.writelines(lines)
+  namelistFile.close()
+  return oldDuration
+
+# the full config_run_duration is kept in this file while namelist.ocean has
+# the short one, so it can be restored even if a run fails or is killed
+fullDurationFileName = 'full_run_duration.txt'
+
+def shorten_run_duration(duration):
+  # record the full run duration before replacing it with a short one
+  if not os.path.exists(fullDurationFileName):
+    durationFile = open(fullDurationFileName, 'w')
+    durationFile.write('%s\n'%get_run_duration())
+    durationFile.close()
+  set_run_duration(duration)
+
+def restore_run_duration():
+  # restore the full run duration recorded by shorten_run_duration, if any
+  if not os.path.exists(fullDurationFileName):
+    return
+  durationFile = open(fullDurationFileName, 'r')
+  fullDuration = durationFile.read().strip()
+  durationFile.close()
+  set_run_duration(fullDuration)
+  os.remove(fullDurationFileName)
+
+def anderson_update(x, f, history, depth, relaxation):
+  # The next iterate of the fixed-point iteration x <- x + f(x) using
+  # Anderson acceleration with the given depth (the number of previous
+  # iterates used) and relaxation.  history holds the previous (x, f) pairs
+  # and is updated.  With depth 0 this is simple relaxation.
+  history.append((x.copy(), f.copy()))
+  while len(history) > depth+1:
+    history.pop(0)
+  if len(history) < 2:
+    return x + relaxation*f
+  deltaX = numpy.array([history[i+1][0] - history[i][0] for i in range(len(history)-1)]).T
+  deltaF = numpy.array([history[i+1][1] - history[i][1] for i in range(len(history)-1)]).T
+  gamma = numpy.linalg.lstsq(deltaF, f, rcond=-1)[0]
+  return x + relaxation*f - numpy.dot(deltaX + relaxation*deltaF, gamma)
+
+def apply_overlay(fileName, initFile):
+  # copy the variables in an overlay file into initFile
+  overlayFile = Dataset(fileName, 'r')
+  for varName in overlayFile.variables:
+    initFile.variables[varName][:] = overlayFile.variables[varName][:]
+  overlayFile.close()
+
 
 ## This script was generated by setup_testcases.py as part of a driver_script file.
 parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
@@ -12,6 +99,12 @@ parser.add_argument("--iteration_count", dest="iteration_count", default=1, type
 parser.add_argument("--first_iteration", dest="first_iteration", default=0, type=int, help="The iteration to start from (for continuing iteration if iterrupted or insufficient)")
 parser.add_argument("--plot_globalStats", dest="plot_globalStats", action='store_true', help="If present, plot mean and max KE, min layer thickness and mean temperature for debugging.")
 parser.add_argument("--variable_to_modify", dest="variable_to_modify", default='ssh', help="Which variable, either ssh or landIcePressure, to modify at each iteration.")
+parser.add_argument("--max_tolerance", dest="max_tolerance", type=float, help="Stop iterating once the maximum |deltaSSH| (m) under land ice is below this value.")
+parser.add_argument("--rms_tolerance", dest="rms_tolerance", type=float, help="Stop iterating once the RMS deltaSSH (m) under land ice is below this value.  If both tolerances are given, both must be met.")
+parser.add_argument("--short_run_duration", dest="short_run_duration", help="A shorter config_run_duration (e.g. 0000_00:30:00) for the first --short_run_iterations iterations.  It must be at least the output interval of output_ssh.")
+parser.add_argument("--short_run_iterations", dest="short_run_iterations", default=0, type=int, help="The number of iterations run with --short_run_duration.")
+parser.add_argument("--relaxation", dest="relaxation", default=1.0, type=float, help="The fraction of the land-ice pressure correction applied at each iteration.")
+parser.add_argument("--anderson_depth", dest="anderson_depth", default=0, type=int, help="The number of previous iterations used for Anderson acceleration of the land-ice pressure update (0 for none).")
 
 args = parser.parse_args()
 dev_null = open('/dev/null', 'w')
@@ -22,93 +115,161 @@ if args.variable_to_modify not in ['ssh', 'landIcePressure']:
 
 subprocess.check_call(['ln', '-sfn', '../init_step2/ocean.nc', 'init0.nc'], stdout=dev_null, stderr=dev_null, env=os.environ.copy())
 
+# init0.nc is never modified.  The model reads init.nc, a single working copy
+# that is made once here and updated in place at each iteration.  The fields
+# modified at each iteration are also written to a small overlay file,
+# init_overlay_NNN.nc, so the state at each iteration can be inspected or
+# restored (with --first_iteration) without keeping a full copy of the init
+# file for every iteration.
+if args.variable_to_modify == 'ssh':
+  overlayVarNames = ['ssh', 'landIceDraft', 'layerThickness']
+else:
+  overlayVarNames = ['landIcePressure']
+
+# remove init.nc first in case it is a link to another init file
+subprocess.check_call(['rm', '-f', 'init.nc'], stdout=dev_null, stderr=dev_null, env=os.environ.copy())
+overlayFileName = 'init_overlay_%03i.nc'%args.first_iteration
+if args.first_iteration > 0 and not os.path.exists(overlayFileName) and os.path.exists('init%i.nc'%args.first_iteration):
+  # continuing from a full init file written by an older version of this script
+  subprocess.check_call(['cp', 'init%i.nc'%args.first_iteration, 'init.nc'], stdout=dev_null, stderr=dev_null, env=os.environ.copy())
+else:
+  subprocess.check_call(['cp', 'init0.nc', 'init.nc'], stdout=dev_null, stderr=dev_null, env=os.environ.copy())
+  if args.first_iteration > 0:
+    if not os.path.exists(overlayFileName):
+      print "Error: no overlay file", overlayFileName, "to continue from"
+      sys.exit(1)
+    initFile = Dataset('init.nc','r+')
+    apply_overlay(overlayFileName, initFile)
+    initFile.close()
+
+# an earlier run may have stopped while using the short run duration
+restore_run_duration()
+shortRun = args.short_run_duration is not None and args.first_iteration < args.short_run_iterations
+if shortRun:
+  shorten_run_duration("'%s'"%args.short_run_duration)
+
+andersonHistory = []
+
 if args.plot_globalStats:
   subprocess.check_call(['mkdir', '-p', 'statsPlots'], stdout=dev_null, stderr=dev_null, env=os.environ.copy())
 
-for iterIndex in range(args.first_iteration,args.iteration_count):
-    print " * Iteration %i/%i"%(iterIndex+1,args.iteration_count)
+try:
+  for iterIndex in range(args.first_iteration,args.iteration_count):
+      print " * Iteration %i/%i"%(iterIndex+1,args.iteration_count)
 
-    subprocess.check_call(['ln', '-sfn', 'init%i.nc'%iterIndex, 'init.nc'], stdout=dev_null, stderr=dev_null, env=os.environ.copy())
+      if shortRun and iterIndex >= args.short_run_iterations:
+        restore_run_duration()
+        shortRun = False
 
-    print "   * Running forward model"
-    # ./run_model.py
-    subprocess.check_call(['./run_model.py'], stdout=dev_null, stderr=dev_null, env=os.environ.copy())
-    print "   - Complete"
+      print "   * Running forward model"
+      # ./run_model.py
+      subprocess.check_call(['./run_model.py'], stdout=dev_null, stderr=dev_null, env=os.environ.copy())
+      print "   - Complete"
 
-    if args.plot_globalStats:
-        print "   * Plotting stats"
-        subprocess.check_call(['./plot_globalStats.py', '--out_dir=statsPlots','--iteration=%i'%iterIndex, 'kineticEnergyCellMax',
-                               'kineticEnergyCellAvg', 'layerThicknessMin'], stdout=dev_null, stderr=dev_null, env=os.environ.copy())
-        print "   - Complete"
+      if args.plot_globalStats:
+          print "   * Plotting stats"
+          subprocess.check_call(['./plot_globalStats.py', '--out_dir=statsPlots','--iteration=%i'%iterIndex, 'kineticEnergyCellMax',
+                                 'kineticEnergyCellAvg', 'layerThicknessMin'], stdout=dev_null, stderr=dev_null, env=os.environ.copy())
+          print "   - Complete"
 
 
-    print "   * Updating SSH or land-ice pressure"
+      print "   * Updating SSH or land-ice pressure"
 
-    # copy the init file first
+      # update the working init file in place
+      initFile = Dataset('init.nc','r+')
 
-    subprocess.check_call(['cp', 'init%i.nc'%iterIndex, 'init%i.nc'%(iterIndex+1)], stdout=dev_null, stderr=dev_null, env=os.environ.copy())
-    subprocess.check_call(['ln', '-sfn', 'init%i.nc'%(iterIndex+1), 'init.nc'], stdout=dev_null, stderr=dev_null, env=os.environ.copy())
-    initFile = Dataset('init.nc','r+')
+      nVertLevels = len(initFile.dimensions['nVertLevels'])
+      initSSH = initFile.variables['ssh'][0,:]
+      bottomDepth = initFile.variables['bottomDepth'][:]
+      modifySSHMask = initFile.variables['modifySSHMask'][0,:]
+      landIcePressure = initFile.variables['landIcePressure'][0,:]
+      lonCell = initFile.variables['lonCell'][:]
+      latCell = initFile.variables['latCell'][:]
+      maxLevelCell = initFile.variables['maxLevelCell'][:]
 
-    nVertLevels = len(initFile.dimensions['nVertLevels'])
-    initSSH = initFile.variables['ssh'][0,:]
-    bottomDepth = initFile.variables['bottomDepth'][:]
-    modifySSHMask = initFile.variables['modifySSHMask'][0,:]
-    landIcePressure = initFile.variables['landIcePressure'][0,:]
-    lonCell = initFile.variables['lonCell'][:]
-    latCell = initFile.variables['latCell'][:]
-    maxLevelCell = initFile.variables['maxLevelCell'][:]
-
-    inSSHFile = Dataset('output_ssh.nc','r')
-    nTime = len(inSSHFile.dimensions['Time'])
-    finalSSH = inSSHFile.variables['ssh'][nTime-1,:]
-    topDensity = inSSHFile.variables['density'][nTime-1,:,0]
-    inSSHFile.close()
-
-    mask = numpy.logical_and(maxLevelCell > 0, modifySSHMask == 1)
-
-    deltaSSH = mask*(finalSSH - initSSH)
-
-    # then, modifty the SSH or land-ice pressure
-    if args.variable_to_modify == 'ssh':
-      outInitFile.variables['ssh'][0,:] = finalSSH
-      # also update the landIceDraft variable, which will be used to compensate
-      # for the SSH due to land-ice pressure when computing sea-surface tilt
-      outInitFile.variables['landIceDraft'][0,:] = finalSSH
-      # we also need to stretch layerThickness to be compatible with the new SSH
-      stretch = (finalSSH + bottomDepth)/(initialSSH + bottomDepth)
-      var = initFile.variables['layerThickness']
-      for k in range(nVertLevels):
-        layerThickness[0,:,k] *= stretch
-    else:
-      # Moving the SSH up or down by deltaSSH would change the land-ice pressure by density(SSH)*g*deltaSSH.
-      # If deltaSSH is positive (moving up), it means the land-ice pressure is too small and if deltaSSH
-      # is negative (moving down), it means land-ice pressure is too large, the sign of the second term
-      # makes sense.
-      gravity = 9.80616
-      deltaLandIcePressure = topDensity*gravity*deltaSSH
-
-      landIcePressure = numpy.maximum(0.0, landIcePressure + deltaLandIcePressure)
-
-      initFile.variables['landIcePressure'][0,:] = landIcePressure
-
-      finalSSH = initSSH
+      inSSHFile = Dataset('output_ssh.nc','r')
+      nTime = len(inSSHFile.dimensions['Time'])
+      finalSSH = inSSHFile.variables['ssh'][nTime-1,:]
+      topDensity = inSSHFile.variables['density'][nTime-1,:,0]
+      inSSHFile.close()
 
-    initFile.close()
+      mask = numpy.logical_and(maxLevelCell > 0, modifySSHMask == 1)
+
+      deltaSSH = mask*(finalSSH - initSSH)
+
+      # measure convergence over the cells under land ice
+      landIceIndices = numpy.nonzero(numpy.logical_and(mask, landIcePressure > 0.))[0]
+      if len(landIceIndices) > 0:
+        maxDeltaSSH = numpy.amax(numpy.abs(deltaSSH[landIceIndices]))
+        rmsDeltaSSH = numpy.sqrt(numpy.mean(deltaSSH[landIceIndices]**2))
+      else:
+        maxDeltaSSH = 0.
+        rmsDeltaSSH = 0.
+      print "   max deltaSSH: %g, RMS deltaSSH: %g"%(maxDeltaSSH, rmsDeltaSSH)
+      convergenceFile = open('convergence.log', 'a')
+      convergenceFile.write('%i %g %g\n'%(iterIndex, maxDeltaSSH, rmsDeltaSSH))
+      convergenceFile.close()
+
+      converged = (args.max_tolerance is not None or args.rms_tolerance is not None) and \
+                  (args.max_tolerance is None or maxDeltaSSH < args.max_tolerance) and \
+                  (args.rms_tolerance is None or rmsDeltaSSH < args.rms_tolerance)
+
+      # then, modifty the SSH or land-ice pressure
+      if args.variable_to_modify == 'ssh':
+        initFile.variables['ssh'][0,:] = finalSSH
+        # also update the landIceDraft variable, which will be used to compensate
+        # for the SSH due to land-ice pressure when computing sea-surface tilt
+        initFile.variables['landIceDraft'][0,:] = finalSSH
+        # we also need to stretch layerThickness to be compatible with the new SSH
+        stretch = (finalSSH + bottomDepth)/(initSSH + bottomDepth)
+        var = initFile.variables['layerThickness']
+        var[0,:,:] = var[0,:,:]*stretch[:,numpy.newaxis]
+      else:
+        # Moving the SSH up or down by deltaSSH would change the land-ice pressure by density(SSH)*g*deltaSSH.
+        # If deltaSSH is positive (moving up), it means the land-ice pressure is too small and if deltaSSH
+        # is negative (moving down), it means land-ice pressure is too large, the sign of the second term
+        # makes sense.
+        gravity = 9.80616
+        deltaLandIcePressure = topDensity*gravity*deltaSSH
+
+        if args.anderson_depth > 0 or args.relaxation != 1.0:
+          indices = numpy.nonzero(mask)[0]
+          newLandIcePressure = landIcePressure.copy()
+          newLandIcePressure[indices] = anderson_update(landIcePressure[indices], deltaLandIcePressure[indices],
+                                                        andersonHistory, args.anderson_depth, args.relaxation)
+          landIcePressure = numpy.maximum(0.0, newLandIcePressure)
+        else:
+          landIcePressure = numpy.maximum(0.0, landIcePressure + deltaLandIcePressure)
+
+        initFile.variables['landIcePressure'][0,:] = landIcePressure
+
+        finalSSH = initSSH
+
+      # keep a record of the modified fields for this iteration
+      write_overlay('init_overlay_%03i.nc'%(iterIndex+1), initFile, overlayVarNames)
+
+      initFile.close()
+
+      # Write the largest change in SSH and its lon/lat to a file
+      logFile = open('maxDeltaSSH_%03i.log'%iterIndex,'w')
 
-    # Write the largest change in SSH and its lon/lat to a file
-    logFile = open('maxDeltaSSH_%03i.log'%iterIndex,'w')
+      indices = numpy.nonzero(landIcePressure)[0]
+      index = numpy.argmax(numpy.abs(deltaSSH[indices]))
+      iCell = indices[index]
+      logFile.write('deltaSSHMax: %g, lon/lat: %f %f, ssh: %g, landIcePressure: %g\n'%(deltaSSH[iCell],
+                                                                           180./numpy.pi*lonCell[iCell],
+                                                                           180./numpy.pi*latCell[iCell],
+                                                                           finalSSH[iCell], landIcePressure[iCell]))
+      logFile.close()
 
-    indices = numpy.nonzero(landIcePressure)[0]
-    index = numpy.argmax(numpy.abs(deltaSSH[indices]))
-    iCell = indices[index]
-    logFile.write('deltaSSHMax: %g, lon/lat: %f %f, ssh: %g, landIcePressure: %g\n'%(deltaSSH[iCell],
-                                                                         180./numpy.pi*lonCell[iCell],
-                                                                         180./numpy.pi*latCell[iCell],
-                                                                         finalSSH[iCell], landIcePressure[iCell]))
-    logFile.close()
+      print "   - Complete"
 
-    print "   - Complete"
+      if converged:
+        print " * Converged after %i iterations"%(iterIndex+1)
+        break
+finally:
+  # never leave namelist.ocean with the short run duration
+  restore_run_duration()
 
 if error:
     sys.exit(1)
@@ -6,34 +6,14 @@ from optparse import OptionParser
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-from matplotlib.patches import Polygon
-from matplotlib.collections import PatchCollection
 
 import os
 import os.path
 
 import copy
 
-def computeCellPatches():
-  patches = []
-  for iCell in range(nCells):
-    nVert = nVerticesOnCell[iCell]
-    vertexIndices = verticesOnCell[iCell,:nVert]
-    vertices = numpy.zeros((nVert,2))
-    vertices[:,0] = 1e-3*xVertex[vertexIndices]
-    vertices[:,1] = 1e-3*yVertex[vertexIndices]
-    #middle = numpy.mean(vertices,axis=0)
-
-    #expansion = 1.05
-    # expand by 1% to avoid annoying gaps
-    #for iVert in range(nVert):
-      #vertices[iVert,:] = expansion*(vertices[iVert,:]-middle) + middle
-    polygon = Polygon(vertices, True)
-    patches.append(polygon)
-
-  p = PatchCollection(patches, cmap=matplotlib.cm.jet, alpha=1.)
-
-  return p
+from cellPatches import getCellPolygons, makeCellCollection, \
+    getSectionCellIndices
 
 def plotHorizField(field, title, prefix, vmin=None, vmax=None, figsize=[6,9]):
   outFileName = '%s/%s_%04i.png'%(options.outImageFolder,prefix,tIndex+1)
@@ -89,19 +69,14 @@ def plotHorizVertField(field, name, units, prefix, vmin=None, vmax=None):
   field = field[sectionCellIndices,:].T
   plotVertField(field, '%s along center line (%s)'%(name,units), 'center%s'%prefix, vmin=vmin, vmax=vmax)
 
-def computeSectionCellIndices():
-  x = options.sectionX
-  yMin = numpy.amin(yCell)
-  yMax = numpy.amax(yCell)
-  ys = numpy.linspace(yMin,yMax,10000)
-  cellIndices = []
-  for y in ys:
-    distanceSquared = (x - xCell)**2 + (y-yCell)**2
-    index = numpy.argmin(distanceSquared)
-    if(len(cellIndices) == 0 or cellIndices[-1] != index):
-      cellIndices.append(index)
-
-  return numpy.array(cellIndices)
+def plotSectionField(field, title, prefix, figsize=[9,6]):
+  outFileName = '%s/%s_%04i.png'%(options.outImageFolder,prefix,tIndex+1)
+  plt.figure(figsize=figsize)
+  plt.plot(1e-3*yCell[sectionCellIndices], field[sectionCellIndices])
+  plt.xlabel('y (km)')
+  plt.title(title)
+  plt.savefig(outFileName)
+  plt.close()
 
 def cellToSectionEdges(field):
   ny = len(sectionCellIndices)
@@ -120,6 +95,8 @@ parser.add_option("--inFolder", type="string", default=".", dest="inFolder")
 parser.add_option("--initFile", type="string", default='init.nc', dest="initFile")
 parser.add_option("--sshFile", type="string", default='output_ssh.nc', dest="sshFile")
 parser.add_option("--iterIndex", type="int", default=0, dest="iterIndex")
+parser.add_option("--sectionX", type="float", dest="sectionX",
+                  help="x location (m) of the section along y to plot (default: the middle of the domain)")
 
 options, args = parser.parse_args()
 
@@ -142,6 +119,8 @@ nVerticesOnCell = numpy.array(inFile.variables['nEdgesOnCell'])
 verticesOnCell = numpy.array(inFile.variables['verticesOnCell'])-1
 xVertex = numpy.array(inFile.variables['xVertex'])
 yVertex = numpy.array(inFile.variables['yVertex'])
+xCell = numpy.array(inFile.variables['xCell'])
+yCell = numpy.array(inFile.variables['yCell'])
 
 nTime = len(sshFile.dimensions['Time'])
 landIcePressure = inFile.variables['landIcePressure'][nTime-1,:]
@@ -151,11 +130,23 @@ deltaSSH = ssh - inFile.variables['ssh'][0,:]
 
 inFile.close()
 
-cellPatches = computeCellPatches()
+cellPatches = makeCellCollection(getCellPolygons(
+    nVerticesOnCell, verticesOnCell, xVertex, yVertex,
+    cacheFolder=options.inFolder), matplotlib.cm.jet)
+
+if(options.sectionX is None):
+  sectionX = 0.5*(numpy.amin(xCell) + numpy.amax(xCell))
+else:
+  sectionX = options.sectionX
+sectionCellIndices = getSectionCellIndices(
+    xCell, yCell, (sectionX, numpy.amin(yCell)), (sectionX, numpy.amax(yCell)),
+    cacheFolder=options.inFolder)
 
 tIndex = options.iterIndex
 
 plotHorizField(landIcePressure, 'land-ice pressure (Pa)', 'landIcePressure')
 plotHorizField(ssh, 'SSH (m)', 'ssh')
 plotHorizField(deltaSSH, 'delta SSH (m)', 'deltaSSH')
-
+plotSectionField(landIcePressure, 'land-ice pressure along x = %g km (Pa)'%(1e-3*sectionX), 'sectionLandIcePressure')
+plotSectionField(ssh, 'SSH along x = %g km (m)'%(1e-3*sectionX), 'sectionSSH')
+plotSectionField(deltaSSH, 'delta SSH along x = %g km (m)'%(1e-3*sectionX), 'sectionDeltaSSH')
@@ -222,6 +222,12 @@ def generate_streams_files(config_file, case_path, configs):  # {{{
             # place.
             configure_streams_file(streams_root, streams, configs)
 
+            # Apply any presets requested on the command line.  Only forward
+            # streams are changed, since the output of init cases (e.g. the
+            # initial condition and forcing) is read back in by forward runs.
+            if streams_mode == 'forward':
+                apply_streams_presets(streams_root, configs)
+
             # Write out the streams file
             write_streams_file(streams_root, config_file, streams_filename,
                                '{}'.format(case_path))
@@ -263,12 +269,27 @@ def modify_stream_definition(streams_file, stream_conf):  # {{{
                           "template. Exiting...".format(name.strip()))
                     sys.exit(1)
 
+    # A name with wildcards (e.g. '*') modifies all existing (mutable) output
+    # streams with matching names, e.g. for presets that apply to any case
+    if any([char in name_to_modify for char in '*?[']):
+        for stream in streams_file.findall('stream'):
+            if 'output' in stream.attrib.get('type', '') and \
+                    fnmatch.fnmatch(stream.attrib['name'].strip(),
+                                    name_to_modify.strip()):
+                apply_stream_modifications(stream, stream_conf)
+        return
+
     # If not found, need to create it
     if not found:
         found = True
         stream_to_modify = ET.SubElement(streams_file, 'stream')
         stream_to_modify.set('name', name_to_modify)
 
+    apply_stream_modifications(stream_to_modify, stream_conf)
+# }}}
+
+
+def apply_stream_modifications(stream_to_modify, stream_conf):  # {{{
     # Make all of the modifications from the config file
     for child in stream_conf:
         # Process attribute changes
@@ -355,6 +376,24 @@ def apply_stream_template(streams_file, template_tag, configs):  # {{{
 # }}}
 
 
+def apply_streams_presets(streams_file, configs):  # {{{
+    # Apply the streams templates given with --streams_preset, which are found
+    # in the core's templates/streams directory
+    if not configs.has_option('script_input_arguments', 'streams_presets'):
+        return
+
+    presets = configs.get('script_input_arguments', 'streams_presets')
+    for preset in presets.split(','):
+        if preset.strip() == '':
+            continue
+        template_tag = ET.Element('template')
+        template_tag.set('file', preset.strip())
+        template_tag.set('path_base', 'script_core_dir')
+        template_tag.set('path', 'templates/streams')
+        apply_stream_template(streams_file, template_tag, configs)
+# }}}
+
+
 def write_streams_file(streams, config_file, filename, init_path):  # {{{
     config_tree = ET.parse(config_file)
     config_root = config_tree.getroot()
@@ -743,6 +782,8 @@ def process_validation_step(validation_tag, configs, script):  # {{{
             process_compare_fields_step(child, configs, script)
         if child.tag == 'compare_timers':
             process_compare_timers_step(child, configs, script)
+        if child.tag == 'benchmark_timers':
+            process_benchmark_timers_step(child, configs, script)
 # }}}
 
 
@@ -1038,6 +1079,63 @@ def process_timer_definition(timer_tag, configs, script, basedir, compdir):
                                                     basedir))
     script.write("        error = True\n")
 # }}}
+
+
+def process_benchmark_timers_step(benchmark_tag, configs, script):  # {{{
+    benchmark_script = '{}/benchmark_timers.py'.format(
+        configs.get('script_paths', 'utility_scripts'))
+
+    try:
+        rundir = benchmark_tag.attrib['rundir']
+    except KeyError:
+        print("ERROR: <benchmark_timers> tag is missing the 'rundir' "
+              "attribute.")
+        print("Exiting...")
+        sys.exit(1)
+
+    command_args = [benchmark_script, '-r', rundir]
+
+    if 'repeats' in benchmark_tag.attrib.keys():
+        command_args.extend(['-N', benchmark_tag.attrib['repeats']])
+    if 'tolerance' in benchmark_tag.attrib.keys():
+        command_args.extend(['--tolerance', benchmark_tag.attrib['tolerance']])
+    if 'alpha' in benchmark_tag.attrib.keys():
+        command_args.extend(['--alpha', benchmark_tag.attrib['alpha']])
+
+    timer_names = []
+    for child in benchmark_tag:
+        if child.tag == 'timer':
+            try:
+                timer_names.append(child.attrib['name'])
+            except KeyError:
+                print("ERROR: <timer> tag is missing the 'name' attribute.")
+                print("Exiting...")
+                sys.exit(1)
+
+    if len(timer_names) > 0:
+        command_args.append('-t')
+        command_args.extend(timer_names)
+
+    baseline_root = configs.get('script_paths', 'baseline_dir')
+    if baseline_root != 'NONE':
+        command_args.extend(['-b', '{}/{}/{}/benchmark.json'.format(
+            baseline_root, configs.get('script_paths', 'test_dir'), rundir)])
+
+    # written on one line, as in process_timer_definition, since wrapping
+    # could split timer names that contain spaces
+    command = 'subprocess.check_call([{}])'.format(
+        ', '.join(['"{}"'.format(arg) for arg in command_args]))
+
+    script.write('\n')
+    script.write('try:\n')
+    script.write('    {}\n'.format(command))
+    script.write("    print(' ** PASS Benchmark of timers in {}')\n".format(
+        rundir))
+    script.write('except subprocess.CalledProcessError:\n')
+    script.write("    print(' ** FAIL Benchmark of timers in {}')\n".format(
+        rundir))
+    script.write('    error = True\n')
+# }}}
 # }}}
 
 
@@ -1283,6 +1381,27 @@ def make_case_dir(config_file, base_path):  # {{{
 # }}}
 
 
+def write_setup_manifest(work_dir, generated_paths):  # {{{
+    # Record the top-level paths generated for a test in the manifest that
+    # clean_testcase.py reads, keeping any entries from an earlier setup.
+    manifest_path = '{}/setup_manifest'.format(work_dir)
+    paths = []
+    if os.path.exists(manifest_path):
+        manifest = open(manifest_path, 'r')
+        paths = [line.strip() for line in manifest if line.strip() != '']
+        manifest.close()
+
+    for path in generated_paths:
+        if path not in paths:
+            paths.append(path)
+
+    manifest = open(manifest_path, 'w')
+    for path in paths:
+        manifest.write('{}\n'.format(path))
+    manifest.close()
+# }}}
+
+
 def get_defined_files(config_file, init_path, configs):  # {{{
     config_tree = ET.parse(config_file)
     config_root = config_tree.getroot()
@@ -1539,6 +1658,19 @@ def get_case_name(config_file):  # {{{
 
     return name
 # }}}
+
+
+def get_driver_script_name(config_file):  # {{{
+    config_tree = ET.parse(config_file)
+    config_root = config_tree.getroot()
+
+    script_name = config_root.attrib['name']
+
+    del config_root
+    del config_tree
+
+    return script_name
+# }}}
 # }}}
 
 
@@ -1580,6 +1712,13 @@ if __name__ == "__main__":
                         help="If set, script will create case directories in "
                              "work_dir rather than the current directory.",
                         metavar="PATH")
+    parser.add_argument("--streams_preset", dest="streams_presets",
+                        help="A streams template (e.g. io_compact.xml) from "
+                             "the core's templates/streams directory to "
+                             "apply to every forward streams file that is set "
+                             "up, after the test case's own streams "
+                             "configuration. Can be given more than once.",
+                        action="append", metavar="FILE")
 
     args = parser.parse_args()
 
@@ -1645,6 +1784,10 @@ if __name__ == "__main__":
     else:
         config.set('script_paths', 'baseline_dir', 'NONE')
 
+    if args.streams_presets:
+        config.set('script_input_arguments', 'streams_presets',
+                   ','.join(args.streams_presets))
+
     if args.no_download:
         config.set('script_input_arguments', 'no_download', 'yes')
     else:
@@ -1726,6 +1869,10 @@ if __name__ == "__main__":
         # Only write history if we did something...
         write_history = False
 
+        # Top-level paths generated for this test, relative to work_dir, to be
+        # written to the manifest read by clean_testcase.py
+        generated_paths = []
+
         # Loop over all files in test_path that have the .xml extension.
         for file in os.listdir('{}'.format(test_path)):
             if fnmatch.fnmatch(file, '*.xml'):
@@ -1743,6 +1890,7 @@ if __name__ == "__main__":
                     # Ensure the case directory exists
                     case_dir = make_case_dir(config_file, work_dir)
                     case_name = get_case_name(config_file)
+                    generated_paths.append(case_dir.split('/')[0])
 
                     # Set case_dir path for function calls
                     config.set('script_paths', 'case_dir',
@@ -1776,8 +1924,12 @@ if __name__ == "__main__":
 
                     # Generate driver scripts.
                     generate_driver_scripts(config_file, config)
+                    generated_paths.append(get_driver_script_name(config_file))
                     print(" -- Set up driver script in {}".format(work_dir))
 
+        if len(generated_paths) > 0:
+            write_setup_manifest(work_dir, generated_paths)
+
     # Write the history of this command to the command_history file, for
     # provenance.
     if write_history and not args.quiet:
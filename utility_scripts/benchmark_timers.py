@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""
+Runs a case repeatedly to collect the distribution of one or more timers and
+optionally decides whether performance has regressed relative to a baseline.
+
+The run script given with -e (default ./run.py) is executed -N times in the
+run directory given with -r.  After each run, the requested timers are read
+from the log.*.out or timing.* files (as in compare_timers.py) and the
+throughput in simulated years per day (SYPD) is computed from the first
+timer and config_run_duration in the namelist.  The samples are written
+to a JSON file (benchmark.json in the run directory by default).
+
+If a baseline file (written by a previous invocation of this script) is
+given with -b, each timer is compared against its baseline distribution.
+A timer fails if its median is more than the tolerance (a fraction, default
+0.05) slower than the baseline median AND a one-sided Mann-Whitney U test
+rejects, at the significance level given by --alpha, the hypothesis that
+the new samples are no slower than the baseline samples inflated by the
+tolerance.  Requiring both keeps run-to-run noise from failing the test.
+The script exits 1 if any timer fails.
+
+Example:
+./benchmark_timers.py -r forward -N 5 -t "time integration" \\
+    -b baseline/forward/benchmark.json
+"""
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import numpy as np
+from scipy.stats import mannwhitneyu
+
+from compare_timers import find_timer_value
+
+
+def get_run_duration(namelist_file):#{{{
+    # Returns config_run_duration in seconds, or None if it can't be found.
+    # Durations have the form [[[YYYY-]MM-]DD_]hh:mm:ss
+    if not os.path.exists(namelist_file):
+        return None
+
+    duration = None
+    inFile = open(namelist_file, 'r')
+    for line in inFile:
+        if 'config_run_duration' in line:
+            duration = line.split("=")[-1].strip(" \t\n'\"")
+    inFile.close()
+
+    if duration is None:
+        return None
+
+    if '_' in duration:
+        (date, time) = duration.split('_')
+    else:
+        (date, time) = ('0', duration)
+
+    days = 0.0
+    dateParts = [int(part) for part in date.split('-')]
+    dateScales = [1.0, 30.0, 365.0]
+    for part, scale in zip(reversed(dateParts), dateScales):
+        days = days + part*scale
+
+    seconds = 0.0
+    timeParts = [float(part) for part in time.split(':')]
+    timeScales = [1.0, 60.0, 3600.0]
+    for part, scale in zip(reversed(timeParts), timeScales):
+        seconds = seconds + part*scale
+
+    return days*86400.0 + seconds
+#}}}
+
+def run_benchmark(run_directory, executable, repeats, timers,
+                  run_duration):#{{{
+    samples = {}
+    for timer_name in timers:
+        samples[timer_name] = []
+    samples['sypd'] = []
+
+    old_dir = os.getcwd()
+    os.chdir(run_directory)
+    for repeat in range(repeats):
+        print(" * Benchmark run %i of %i"%(repeat+1, repeats))
+        subprocess.check_call([executable])
+        for timer_name in timers:
+            timer_found, timer = find_timer_value(timer_name, '.')
+            if not timer_found:
+                print("ERROR: Timer '%s' not found after run %i"%(timer_name,
+                                                                  repeat+1))
+                sys.exit(1)
+            samples[timer_name].append(timer)
+        if run_duration is not None and samples[timers[0]][-1] > 0.0:
+            # simulated years per wall-clock day
+            sypd = (run_duration/(365.0*86400.0)) / \
+                (samples[timers[0]][-1]/86400.0)
+            samples['sypd'].append(sypd)
+    os.chdir(old_dir)
+
+    return samples
+#}}}
+
+def compare_samples(samples, baseline_samples, tolerance, alpha):#{{{
+    # Returns the median ratio (new/baseline), the p-value and whether the
+    # timer passed
+    samples = np.array(samples)
+    baseline_samples = np.array(baseline_samples)
+    ratio = np.median(samples)/np.median(baseline_samples)
+    if len(samples) < 2 or len(baseline_samples) < 2:
+        # no statistics possible, fall back on the tolerance alone
+        pValue = 0.0
+    else:
+        (statistic, pValue) = mannwhitneyu(
+            samples, baseline_samples*(1.0+tolerance), alternative='greater')
+    passed = not (ratio > 1.0+tolerance and pValue < alpha)
+    return ratio, pValue, passed
+#}}}
+
+if __name__ == "__main__":
+    # Define and process input arguments
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-r', '--run_directory', dest="run_directory", help="The directory of the case to benchmark", metavar="PATH", required=True)
+    parser.add_argument('-e', '--executable', dest="executable", help="The script that runs the case (default ./run.py)", metavar="EXE", default="./run.py")
+    parser.add_argument('-N', '--repeats', dest="repeats", help="The number of times to run the case (default 5)", type=int, default=5)
+    parser.add_argument('-t', '--timers', dest="timers", help="Names of the timers to benchmark (default 'time integration')", nargs="+", default=["time integration"])
+    parser.add_argument('-f', '--namelist', dest="namelist", help="Namelist file in the run directory used to find config_run_duration (default namelist.ocean)", metavar="FILE", default="namelist.ocean")
+    parser.add_argument('-o', '--output', dest="output", help="File to write the timer samples to (default benchmark.json in the run directory)", metavar="FILE")
+    parser.add_argument('-b', '--baseline', dest="baseline", help="A file written by this script to compare against", metavar="FILE")
+    parser.add_argument('--tolerance', dest="tolerance", help="Allowed fractional slowdown relative to the baseline (default 0.05)", type=float, default=0.05)
+    parser.add_argument('--alpha', dest="alpha", help="Significance level of the statistical test (default 0.05)", type=float, default=0.05)
+    parser.add_argument('--no_run', dest="no_run", help="If set, compare the samples already in the output file without running the case", action="store_true")
+
+    args = parser.parse_args()
+
+    if args.output is None:
+        args.output = '%s/benchmark.json'%args.run_directory
+
+    if args.no_run:
+        inFile = open(args.output, 'r')
+        samples = json.load(inFile)
+        inFile.close()
+    else:
+        run_duration = get_run_duration('%s/%s'%(args.run_directory,
+                                                 args.namelist))
+        samples = run_benchmark(args.run_directory, args.executable,
+                                args.repeats, args.timers, run_duration)
+        outFile = open(args.output, 'w')
+        json.dump(samples, outFile, indent=4, sort_keys=True)
+        outFile.close()
+
+    for timer_name in args.timers:
+        print("Timer %s: median %lf s, min %lf s, max %lf s over %i runs"%(
+            timer_name, np.median(samples[timer_name]),
+            np.amin(samples[timer_name]), np.amax(samples[timer_name]),
+            len(samples[timer_name])))
+    if len(samples['sypd']) > 0:
+        print("Throughput: median %lf simulated years per day"%(
+            np.median(samples['sypd'])))
+
+    if args.baseline is None:
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print("WARNING: Baseline file %s does not exist. Skipping "
+              "comparison."%(args.baseline))
+        sys.exit(0)
+
+    inFile = open(args.baseline, 'r')
+    baseline_samples = json.load(inFile)
+    inFile.close()
+
+    passed = True
+    for timer_name in args.timers:
+        if timer_name not in baseline_samples:
+            print("WARNING: Timer '%s' is not in the baseline"%(timer_name))
+            continue
+        ratio, pValue, timer_passed = compare_samples(
+            samples[timer_name], baseline_samples[timer_name],
+            args.tolerance, args.alpha)
+        if timer_passed:
+            status = 'PASS'
+        else:
+            status = 'FAIL'
+            passed = False
+        print(" ** %s timer %s: median ratio to baseline %lf, p-value %lf"%(
+            status, timer_name, ratio, pValue))
+
+    if len(samples['sypd']) > 0 and len(baseline_samples['sypd']) > 0:
+        print("Throughput change: %lf%%"%(
+            100.0*(np.median(samples['sypd']) /
+                   np.median(baseline_samples['sypd']) - 1.0)))
+
+    if passed:
+        sys.exit(0)
+    else:
+        sys.exit(1)
@@ -55,43 +55,31 @@ these jobs exits with exit status 1, this could be made to
 cancel dependent jobs (depending on the capabilities of the
 job scheduler).  Even if not, the next job would immediately
 exit once it runs, thus using negligible computing time.
+
+See restart_chain.py for a script that performs this loop itself.
 """
 from __future__ import absolute_import, division, print_function, \
     unicode_literals
 
-import os
 import argparse
 from datetime import datetime
 import sys
 
+from restart_chain import get_restart_pointer, read_restart_date, dateFormat
+
 parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
 parser.add_argument("-f", "--fileName", dest="fileName", help="A namelist file in which to find the name of the restart pointer", metavar="FILE", required=True)
 parser.add_argument("-e", "--endDate", dest="endDate", help="End date of the run", metavar="DATE", required=True)
 
 args = parser.parse_args()
 
-lines = []
-restartPointer = 'Restart_timestamp'
-inFile = open(args.fileName, 'r')
-for line in inFile:
-    if 'config_restart_timestamp_name' in line:
-        restartPointer = line.split("=")[-1]
-        restartPointer = restartPointer.lstrip(" \t'")
-        restartPointer = restartPointer.rstrip(" \t\n'")
-    lines.append(line)
-inFile.close()
-
-if not os.path.exists(restartPointer):
+restartDate = read_restart_date(get_restart_pointer(args.fileName))
+
+if restartDate is None:
     # nothing to do
     sys.exit(0)
 
-inFile = open(restartPointer, 'r')
-for line in inFile:
-    line = line.strip(" \t\n")
-    restartDate = datetime.strptime(line, '%Y-%m-%d_%H:%M:%S')
-    break
-inFile.close()
-endDate = datetime.strptime(args.endDate, '%Y-%m-%d_%H:%M:%S')
+endDate = datetime.strptime(args.endDate, dateFormat)
 if restartDate >= endDate:
     print('Run has completed.')
     sys.exit(1)
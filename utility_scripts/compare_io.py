@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Compares the size of the output files and the I/O timers of two runs of the
+same case, e.g. one set up normally and one set up with
+--streams_preset io_compact.xml (or io_compact_single.xml), to measure how
+much a streams preset reduces the output size and the time spent in I/O.
+
+For each file pattern, the total size of the matching files in each directory
+is printed along with the ratio of the comparison to the base.  For each
+timer, the values from the log (or GPTL timing) files are printed as with
+compare_timers.py.
+
+Example:
+./compare_io.py -b base/forward -c compact/forward \\
+    -p 'output*.nc' 'output/*.nc' -t io_write
+"""
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import glob
+import argparse
+
+from compare_timers import find_timer_value
+
+
+def total_size(directory, pattern):#{{{
+    # The number and total size in bytes of files matching a pattern
+    fileNames = [fileName for fileName in
+                 glob.glob('%s/%s'%(directory, pattern))
+                 if os.path.isfile(fileName)]
+    return len(fileNames), sum([os.path.getsize(fileName) for fileName in
+                                fileNames])
+#}}}
+
+def format_size(size):#{{{
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024.0:
+            return '%.1f %s'%(size, unit)
+        size = size/1024.0
+    return '%.1f TB'%size
+#}}}
+
+def compare_sizes(baseDirectory, comparisonDirectory, patterns):#{{{
+    print('Output size:')
+    for pattern in patterns:
+        baseCount, baseSize = total_size(baseDirectory, pattern)
+        compareCount, compareSize = total_size(comparisonDirectory, pattern)
+        if baseCount == 0 and compareCount == 0:
+            print('   %s: no files found'%pattern)
+            continue
+        print('   %s:'%pattern)
+        print('             Base: %s in %i files'%(format_size(baseSize),
+                                                    baseCount))
+        print('          Compare: %s in %i files'%(format_size(compareSize),
+                                                    compareCount))
+        if baseSize > 0:
+            print('            Ratio: %lf'%(compareSize/baseSize))
+#}}}
+
+def compare_io_timers(baseDirectory, comparisonDirectory, timers):#{{{
+    print('I/O timers:')
+    for timer in timers:
+        timer1_found, timer1 = find_timer_value(timer, baseDirectory)
+        timer2_found, timer2 = find_timer_value(timer, comparisonDirectory)
+        if not (timer1_found and timer2_found):
+            print('   %s: not found'%timer)
+            continue
+        print('   %s:'%timer)
+        print('             Base: %lf'%(timer1))
+        print('          Compare: %lf'%(timer2))
+        if timer1 > 0.0:
+            print('   Percent Change: %lf%%'%((timer2 - timer1)/timer1*100))
+#}}}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-b', '--base_directory', dest="base_directory", help="Directory of the baseline run.", required=True)
+    parser.add_argument('-c', '--comparison_directory', dest="comparison_directory", help="Directory of the comparison run.", required=True)
+    parser.add_argument('-p', '--patterns', dest="patterns", help="Patterns of the output files to compare (default output*.nc output/*.nc restarts/*.nc)", nargs="+", default=['output*.nc', 'output/*.nc', 'restarts/*.nc'])
+    parser.add_argument('-t', '--timers', dest="timers", help="Names of the I/O timers to compare (default io_write io_read)", nargs="+", default=['io_write', 'io_read'])
+
+    args = parser.parse_args()
+
+    compare_sizes(args.base_directory, args.comparison_directory,
+                  args.patterns)
+    compare_io_timers(args.base_directory, args.comparison_directory,
+                      args.timers)
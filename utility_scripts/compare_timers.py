@@ -49,31 +49,106 @@ def find_timer_value(timer_name, directory):#{{{
     return timer_found, timer
 #}}}
 
-# Define and process input arguments
-parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
-parser.add_argument('-b', '--base_directory', dest="base_directory", help="Directory with the baseline timer information.", required=True)
-parser.add_argument('-c', '--comparison_directory', dest="comparison_directory", help="Directory with the comparison timer information.", required=True)
-parser.add_argument('-t', '--timer', dest="timer", help="Name of the timer to compare", required=True)
-parser.add_argument('-s', '--speedup', dest="speedup", help="If set, only speedup will be printed. This is useful when making speedup plots.", action="store_true")
-
-args = parser.parse_args()
-
-timer1_found, timer1 = find_timer_value(args.timer, args.base_directory)
-timer2_found, timer2 = find_timer_value(args.timer, args.comparison_directory)
-
-if timer1_found and timer2_found:
-    try:
-        speedup = timer1 / timer2
-    except:
-        speedup = 1.0
-
-    percent = (timer2 - timer1) / timer1
-
-    if not args.speedup:
-        print("Comparing timer %s:"%(args.timer))
-        print("             Base: %lf"%(timer1))
-        print("          Compare: %lf"%(timer2))
-        print("   Percent Change: %lf%%"%(percent*100))
-        print("          Speedup: %lf"%(speedup))
-    else:
-        print("%lf"%(speedup))
+def find_timer_stats(timer_name, directory):#{{{
+    # Like find_timer_value, but also returns the min, max and average of the
+    # timer across tasks so load imbalance can be computed.  The built in MPAS
+    # timers report these directly.  For GPTL timers, one timing.* file is
+    # written per task, so the statistics are computed over those files.
+    regex = re.compile(r'(\S) (\S)')
+
+    sub_timer_name = timer_name.replace(' ', '_')
+
+    stats = {'total': 0.0, 'min': None, 'max': None, 'avg': None}
+    timer_found = False
+    task_totals = []
+    for file in sorted(os.listdir(directory)):
+        if fnmatch.fnmatch(file, "log.*.out"):
+            if timer_found:
+                continue
+            # The total, min, max and average of the timer with exactly this
+            # name if there is one, otherwise each summed over the matching
+            # timers as find_timer_value does for the total
+            exact_values = None
+            summed_values = None
+            stats_file = open('%s/%s'%(directory, file), "r")
+            for block in iter(lambda: stats_file.readline(), ""):
+                new_block_arr = regex.sub(r"\1_\2", block[2:]).split()
+                if len(new_block_arr) >= 6 and \
+                        sub_timer_name.find(new_block_arr[0]) >= 0:
+                    try:
+                        values = [float(new_block_arr[index]) for index in
+                                  [1, 3, 4, 5]]
+                    except ValueError:
+                        continue
+                    if new_block_arr[0] == sub_timer_name and \
+                            exact_values is None:
+                        exact_values = values
+                    if summed_values is None:
+                        summed_values = values
+                    else:
+                        summed_values = [summed + value for (summed, value)
+                                         in zip(summed_values, values)]
+            stats_file.close()
+            if exact_values is not None:
+                values = exact_values
+            else:
+                values = summed_values
+            if values is not None:
+                (stats['total'], stats['min'], stats['max'],
+                 stats['avg']) = values
+                timer_found = True
+        elif fnmatch.fnmatch(file, "timing.*"):
+            task_total = None
+            stats_file = open('%s/%s'%(directory, file), "r")
+            for block in iter(lambda: stats_file.readline(), ""):
+                new_block_arr = regex.sub(r"\1_\2", block[2:]).split()
+                if len(new_block_arr) >= 6 and \
+                        sub_timer_name.find(new_block_arr[0]) >= 0:
+                    try:
+                        task_total = (task_total or 0.0) + \
+                            float(new_block_arr[3])
+                    except ValueError:
+                        continue
+            stats_file.close()
+            if task_total is not None:
+                task_totals.append(task_total)
+
+    if not timer_found and len(task_totals) > 0:
+        timer_found = True
+        stats['total'] = task_totals[0]
+        stats['min'] = min(task_totals)
+        stats['max'] = max(task_totals)
+        stats['avg'] = sum(task_totals) / len(task_totals)
+
+    return timer_found, stats
+#}}}
+
+if __name__ == "__main__":
+    # Define and process input arguments
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-b', '--base_directory', dest="base_directory", help="Directory with the baseline timer information.", required=True)
+    parser.add_argument('-c', '--comparison_directory', dest="comparison_directory", help="Directory with the comparison timer information.", required=True)
+    parser.add_argument('-t', '--timer', dest="timer", help="Name of the timer to compare", required=True)
+    parser.add_argument('-s', '--speedup', dest="speedup", help="If set, only speedup will be printed. This is useful when making speedup plots.", action="store_true")
+
+    args = parser.parse_args()
+
+    timer1_found, timer1 = find_timer_value(args.timer, args.base_directory)
+    timer2_found, timer2 = find_timer_value(args.timer, args.comparison_directory)
+
+    if timer1_found and timer2_found:
+        try:
+            speedup = timer1 / timer2
+        except:
+            speedup = 1.0
+
+        percent = (timer2 - timer1) / timer1
+
+        if not args.speedup:
+            print("Comparing timer %s:"%(args.timer))
+            print("             Base: %lf"%(timer1))
+            print("          Compare: %lf"%(timer2))
+            print("   Percent Change: %lf%%"%(percent*100))
+            print("          Speedup: %lf"%(speedup))
+        else:
+            print("%lf"%(speedup))
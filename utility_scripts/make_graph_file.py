@@ -10,6 +10,8 @@ import argparse
 from netCDF4 import *
 from netCDF4 import Dataset as NetCDFFile
 
+from mpas_mesh import to_csr
+
 parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
 parser.add_argument("-f", "--file", dest="filename", help="Path to grid file", metavar="FILE", required=True)
 parser.add_argument("-w", "--weights", dest="weight_field", help="Field to weight block partition file on.", metavar="VAR")
@@ -26,10 +28,9 @@ dev_null = open(os.devnull, 'w')
 grid = NetCDFFile(args.filename, 'r')
 
 nCells = len(grid.dimensions['nCells'])
-nEdges = len(grid.dimensions['nEdges'])
 
-nEdgesOnCell = grid.variables['nEdgesOnCell'][:]
-cellsOnCell = grid.variables['cellsOnCell'][:] - 1
+nEdgesOnCell = np.array(grid.variables['nEdgesOnCell'][:], int)
+cellsOnCell = np.array(grid.variables['cellsOnCell'][:], int) - 1
 if weighted_parts:
     try:
         weights = grid.variables[args.weight_field][:]
@@ -38,13 +39,15 @@ if weighted_parts:
         weighted_parts = False
 grid.close()
 
-nEdges = 0
-for i in np.arange(0, nCells):
-    for j in np.arange(0,nEdgesOnCell[i]):
-        if cellsOnCell[i][j] != -1:
-            nEdges = nEdges + 1
+# the neighbors of each cell in CSR format, keeping only those in the mesh
+(offsets, cellsOnCell) = to_csr(nEdgesOnCell, cellsOnCell)
+exists = cellsOnCell >= 0
+rows = np.repeat(np.arange(nCells), nEdgesOnCell)
+neighbors = cellsOnCell[exists]
+neighborOffsets = np.zeros(nCells+1, int)
+neighborOffsets[1:] = np.cumsum(np.bincount(rows[exists], minlength=nCells))
 
-nEdges = nEdges/2
+nEdges = len(neighbors)//2
 
 graph = open('graph.info', 'w+')
 if weighted_parts:
@@ -52,13 +55,12 @@ if weighted_parts:
 else:
     graph.write('%s %s\n'%(nCells, nEdges))
 
+# the one-based neighbors of each cell, one line per cell
+neighbors = ['%s '%(cell+1) for cell in neighbors]
 for i in np.arange(0, nCells):
     if weighted_parts:
         graph.write('%s '%int(weights[i]))
 
-    for j in np.arange(0,nEdgesOnCell[i]):
-        if(cellsOnCell[i][j] >= 0):
-            graph.write('%s '%(cellsOnCell[i][j]+1))
+    graph.write(''.join(neighbors[neighborOffsets[i]:neighborOffsets[i+1]]))
     graph.write('\n')
 graph.close()
-
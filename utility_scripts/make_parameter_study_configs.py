@@ -8,50 +8,145 @@ with the -o flag.  Parameter names and values are provided as a list with
 the -p flag using syntax as in this example:
 -p param1=1,2,3 param2=1e3,1e4,1e5 param3='a','b','c' \\
    param4=.true.,.false.,.true.
-The number of parameter values must be the same for all parameters and all
-parameters are varied simultaneously.
+
+The design of the study is selected with the -d flag:
+  zip      The number of parameter values must be the same for all
+           parameters and all parameters are varied simultaneously
+           (the default).
+  product  Every combination of the parameter values is used (a full grid).
+  random   -n samples are drawn independently and uniformly for each
+           parameter.
+  lhs      -n samples are drawn as a Latin hypercube: the range of each
+           parameter is divided into n equal strata and each stratum is
+           sampled exactly once.
+For the random and lhs designs, each parameter is given as a range
+min:max (or min:max:log to sample uniformly in the logarithm), e.g.
+-p GammaT=0.002:0.02:log amplitude=150:300
+
+A manifest listing each config file and its parameter values is written to
+the file given with -m (default <prefix>_manifest.json) so that the members
+of the study can be set up, run or bundled without re-parsing the configs.
 """
 from __future__ import absolute_import, division, print_function, \
     unicode_literals
 
 import argparse
+import itertools
+import json
+import math
+import random
+import re
+
 
 def write_from_template(inFile,outFile,replacements):
     inID = open(inFile)
-    outID = open(outFile, 'w')
-
-    for line in inID:
-        for src, target in replacements.iteritems():
-            line = line.replace(src, target)
-        outID.write(line)
+    template = inID.read()
     inID.close()
+
+    # Replace all parameters in a single pass.  Longer names come first so
+    # that, e.g., @GammaTS is not matched by @GammaT
+    names = sorted(replacements.keys(), key=len, reverse=True)
+    regex = re.compile('|'.join([re.escape(name) for name in names]))
+    outID = open(outFile, 'w')
+    outID.write(regex.sub(lambda match: replacements[match.group(0)],
+                          template))
     outID.close()
 
+def parse_range(parameter, valueString):
+    rangeValues = valueString.split(':')
+    if len(rangeValues) not in [2, 3] or \
+            (len(rangeValues) == 3 and rangeValues[2] != 'log'):
+        raise ValueError('Parameter %s must be given as a range min:max or '
+                         'min:max:log for sampled designs.'%parameter)
+    lower = float(rangeValues[0])
+    upper = float(rangeValues[1])
+    useLog = len(rangeValues) == 3
+    if useLog:
+        lower = math.log(lower)
+        upper = math.log(upper)
+    return lower, upper, useLog
+
+def sample_parameters(parameterNames, parameters, sampleCount, design):
+    # Returns a list of sampleCount lists of values, one per parameter, for
+    # the random or lhs design
+    columns = []
+    for parameter in parameterNames:
+        lower, upper, useLog = parse_range(parameter, parameters[parameter])
+        if design == 'lhs':
+            strata = list(range(sampleCount))
+            random.shuffle(strata)
+            fractions = [(stratum + random.random())/sampleCount for
+                         stratum in strata]
+        else:
+            fractions = [random.random() for index in range(sampleCount)]
+        values = [lower + fraction*(upper - lower) for fraction in
+                  fractions]
+        if useLog:
+            values = [math.exp(value) for value in values]
+        columns.append(['%g'%value for value in values])
+    return [list(row) for row in zip(*columns)]
+
 # Define and process input arguments
 parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
 parser.add_argument("-t", "--template", dest="template", help="A config file in which to add or modify a parameter", metavar="TEMPLATE", required=True)
 parser.add_argument("-o", "--out_prefix", dest="out_prefix", help="The prefix for the output config file", metavar="PREFIX", required=True)
-parser.add_argument("-p", "--parameters", dest="parameters", help="A list of parameters and comma-separated values", metavar="PARAMETERS", nargs="+", required=True)
+parser.add_argument("-p", "--parameters", dest="parameters", help="A list of parameters and comma-separated values (or ranges for sampled designs)", metavar="PARAMETERS", nargs="+", required=True)
+parser.add_argument("-d", "--design", dest="design", help="The design of the study: zip, product, random or lhs (default zip)", choices=['zip', 'product', 'random', 'lhs'], default='zip')
+parser.add_argument("-n", "--samples", dest="samples", help="The number of samples for the random and lhs designs", type=int)
+parser.add_argument("-s", "--seed", dest="seed", help="Seed for the random number generator of the random and lhs designs", type=int)
+parser.add_argument("-m", "--manifest", dest="manifest", help="The manifest file to write (default <prefix>_manifest.json)", metavar="FILE")
 
 args = parser.parse_args()
 
+parameterNames = []
 parameters = {}
-
-first = True
 for parameterString in args.parameters:
     (parameter, valueString) = parameterString.split('=',1)
-    values = valueString.split(',')
-    if first:
-        valueCount = len(values)
-        first = False
+    parameterNames.append(parameter)
+    if args.design in ['zip', 'product']:
+        parameters[parameter] = valueString.split(',')
     else:
-        assert(len(values) == valueCount)
+        parameters[parameter] = valueString
 
-    parameters[parameter] = values
+if args.design == 'zip':
+    valueCount = len(parameters[parameterNames[0]])
+    for parameter in parameterNames:
+        if len(parameters[parameter]) != valueCount:
+            parser.error('The number of values must be the same for all '
+                         'parameters with the zip design.')
+    members = [[parameters[parameter][valueIndex] for parameter in
+                parameterNames] for valueIndex in range(valueCount)]
+elif args.design == 'product':
+    members = [list(values) for values in itertools.product(
+        *[parameters[parameter] for parameter in parameterNames])]
+else:
+    if args.samples is None:
+        parser.error('The number of samples (-n) is required for the %s '
+                     'design.'%args.design)
+    random.seed(args.seed)
+    try:
+        members = sample_parameters(parameterNames, parameters,
+                                    args.samples, args.design)
+    except ValueError as error:
+        parser.error(str(error))
 
-for valueIndex in range(valueCount):
-    outFileName = '%s_%02i.xml'%(args.out_prefix, valueIndex)
+if args.manifest is None:
+    args.manifest = '%s_manifest.json'%args.out_prefix
+
+indexWidth = max(2, len('%i'%(len(members)-1)))
+
+manifest = {'template': args.template, 'design': args.design,
+            'parameters': parameterNames, 'seed': args.seed, 'members': []}
+for valueIndex, values in enumerate(members):
+    outFileName = '%s_%0*i.xml'%(args.out_prefix, indexWidth, valueIndex)
     replacements = {}
-    for parameter in parameters:
-        replacements['@%s'%parameter] = parameters[parameter][valueIndex]
+    for parameter, value in zip(parameterNames, values):
+        replacements['@%s'%parameter] = value
     write_from_template(args.template, outFileName, replacements)
+    manifest['members'].append({'index': valueIndex, 'config': outFileName,
+                                'parameters': dict(zip(parameterNames,
+                                                       values))})
+
+manifestFile = open(args.manifest, 'w')
+json.dump(manifest, manifestFile, indent=4, sort_keys=True)
+manifestFile.close()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+"""
+Loads the connectivity of an MPAS mesh once as zero-based arrays and caches
+it so that analysis scripts don't have to re-read cellsOnCell, edgesOnCell,
+verticesOnEdge, etc. and walk neighbors in Python loops.
+
+The per-cell connectivity (cellsOnCell, edgesOnCell, verticesOnCell) is
+stored in CSR format: the entries of cell iCell are
+cellsOnCell[cellOffsets[iCell]:cellOffsets[iCell+1]], and so on, with only
+the first nEdgesOnCell[iCell] entries kept.  Neighbors outside the mesh are
+-1 in cellsOnCell; the neighbors and neighborOffsets arrays hold only the
+neighbors that exist.  The per-edge and per-vertex connectivity
+(cellsOnEdge, verticesOnEdge, cellsOnVertex) has a fixed width and is kept
+as zero-based 2D arrays.
+
+By default the arrays are read into memory.  If a cache folder is given (or
+$MPAS_MESH_CACHE is set), each array is instead saved as a .npy file in a
+subfolder named by the mesh's file_id attribute (or, if it has none, by the
+path, size and modification time of the file) and is loaded back as a
+read-only memory map, so later runs (and several processes at once) start
+without reading the mesh file.  Other variables of the mesh file (e.g.
+bottomDepth) can be requested with varNames and are cached as they are.
+
+Example:
+    from mpas_mesh import MpasMesh
+
+    mesh = MpasMesh('init.nc')
+    (sums, counts) = mesh.neighbor_sum(field, mask)
+
+Running this script on a mesh file fills its cache ahead of time:
+./mpas_mesh.py -f init.nc -c mesh_cache
+"""
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import hashlib
+import argparse
+import numpy as np
+
+from netCDF4 import Dataset as NetCDFFile
+
+# the mesh variables copied as they are, with the connectivity variables that
+# are changed to zero-based indexing
+meshVarNames = ['nEdgesOnCell', 'areaCell', 'dvEdge', 'dcEdge',
+                'areaTriangle', 'xCell', 'yCell', 'xEdge', 'yEdge',
+                'xVertex', 'yVertex']
+connectivityVarNames = ['cellsOnEdge', 'verticesOnEdge', 'cellsOnVertex',
+                        'edgesOnVertex']
+cellConnectivityVarNames = ['cellsOnCell', 'edgesOnCell', 'verticesOnCell']
+
+
+def get_mesh_key(fileName):#{{{
+    # the file_id of an MPAS mesh file if it has one, otherwise a hash of the
+    # path, size and modification time of the file
+    inFile = NetCDFFile(fileName, 'r')
+    try:
+        key = str(inFile.file_id).strip()
+    except AttributeError:
+        key = ''
+    inFile.close()
+    if key == '':
+        stat = os.stat(fileName)
+        key = hashlib.sha1(('%s %i %r'%(os.path.realpath(fileName),
+                                        stat.st_size, stat.st_mtime))
+                           .encode('utf-8')).hexdigest()
+    return key
+#}}}
+
+def to_csr(counts, values):#{{{
+    # the offsets and the flattened first counts[i] entries of each row of a
+    # 2D array
+    offsets = np.zeros(len(counts)+1, int)
+    offsets[1:] = np.cumsum(counts)
+    valid = np.arange(values.shape[1])[np.newaxis, :] < \
+        np.asarray(counts)[:, np.newaxis]
+    return offsets, np.asarray(values)[valid]
+#}}}
+
+def from_csr(offsets, values, fillValue=-1):#{{{
+    # a 2D array with the entries of each row of a CSR array, padded with
+    # fillValue to the length of the longest row
+    counts = np.diff(offsets)
+    valid = np.arange(np.amax(counts))[np.newaxis, :] < counts[:, np.newaxis]
+    padded = fillValue*np.ones(valid.shape, np.asarray(values).dtype)
+    padded[valid] = values
+    return padded
+#}}}
+
+def get_array_names(varNames):#{{{
+    # the names of the arrays read_mesh_arrays makes from varNames
+    arrayNames = list(varNames)
+    if any([varName in cellConnectivityVarNames for varName in varNames]):
+        arrayNames.append('cellOffsets')
+    if 'cellsOnCell' in varNames:
+        arrayNames.extend(['neighbors', 'neighborOffsets'])
+    return arrayNames
+#}}}
+
+def read_mesh_arrays(fileName, varNames):#{{{
+    # a dictionary of the (zero-based) mesh arrays made from the variables in
+    # varNames that are in the mesh file
+    inFile = NetCDFFile(fileName, 'r')
+    arrays = {}
+    nEdgesOnCell = np.array(inFile.variables['nEdgesOnCell'][:], int)
+    nCells = len(nEdgesOnCell)
+    for varName in varNames:
+        if varName not in inFile.variables:
+            continue
+        if varName not in connectivityVarNames + cellConnectivityVarNames:
+            arrays[varName] = np.array(inFile.variables[varName][:])
+            continue
+        values = np.array(inFile.variables[varName][:], int) - 1
+        if varName.startswith('cellsOn'):
+            # cells outside the mesh may be 0 or nCells+1 in the file
+            values[values >= nCells] = -1
+        if varName in cellConnectivityVarNames:
+            offsets, values = to_csr(nEdgesOnCell, values)
+            arrays['cellOffsets'] = offsets
+        arrays[varName] = values
+    inFile.close()
+
+    if 'cellsOnCell' in arrays:
+        # only the neighbors that exist (not outside the mesh)
+        cellsOnCell = arrays['cellsOnCell']
+        rows = np.repeat(np.arange(nCells), nEdgesOnCell)
+        exists = cellsOnCell >= 0
+        arrays['neighbors'] = cellsOnCell[exists]
+        arrays['neighborOffsets'] = np.zeros(nCells+1, int)
+        arrays['neighborOffsets'][1:] = np.cumsum(
+            np.bincount(rows[exists], minlength=nCells))
+    return arrays
+#}}}
+
+def write_mesh_cache(fileName, cacheFolder, varNames):#{{{
+    # write the mesh arrays made from varNames to cacheFolder, each to a
+    # temporary file first that is then renamed, so processes filling the
+    # same cache at once never load a partially written array
+    arrays = read_mesh_arrays(fileName, varNames)
+    try:
+        os.makedirs(cacheFolder)
+    except OSError:
+        pass
+    for arrayName in arrays:
+        tempFileName = '%s/%s.%i.tmp.npy'%(cacheFolder, arrayName,
+                                           os.getpid())
+        np.save(tempFileName, arrays[arrayName])
+        os.rename(tempFileName, '%s/%s.npy'%(cacheFolder, arrayName))
+#}}}
+
+def load_mesh_cache(fileName, cacheFolder, varNames):#{{{
+    # read-only memory maps of the cached mesh arrays made from varNames,
+    # caching first those that aren't cached yet
+    missing = [varName for varName in varNames if not
+               all([os.path.exists('%s/%s.npy'%(cacheFolder, arrayName))
+                    for arrayName in get_array_names([varName])])]
+    if len(missing) > 0:
+        write_mesh_cache(fileName, cacheFolder, missing)
+    arrays = {}
+    for arrayName in get_array_names(varNames):
+        cacheFileName = '%s/%s.npy'%(cacheFolder, arrayName)
+        # variables that aren't in the mesh file are never cached
+        if os.path.exists(cacheFileName):
+            arrays[arrayName] = np.load(cacheFileName, mmap_mode='r')
+    return arrays
+#}}}
+
+class MpasMesh(object):#{{{
+    # Zero-based connectivity and geometry of an MPAS mesh, read into memory
+    # or loaded from (and if needed, written to) a cache of memory-mapped .npy
+    # files.  Each array is an attribute of the mesh.
+
+    def __init__(self, fileName, cacheDir=None, varNames=None):#{{{
+        if varNames is None:
+            varNames = meshVarNames + connectivityVarNames + \
+                cellConnectivityVarNames
+        if 'nEdgesOnCell' not in varNames:
+            varNames = ['nEdgesOnCell'] + list(varNames)
+        if cacheDir is None:
+            cacheDir = os.environ.get('MPAS_MESH_CACHE')
+        self.fileName = fileName
+        if cacheDir is None:
+            self.cacheFolder = None
+            arrays = read_mesh_arrays(fileName, varNames)
+        else:
+            self.cacheFolder = '%s/%s'%(cacheDir, get_mesh_key(fileName))
+            arrays = load_mesh_cache(fileName, self.cacheFolder, varNames)
+
+        for arrayName in arrays:
+            setattr(self, arrayName, arrays[arrayName])
+
+        self.nCells = len(self.nEdgesOnCell)
+    #}}}
+
+    def cell_neighbors(self, iCell):#{{{
+        # the existing neighbors of one cell
+        return self.neighbors[self.neighborOffsets[iCell]:
+                              self.neighborOffsets[iCell+1]]
+    #}}}
+
+    def cell_edges(self, iCell):#{{{
+        return self.edgesOnCell[self.cellOffsets[iCell]:
+                                self.cellOffsets[iCell+1]]
+    #}}}
+
+    def cell_vertices(self, iCell):#{{{
+        return self.verticesOnCell[self.cellOffsets[iCell]:
+                                   self.cellOffsets[iCell+1]]
+    #}}}
+
+    def neighbor_rows(self):#{{{
+        # the cell each entry of neighbors belongs to
+        return np.repeat(np.arange(self.nCells),
+                         np.diff(self.neighborOffsets))
+    #}}}
+
+    def neighbor_sum(self, field, mask=None):#{{{
+        # the sum of a cell field over the existing neighbors of every cell
+        # (only those where mask is True, if given) and the number of
+        # neighbors summed over
+        field = np.asarray(field)
+        rows = self.neighbor_rows()
+        if mask is None:
+            weights = np.ones(len(self.neighbors))
+        else:
+            weights = np.asarray(mask)[self.neighbors].astype(float)
+        sums = np.bincount(rows, weights=weights*field[self.neighbors],
+                           minlength=self.nCells)
+        counts = np.bincount(rows, weights=weights,
+                             minlength=self.nCells).astype(int)
+        return sums, counts
+    #}}}
+
+    def neighbor_any(self, mask):#{{{
+        # True for cells with at least one existing neighbor where mask is
+        # True
+        return np.bincount(self.neighbor_rows(),
+                           weights=np.asarray(mask)[self.neighbors],
+                           minlength=self.nCells) > 0
+    #}}}
+
+    def adjacency(self):#{{{
+        # the cell-to-cell adjacency as a scipy CSR matrix
+        import scipy.sparse
+        return scipy.sparse.csr_matrix(
+            (np.ones(len(self.neighbors)), np.asarray(self.neighbors),
+             np.asarray(self.neighborOffsets)),
+            shape=(self.nCells, self.nCells))
+    #}}}
+
+    def boundary_cells(self):#{{{
+        # True for cells with at least one neighbor outside the mesh
+        rows = np.repeat(np.arange(self.nCells), self.nEdgesOnCell)
+        return np.bincount(rows, weights=self.cellsOnCell < 0,
+                           minlength=self.nCells) > 0
+    #}}}
+
+    def boundary_vertices(self):#{{{
+        # True for vertices with at least one cell outside the mesh
+        return np.any(self.cellsOnVertex < 0, axis=1)
+    #}}}
+
+    def inner_edges(self):#{{{
+        # the indices of edges with cells on both sides
+        return np.nonzero(np.logical_and(self.cellsOnEdge[:, 0] >= 0,
+                                         self.cellsOnEdge[:, 1] >= 0))[0]
+    #}}}
+
+    def total_area(self, mask=None):#{{{
+        if mask is None:
+            return np.sum(self.areaCell)
+        return np.sum(self.areaCell[np.asarray(mask)])
+    #}}}
+
+    def area_sum(self, field, mask=None):#{{{
+        # the area-weighted sum of a field with nCells as its last dimension
+        # (over the cells where mask is True, if given)
+        weights = np.array(self.areaCell)
+        if mask is not None:
+            weights = weights*np.asarray(mask)
+        return np.dot(np.asarray(field), weights)
+    #}}}
+
+    def area_mean(self, field, mask=None):#{{{
+        return self.area_sum(field, mask)/self.total_area(mask)
+    #}}}
+#}}}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-f", "--file", dest="filename", help="Path to the mesh file", metavar="FILE", required=True)
+    parser.add_argument("-c", "--cache_dir", dest="cache_dir", help="Folder to cache the mesh in (default: $MPAS_MESH_CACHE)", metavar="DIR")
+
+    args = parser.parse_args()
+
+    if args.cache_dir is None and 'MPAS_MESH_CACHE' not in os.environ:
+        parser.error('no cache folder given and $MPAS_MESH_CACHE is not set')
+
+    mesh = MpasMesh(args.filename, args.cache_dir)
+    print('Mesh connectivity of %s cached in %s'%(args.filename,
+                                                  mesh.cacheFolder))
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+"""
+Runs a case in a chain of segments until an end date is reached, replacing
+hand-written job-script loops around check_progress.py and setup_restart.py.
+
+Before each segment, the restart pointer named by
+config_restart_timestamp_name in the namelist (-f) is read.  If the date it
+contains is at or beyond the end date (-e, format YYYY-MM-DD_hh:mm:ss), the
+chain is complete.  Otherwise, the run script (-x, default ./run.py) is
+executed.  After a successful segment, the namelist is updated in place to
+restart from the new restart file (as setup_restart.py does), files matching
+the --rotate patterns (e.g. output.nc) are renamed with the date of the end
+of the segment so the next segment does not overwrite them, and all but the
+newest --keep_restarts restart files matching --restart_pattern are removed.
+
+A ledger with the simulated time, wall-clock time and throughput in
+simulated years per day (SYPD) of each segment is appended to
+chain_ledger.txt (or the file given with -l).
+
+The script exits 0 once the end date is reached and 1 if a segment fails,
+if a segment does not advance the restart date, or if -m
+segments were run without reaching the end date (so a job script can
+resubmit itself).
+
+Example:
+./restart_chain.py -f namelist.ocean -e 0011-01-01_00:00:00 -m 12 \\
+    --rotate output.nc --restart_pattern 'restarts/restart.*.nc' \\
+    --keep_restarts 2
+"""
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import sys
+import glob
+import time
+import argparse
+import subprocess
+from datetime import datetime
+
+dateFormat = '%Y-%m-%d_%H:%M:%S'
+
+
+def format_date(date):#{{{
+    # strftime does not zero-pad years before 1000 on all platforms and
+    # doesn't support years before 1900 in python 2
+    return '%04i-%02i-%02i_%02i:%02i:%02i'%(date.year, date.month, date.day,
+                                            date.hour, date.minute,
+                                            date.second)
+#}}}
+
+def get_namelist_option(namelistFileName, optionName, default=None):#{{{
+    # Returns the value of a namelist option, stripped of quotes
+    value = default
+    inFile = open(namelistFileName, 'r')
+    for line in inFile:
+        if optionName in line and '=' in line:
+            value = line.split("=")[-1]
+            value = value.lstrip(" \t'\"")
+            value = value.rstrip(" \t\n'\"")
+    inFile.close()
+    return value
+#}}}
+
+def get_restart_pointer(namelistFileName):#{{{
+    return get_namelist_option(namelistFileName,
+                               'config_restart_timestamp_name',
+                               'Restart_timestamp')
+#}}}
+
+def read_restart_date(restartPointer):#{{{
+    # Returns the date in the restart pointer file, or None if the file does
+    # not exist
+    if not os.path.exists(restartPointer):
+        return None
+
+    restartDate = None
+    inFile = open(restartPointer, 'r')
+    for line in inFile:
+        line = line.strip(" \t\n")
+        restartDate = datetime.strptime(line, dateFormat)
+        break
+    inFile.close()
+    return restartDate
+#}}}
+
+def get_current_date(namelistFileName):#{{{
+    # The date the next segment will start from: the restart date if there is
+    # one, otherwise config_start_time
+    restartDate = read_restart_date(get_restart_pointer(namelistFileName))
+    if restartDate is not None:
+        return restartDate
+    startTime = get_namelist_option(namelistFileName, 'config_start_time')
+    try:
+        return datetime.strptime(startTime, dateFormat)
+    except (TypeError, ValueError):
+        return None
+#}}}
+
+def set_restart(namelistFileName, startTime="'file'"):#{{{
+    # Modifies the namelist in place so the next run restarts. Returns False
+    # if there is no restart pointer yet (and the namelist is unchanged)
+    if not os.path.exists(get_restart_pointer(namelistFileName)):
+        return False
+
+    inFile = open(namelistFileName, 'r')
+    lines = inFile.readlines()
+    inFile.close()
+
+    outFile = open(namelistFileName, 'w')
+    for line in lines:
+        if 'config_do_restart' in line:
+            line = "    config_do_restart = .true.\n"
+        if 'config_start_time' in line:
+            line = "    config_start_time = %s\n"%startTime
+        outFile.write(line)
+    outFile.close()
+    return True
+#}}}
+
+def rotate_files(patterns, date):#{{{
+    # Rename files matching each pattern to <root>.<date><ext>
+    suffix = format_date(date)
+    for pattern in patterns:
+        for fileName in glob.glob(pattern):
+            (root, ext) = os.path.splitext(fileName)
+            os.rename(fileName, '%s.%s%s'%(root, suffix, ext))
+#}}}
+
+def prune_restarts(restartPattern, keepCount):#{{{
+    # Remove all but the keepCount most recently modified restart files
+    restartFiles = sorted(glob.glob(restartPattern), key=os.path.getmtime)
+    for fileName in restartFiles[:max(len(restartFiles)-keepCount, 0)]:
+        os.remove(fileName)
+#}}}
+
+def write_ledger_entry(ledgerFileName, segment, startDate, endDate,
+                       wallTime):#{{{
+    simulatedDays = (endDate - startDate).total_seconds()/86400.0
+    if wallTime > 0.0:
+        sypd = (simulatedDays/365.0)/(wallTime/86400.0)
+    else:
+        sypd = 0.0
+
+    if not os.path.exists(ledgerFileName):
+        ledgerFile = open(ledgerFileName, 'w')
+        ledgerFile.write('%8s %20s %20s %14s %14s %10s\n'%(
+            'segment', 'start', 'end', 'sim. days', 'wall (s)', 'SYPD'))
+    else:
+        ledgerFile = open(ledgerFileName, 'a')
+    ledgerFile.write('%8i %20s %20s %14.4f %14.2f %10.4f\n'%(
+        segment, format_date(startDate), format_date(endDate),
+        simulatedDays, wallTime, sypd))
+    ledgerFile.close()
+
+    return simulatedDays, sypd
+#}}}
+
+def run_chain(namelistFileName, endDate, runScript='./run.py',
+              maxSegments=None, rotatePatterns=[], restartPattern=None,
+              keepRestarts=None, ledgerFileName='chain_ledger.txt'):#{{{
+    # Returns True if the end date has been reached, False otherwise
+    segment = 0
+    # continue the segment numbering of previous jobs in the ledger
+    firstSegment = 0
+    if os.path.exists(ledgerFileName):
+        ledgerFile = open(ledgerFileName, 'r')
+        firstSegment = max(len(ledgerFile.readlines()) - 1, 0)
+        ledgerFile.close()
+    totalDays = 0.0
+    totalWallTime = 0.0
+    while True:
+        startDate = get_current_date(namelistFileName)
+        if startDate is not None and startDate >= endDate:
+            print('Run has completed.')
+            completed = True
+            break
+
+        if maxSegments is not None and segment >= maxSegments:
+            print('Maximum number of segments reached.')
+            completed = False
+            break
+
+        segment = segment + 1
+        if startDate is None:
+            startString = '?'
+        else:
+            startString = format_date(startDate)
+        print(' * Running segment %i starting at %s'%(firstSegment + segment,
+                                                      startString))
+
+        wallStart = time.time()
+        try:
+            subprocess.check_call([runScript])
+        except subprocess.CalledProcessError:
+            print('   run failed')
+            completed = False
+            break
+        wallTime = time.time() - wallStart
+
+        segmentEndDate = read_restart_date(
+            get_restart_pointer(namelistFileName))
+        if segmentEndDate is None or \
+                (startDate is not None and segmentEndDate <= startDate):
+            print('   run did not advance the restart date')
+            completed = False
+            break
+
+        if startDate is not None:
+            simulatedDays, sypd = write_ledger_entry(
+                ledgerFileName, firstSegment + segment, startDate,
+                segmentEndDate, wallTime)
+            totalDays = totalDays + simulatedDays
+            totalWallTime = totalWallTime + wallTime
+            print('   reached %s in %.2f s (%.4f SYPD)'%(
+                format_date(segmentEndDate), wallTime, sypd))
+
+        rotate_files(rotatePatterns, segmentEndDate)
+        if restartPattern is not None and keepRestarts is not None:
+            prune_restarts(restartPattern, keepRestarts)
+
+        set_restart(namelistFileName)
+
+    if totalWallTime > 0.0:
+        print('Simulated %.4f days in %.2f s (%.4f SYPD)'%(
+            totalDays, totalWallTime,
+            (totalDays/365.0)/(totalWallTime/86400.0)))
+
+    return completed
+#}}}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-f", "--fileName", dest="fileName", help="The namelist file of the case", metavar="FILE", required=True)
+    parser.add_argument("-e", "--endDate", dest="endDate", help="End date of the run", metavar="DATE", required=True)
+    parser.add_argument("-x", "--runScript", dest="runScript", help="The script that runs one segment (default ./run.py)", metavar="SCRIPT", default="./run.py")
+    parser.add_argument("-m", "--maxSegments", dest="maxSegments", help="The maximum number of segments to run in this job", type=int)
+    parser.add_argument("-l", "--ledger", dest="ledger", help="File to append the progress ledger to (default chain_ledger.txt)", metavar="FILE", default="chain_ledger.txt")
+    parser.add_argument("--rotate", dest="rotate", help="Patterns of output files to rename with the date after each segment", nargs="+", default=[])
+    parser.add_argument("--restart_pattern", dest="restartPattern", help="Pattern matching the restart files written by the model", metavar="PATTERN")
+    parser.add_argument("--keep_restarts", dest="keepRestarts", help="The number of most recent restart files to keep", type=int)
+
+    args = parser.parse_args()
+
+    endDate = datetime.strptime(args.endDate, dateFormat)
+
+    completed = run_chain(args.fileName, endDate, args.runScript,
+                          args.maxSegments, args.rotate, args.restartPattern,
+                          args.keepRestarts, args.ledger)
+    if completed:
+        sys.exit(0)
+    sys.exit(1)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+"""
+Runs the stages (cases) of a multi-stage test such as the global_ocean spin_up
+tests, resuming after the last completed stage instead of starting over.
+
+This script is run from the test directory (the one containing run_test.py).
+The stages are the case directories given as arguments or, by default, the
+cases run by run_test.py, in order.  Each stage is run by executing ./run.py
+(or the script given with -x) in its directory.
+
+After a stage completes successfully, a marker file (.stage_complete) is
+written in its directory recording the wall time, the simulated dates and the
+size, modification time and SHA-1 hash of each of its output files (regular
+files, not links, matching the --hash_patterns, by default *.nc).  On later
+runs, a stage is skipped if its marker exists and its outputs are unchanged
+(compared by size and modification time or, with --verify, by hash).  Once a
+stage has to be run, the markers of all later stages are removed so they are
+run again as well.
+
+Before running a stage that restarts from a previous one, the restart pointer
+(Restart_timestamp) and the restarts directory are made links to those of the
+previous stage if they are missing or are copies (e.g. after finalizing).
+
+The wall time, simulated days and wall time per simulated day of each stage
+are appended to stage_ledger.txt (or the file given with -l) and a summary is
+printed at the end.
+
+Example:
+../../../utility_scripts/run_stages.py
+"""
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import sys
+import re
+import glob
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from datetime import datetime
+
+from restart_chain import get_namelist_option, get_restart_pointer, \
+    read_restart_date, format_date, dateFormat
+
+markerFileName = '.stage_complete'
+
+
+def get_driver_stages(driverFileName):#{{{
+    # The case directories run by a generated driver script, in order
+    stages = []
+    inFile = open(driverFileName, 'r')
+    for line in inFile:
+        match = re.match(r"\s*os\.chdir\('(.+)'\)", line)
+        if match is not None and match.group(1) not in stages:
+            stages.append(match.group(1))
+    inFile.close()
+    return stages
+#}}}
+
+def compute_hash(fileName, blockSize=2**20):#{{{
+    sha = hashlib.sha1()
+    inFile = open(fileName, 'rb')
+    while True:
+        block = inFile.read(blockSize)
+        if len(block) == 0:
+            break
+        sha.update(block)
+    inFile.close()
+    return sha.hexdigest()
+#}}}
+
+def get_output_files(stage, patterns):#{{{
+    # Regular files in the stage directory matching the patterns.  Links are
+    # skipped because they point to the outputs of other stages.
+    fileNames = set()
+    for pattern in patterns:
+        for fileName in glob.glob('%s/%s'%(stage, pattern)):
+            if os.path.isfile(fileName) and not os.path.islink(fileName):
+                fileNames.add(fileName)
+    return sorted(fileNames)
+#}}}
+
+def describe_outputs(stage, patterns):#{{{
+    outputs = {}
+    for fileName in get_output_files(stage, patterns):
+        outputs[os.path.relpath(fileName, stage)] = {
+            'size': os.path.getsize(fileName),
+            'mtime': os.path.getmtime(fileName),
+            'sha1': compute_hash(fileName)}
+    return outputs
+#}}}
+
+def read_marker(stage):#{{{
+    fileName = '%s/%s'%(stage, markerFileName)
+    if not os.path.exists(fileName):
+        return None
+    inFile = open(fileName, 'r')
+    try:
+        marker = json.load(inFile)
+    except ValueError:
+        marker = None
+    inFile.close()
+    return marker
+#}}}
+
+def write_marker(stage, marker):#{{{
+    # write to a temporary file first so an interrupted write never leaves a
+    # partial marker
+    fileName = '%s/%s'%(stage, markerFileName)
+    outFile = open('%s.tmp'%fileName, 'w')
+    json.dump(marker, outFile, indent=2, sort_keys=True)
+    outFile.close()
+    os.rename('%s.tmp'%fileName, fileName)
+#}}}
+
+def remove_marker(stage):#{{{
+    fileName = '%s/%s'%(stage, markerFileName)
+    if os.path.exists(fileName):
+        os.remove(fileName)
+#}}}
+
+def is_complete(stage, patterns, verify):#{{{
+    # True if the stage has a marker and its outputs have not changed
+    marker = read_marker(stage)
+    if marker is None:
+        return False
+    outputs = marker['outputs']
+    fileNames = [os.path.relpath(fileName, stage) for fileName in
+                 get_output_files(stage, patterns)]
+    if sorted(fileNames) != sorted(outputs.keys()):
+        return False
+    for fileName in fileNames:
+        path = '%s/%s'%(stage, fileName)
+        if os.path.getsize(path) != outputs[fileName]['size']:
+            return False
+        if verify:
+            if compute_hash(path) != outputs[fileName]['sha1']:
+                return False
+        elif os.path.getmtime(path) != outputs[fileName]['mtime']:
+            return False
+    return True
+#}}}
+
+def link_restarts(previousStage, stage, namelistFileName):#{{{
+    # Make the restart pointer and restarts directory of a restarting stage
+    # links to those of the previous stage
+    namelistPath = '%s/%s'%(stage, namelistFileName)
+    if previousStage is None or not os.path.exists(namelistPath):
+        return
+    doRestart = get_namelist_option(namelistPath, 'config_do_restart',
+                                    '.false.')
+    if doRestart != '.true.':
+        return
+    restartPointer = get_restart_pointer(namelistPath)
+    for name in [restartPointer, 'restarts']:
+        source = '%s/%s'%(previousStage, name)
+        dest = '%s/%s'%(stage, name)
+        if os.path.islink(dest) or not os.path.exists(source):
+            continue
+        if os.path.isdir(dest):
+            print('   Warning: %s is a directory, not linking it to %s'%(
+                dest, source))
+            continue
+        if os.path.exists(dest):
+            os.remove(dest)
+        print('   linking %s to %s'%(dest, source))
+        os.symlink('../%s'%source, dest)
+#}}}
+
+def get_stage_start_date(stage, namelistFileName):#{{{
+    # The simulation date a stage starts from, or None if it isn't a
+    # time-stepping stage.  A stage that doesn't restart starts from
+    # config_start_time, even if a restart pointer is left over from an
+    # earlier run.
+    namelistPath = '%s/%s'%(stage, namelistFileName)
+    if not os.path.exists(namelistPath):
+        return None
+    doRestart = get_namelist_option(namelistPath, 'config_do_restart',
+                                    '.false.')
+    if doRestart == '.true.':
+        return read_restart_date('%s/%s'%(stage,
+                                          get_restart_pointer(namelistPath)))
+    startTime = get_namelist_option(namelistPath, 'config_start_time')
+    try:
+        return datetime.strptime(startTime, dateFormat)
+    except (TypeError, ValueError):
+        return None
+#}}}
+
+def get_stage_end_date(stage, namelistFileName, runStart):#{{{
+    # The simulation date a stage reached: the date in its restart pointer if
+    # the pointer was written after runStart (a time from time.time(), compared
+    # to the second in case of coarse file times), otherwise None
+    namelistPath = '%s/%s'%(stage, namelistFileName)
+    if not os.path.exists(namelistPath):
+        return None
+    restartPointer = '%s/%s'%(stage, get_restart_pointer(namelistPath))
+    if not os.path.exists(restartPointer) or \
+            os.path.getmtime(restartPointer) < int(runStart):
+        return None
+    return read_restart_date(restartPointer)
+#}}}
+
+def write_ledger_entry(ledgerFileName, stage, wallTime, simulatedDays):#{{{
+    if simulatedDays is not None and simulatedDays > 0.0:
+        wallPerDay = '%14.2f'%(wallTime/simulatedDays)
+        days = '%14.4f'%simulatedDays
+    else:
+        wallPerDay = '%14s'%'-'
+        days = '%14s'%'-'
+    if not os.path.exists(ledgerFileName):
+        ledgerFile = open(ledgerFileName, 'w')
+        ledgerFile.write('%-20s %14s %14s %14s\n'%(
+            'stage', 'wall (s)', 'sim. days', 'wall/day (s)'))
+    else:
+        ledgerFile = open(ledgerFileName, 'a')
+    ledgerFile.write('%-20s %14.2f %s %s\n'%(stage, wallTime, days,
+                                             wallPerDay))
+    ledgerFile.close()
+#}}}
+
+def run_stages(stages, runScript='./run.py', patterns=['*.nc'],
+               verify=False, namelistFileName='namelist.ocean',
+               ledgerFileName='stage_ledger.txt'):#{{{
+    # Returns True if all stages completed
+    summary = []
+    previousStage = None
+    rerun = False
+    for stage in stages:
+        if not rerun and is_complete(stage, patterns, verify):
+            print(' * Skipping %s (already complete)'%stage)
+            previousStage = stage
+            continue
+
+        # this stage and all later stages need to be run
+        rerun = True
+        remove_marker(stage)
+
+        print(' * Running %s'%stage)
+        link_restarts(previousStage, stage, namelistFileName)
+        startDate = get_stage_start_date(stage, namelistFileName)
+
+        wallStart = time.time()
+        try:
+            subprocess.check_call([runScript], cwd=stage)
+        except subprocess.CalledProcessError:
+            print('   %s failed'%stage)
+            return False
+        wallTime = time.time() - wallStart
+
+        endDate = get_stage_end_date(stage, namelistFileName, wallStart)
+        if startDate is not None and endDate is not None and \
+                endDate > startDate:
+            simulatedDays = (endDate - startDate).total_seconds()/86400.0
+            dates = [format_date(startDate), format_date(endDate)]
+        else:
+            simulatedDays = None
+            dates = None
+
+        write_marker(stage, {'wallTime': wallTime,
+                             'simulatedDays': simulatedDays,
+                             'dates': dates,
+                             'outputs': describe_outputs(stage, patterns)})
+        write_ledger_entry(ledgerFileName, stage, wallTime, simulatedDays)
+        summary.append((stage, wallTime, simulatedDays))
+        if simulatedDays is not None:
+            print('   - Complete in %.2f s, %.4f simulated days '
+                  '(%.2f s per simulated day)'%(wallTime, simulatedDays,
+                                                wallTime/simulatedDays))
+        else:
+            print('   - Complete in %.2f s'%wallTime)
+        previousStage = stage
+
+    if len(summary) > 0:
+        print('')
+        print('Stage summary:')
+        for (stage, wallTime, simulatedDays) in summary:
+            if simulatedDays is not None:
+                print('  %-20s %10.2f s %10.4f days %10.2f s/day'%(
+                    stage, wallTime, simulatedDays, wallTime/simulatedDays))
+            else:
+                print('  %-20s %10.2f s'%(stage, wallTime))
+    return True
+#}}}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("stages", help="The stages (case directories) to run, in order (default: those in run_test.py)", nargs="*")
+    parser.add_argument("-d", "--driver", dest="driver", help="The driver script to read the stages from (default run_test.py)", metavar="FILE", default="run_test.py")
+    parser.add_argument("-x", "--runScript", dest="runScript", help="The script that runs each stage (default ./run.py)", metavar="SCRIPT", default="./run.py")
+    parser.add_argument("-f", "--fileName", dest="fileName", help="The namelist file of each stage (default namelist.ocean)", metavar="FILE", default="namelist.ocean")
+    parser.add_argument("-l", "--ledger", dest="ledger", help="File to append the stage timings to (default stage_ledger.txt)", metavar="FILE", default="stage_ledger.txt")
+    parser.add_argument("--hash_patterns", dest="hashPatterns", help="Patterns of the output files of each stage to record in its marker", nargs="+", default=["*.nc"])
+    parser.add_argument("--verify", dest="verify", help="Compare the hashes of outputs rather than their modification times", action="store_true")
+    parser.add_argument("--restart", dest="restart", help="Remove all markers and run every stage", action="store_true")
+
+    args = parser.parse_args()
+
+    if len(args.stages) > 0:
+        stages = args.stages
+    else:
+        stages = get_driver_stages(args.driver)
+
+    if args.restart:
+        for stage in stages:
+            remove_marker(stage)
+
+    completed = run_stages(stages, args.runScript, args.hashPatterns,
+                           args.verify, args.fileName, args.ledger)
+    if completed:
+        sys.exit(0)
+    sys.exit(1)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+Collects timers from a set of run directories that ran the same case with
+different numbers of MPI tasks, OpenMP threads or blocks (e.g. the 4proc_run
+and 8proc_run cases of a threads_test or the 4blocks_run and 8blocks_run cases
+of a blocks_test) and computes speedup, parallel efficiency and load
+imbalance for each timer.
+
+The count associated with each run directory is taken from the leading
+integer in the directory name (4thread_run -> 4) unless it is given
+explicitly with the -n flag.  The run with the smallest count is the
+reference for speedup and efficiency.  For a strong-scaling study (the
+default) the ideal speedup is the ratio of counts; for a weak-scaling study
+(--weak) the ideal is a constant run time.
+
+A table is written to stdout (and to PREFIX.txt with -o), and one plot per
+timer is written to PREFIX_<timer>.png if -o is given.  Efficiencies can be
+stored as a baseline with --write_baseline and later compared against with
+-b.  Any timer whose efficiency at some count has dropped by more than the
+tolerance relative to the baseline is flagged and the script exits 1.
+
+Example:
+./scaling_study.py -r 4thread_run 8thread_run -t "time integration" \\
+    "se timestep" -o scaling -b baseline/scaling.json
+"""
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import sys
+import re
+import json
+import argparse
+
+from compare_timers import find_timer_stats
+
+
+def get_run_count(directory):#{{{
+    match = re.match(r'(\d+)', os.path.basename(os.path.normpath(directory)))
+    if match is None:
+        print("ERROR: Could not determine a count from run directory '%s'. "
+              "Use the -n flag."%(directory))
+        sys.exit(1)
+    return int(match.group(1))
+#}}}
+
+def compute_scaling(timer_name, directories, counts, weak):#{{{
+    # Returns a list of dictionaries, one per run, sorted by count
+    runs = []
+    for directory, count in sorted(zip(directories, counts),
+                                   key=lambda run: run[1]):
+        timer_found, stats = find_timer_stats(timer_name, directory)
+        if not timer_found:
+            print("WARNING: Timer '%s' not found in %s"%(timer_name,
+                                                         directory))
+            continue
+        runs.append({'directory': directory, 'count': count,
+                     'time': stats['total'], 'max': stats['max'],
+                     'avg': stats['avg']})
+
+    if len(runs) == 0:
+        return runs
+
+    ref_count = runs[0]['count']
+    ref_time = runs[0]['time']
+    for run in runs:
+        if run['time'] > 0.0:
+            run['speedup'] = ref_time / run['time']
+        else:
+            run['speedup'] = 1.0
+        if weak:
+            ideal = 1.0
+        else:
+            ideal = run['count'] / ref_count
+        run['efficiency'] = run['speedup'] / ideal
+        if run['avg'] is not None and run['avg'] > 0.0:
+            run['imbalance'] = run['max'] / run['avg'] - 1.0
+        else:
+            run['imbalance'] = None
+
+    return runs
+#}}}
+
+def write_table(results, out_file):#{{{
+    header = '%-32s %8s %14s %10s %10s %10s'%('timer', 'count', 'time (s)',
+                                             'speedup', 'efficiency',
+                                             'imbalance')
+    out_file.write('%s\n'%header)
+    out_file.write('%s\n'%('-'*len(header)))
+    for timer_name in results:
+        for run in results[timer_name]:
+            if run['imbalance'] is None:
+                imbalance = '%10s'%'-'
+            else:
+                imbalance = '%9.2f%%'%(100.0*run['imbalance'])
+            out_file.write('%-32s %8i %14.4f %10.3f %10.3f %s\n'%(
+                timer_name, run['count'], run['time'], run['speedup'],
+                run['efficiency'], imbalance))
+#}}}
+
+def plot_scaling(timer_name, runs, weak, out_prefix):#{{{
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    counts = [run['count'] for run in runs]
+    speedups = [run['speedup'] for run in runs]
+    efficiencies = [run['efficiency'] for run in runs]
+    if weak:
+        ideal = [1.0 for count in counts]
+    else:
+        ideal = [count / counts[0] for count in counts]
+
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(10, 4))
+    ax1.loglog(counts, speedups, 'o-', label='measured')
+    ax1.loglog(counts, ideal, 'k--', label='ideal')
+    ax1.set_xlabel('count')
+    ax1.set_ylabel('speedup')
+    ax1.legend(loc='best')
+    ax2.semilogx(counts, efficiencies, 'o-')
+    ax2.axhline(1.0, color='k', linestyle='--')
+    ax2.set_xlabel('count')
+    ax2.set_ylabel('parallel efficiency')
+    ax2.set_ylim(0.0, 1.1*max(1.0, max(efficiencies)))
+    fig.suptitle(timer_name)
+    fig.savefig('%s_%s.png'%(out_prefix, timer_name.replace(' ', '_')))
+    plt.close(fig)
+#}}}
+
+def compare_to_baseline(results, baseline, tolerance):#{{{
+    # Returns a list of (timer, count, baseline efficiency, efficiency) for
+    # every timer and count whose efficiency dropped by more than tolerance
+    regressions = []
+    for timer_name in results:
+        if timer_name not in baseline:
+            print("WARNING: Timer '%s' is not in the baseline"%(timer_name))
+            continue
+        for run in results[timer_name]:
+            key = '%i'%run['count']
+            if key not in baseline[timer_name]:
+                continue
+            base_efficiency = baseline[timer_name][key]
+            if base_efficiency - run['efficiency'] > tolerance:
+                regressions.append((timer_name, run['count'],
+                                    base_efficiency, run['efficiency']))
+    return regressions
+#}}}
+
+if __name__ == "__main__":
+    # Define and process input arguments
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-r', '--run_directories', dest="run_directories", help="Run directories containing timer information for each count", nargs="+", required=True)
+    parser.add_argument('-t', '--timers', dest="timers", help="Names of the timers to analyze", nargs="+", required=True)
+    parser.add_argument('-n', '--counts', dest="counts", help="Comma-separated task, thread or block counts, one per run directory. Default is the leading integer in each directory name.", metavar="COUNTS")
+    parser.add_argument('-w', '--weak', dest="weak", help="If set, treat the runs as a weak-scaling study", action="store_true")
+    parser.add_argument('-o', '--out_prefix', dest="out_prefix", help="Prefix for the table and plots to write", metavar="PREFIX")
+    parser.add_argument('-b', '--baseline', dest="baseline", help="A baseline file written with --write_baseline to compare efficiencies against", metavar="FILE")
+    parser.add_argument('--write_baseline', dest="write_baseline", help="Write efficiencies to this file for use as a baseline", metavar="FILE")
+    parser.add_argument('--tolerance', dest="tolerance", help="Largest allowed drop in parallel efficiency relative to the baseline (default 0.05)", type=float, default=0.05)
+
+    args = parser.parse_args()
+
+    if args.counts is None:
+        counts = [get_run_count(directory) for directory in
+                  args.run_directories]
+    else:
+        counts = [int(count) for count in args.counts.split(',')]
+        if len(counts) != len(args.run_directories):
+            parser.error("The number of counts must match the number of run "
+                         "directories.")
+
+    results = {}
+    for timer_name in args.timers:
+        runs = compute_scaling(timer_name, args.run_directories, counts,
+                               args.weak)
+        if len(runs) > 0:
+            results[timer_name] = runs
+
+    write_table(results, sys.stdout)
+
+    if args.out_prefix is not None:
+        table_file = open('%s.txt'%args.out_prefix, 'w')
+        write_table(results, table_file)
+        table_file.close()
+        for timer_name in results:
+            plot_scaling(timer_name, results[timer_name], args.weak,
+                         args.out_prefix)
+
+    if args.write_baseline is not None:
+        efficiencies = {}
+        for timer_name in results:
+            efficiencies[timer_name] = {}
+            for run in results[timer_name]:
+                efficiencies[timer_name]['%i'%run['count']] = \
+                    run['efficiency']
+        baseline_file = open(args.write_baseline, 'w')
+        json.dump(efficiencies, baseline_file, indent=4, sort_keys=True)
+        baseline_file.close()
+
+    if args.baseline is not None:
+        if not os.path.exists(args.baseline):
+            print("WARNING: Baseline file %s does not exist. Skipping "
+                  "comparison."%(args.baseline))
+            sys.exit(0)
+        baseline_file = open(args.baseline, 'r')
+        baseline = json.load(baseline_file)
+        baseline_file.close()
+
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if len(regressions) > 0:
+            print("")
+            print("Timers whose scaling got worse than the baseline:")
+            for timer_name, count, base_efficiency, efficiency in regressions:
+                print("   %s at count %i: efficiency %.3f (baseline %.3f)"%(
+                    timer_name, count, efficiency, base_efficiency))
+            sys.exit(1)
+        print("")
+        print("Parallel efficiency is within %g of the baseline for all "
+              "timers."%(args.tolerance))
+
+    sys.exit(0)
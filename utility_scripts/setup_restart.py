@@ -14,10 +14,11 @@ and subsequent runs continuing from a restart file.
 from __future__ import absolute_import, division, print_function, \
     unicode_literals
 
-import os
 import argparse
 import sys
 
+from restart_chain import set_restart
+
 parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
 parser.add_argument("-f", "--fileName", dest="fileName", help="A namelist file to be changed to restart mode", metavar="FILE", required=True)
 parser.add_argument("-s", "--startTime", dest="startTime", help="The new value to assign to config_start_time (default is 'file')", metavar="STARTTIME")
@@ -28,28 +29,6 @@ args = parser.parse_args()
 if args.startTime is None:
     args.startTime = "'file'"
 
-lines = []
-restartPointer = 'Restart_timestamp'
-inFile = open(args.fileName, 'r')
-for line in inFile:
-    if 'config_restart_timestamp_name' in line:
-        restartPointer = line.split("=")[-1]
-        restartPointer = restartPointer.lstrip(" \t'")
-        restartPointer = restartPointer.rstrip(" \t\n'")
-    lines.append(line)
-inFile.close()
-
-if not os.path.exists(restartPointer):
-    # nothing to do
-    sys.exit(0)
-
-outFile = open(args.fileName, 'w')
-for line in lines:
-    if 'config_do_restart' in line:
-        line = "    config_do_restart = .true.\n"
-    if 'config_start_time' in line:
-        line = "    config_start_time = %s\n"%args.startTime
-    outFile.write(line)
-outFile.close()
+set_restart(args.fileName, args.startTime)
 
 sys.exit(0)